@@ -0,0 +1,211 @@
+"""Token authentication with the token to user lookups cached.
+
+Resolved tokens are kept in a bounded per-process LRU cache for ``TTL``
+seconds and in the ``SHARED_CACHE`` Django cache for ``SHARED_TTL``
+seconds, so fresh processes do not hit the database either. Both tiers
+store every token under its revocation stamp, kept in the shared cache and
+read on every lookup, local hits included. Deleting a token (logging out)
+or saving its user (deactivating) bumps the stamp, so every process drops
+the token at once. ``QuerySet.update()`` sends no signal, call
+``accounts.utils.invalidate_user_tokens`` after it.
+
+Without a shared cache no process could learn about revocations, so
+nothing is cached. A local-memory ``SHARED_CACHE`` is only shared by the
+threads of one process: enough for ``runserver`` and the tests, wrong with
+several workers, which is why the production settings refuse local-memory
+caches.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULTS = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 10.0,
+    'SHARED_CACHE': None,
+    'SHARED_TTL': 300.0,
+}
+
+# (user, token), as returned by ``authenticate_credentials``.
+Credentials = Tuple[object, object]
+
+
+def get_token_cache_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_CACHE', {})}
+
+
+class TokenCacheStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def record_hit(self, is_shared: bool):
+        with self.lock:
+            if is_shared:
+                self.shared_hits += 1
+            else:
+                self.hits += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def record_invalidations(self, count: int):
+        with self.lock:
+            self.invalidations += count
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': (
+                    (self.hits + self.shared_hits) / lookups if lookups else 0.0
+                ),
+            }
+
+
+stats = TokenCacheStats()
+
+
+def get_shared_key(key: str) -> str:
+    # Token keys are credentials, keep them out of the shared cache.
+    return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_stamp_key(key: str) -> str:
+    return f'auth-token-stamp:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+class TokenLookup(NamedTuple):
+    credentials: Optional[Credentials]
+    # Revocation stamp read before the lookup, to cache what the database
+    # returns under. None when nothing may be cached.
+    stamp: Optional[int]
+
+
+class TokenCache:
+    """Process-local LRU of resolved tokens, validated against revocation
+    stamps in a shared Django cache."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Tuple[float, int, Credentials]]' = (
+            OrderedDict()
+        )
+
+    def get_shared_cache(self):
+        alias = get_token_cache_settings()['SHARED_CACHE']
+        return None if alias is None else caches[alias]
+
+    @staticmethod
+    def get_stamp(shared_cache, key: str) -> int:
+        stamp = shared_cache.get(get_stamp_key(key))
+        if stamp is None:
+            # A fresh stamp starts from the clock, so entries cached under
+            # an evicted stamp can never be served again.
+            shared_cache.add(get_stamp_key(key), time.time_ns(), timeout=None)
+            stamp = shared_cache.get(get_stamp_key(key), time.time_ns())
+        return stamp
+
+    def get(self, key: str) -> TokenLookup:
+        shared_cache = self.get_shared_cache()
+        if shared_cache is None:
+            # Nothing would tell this process about revocations.
+            stats.record_miss()
+            return TokenLookup(None, None)
+        stamp = self.get_stamp(shared_cache, key)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, entry_stamp, credentials = entry
+                if expires_at > now and entry_stamp == stamp:
+                    self.entries.move_to_end(key)
+                    stats.record_hit(is_shared=False)
+                    return TokenLookup(credentials, stamp)
+                del self.entries[key]
+        entry = shared_cache.get(get_shared_key(key))
+        if entry is not None and entry[0] == stamp:
+            stats.record_hit(is_shared=True)
+            self.set_local(key, entry[1], stamp)
+            return TokenLookup(entry[1], stamp)
+        stats.record_miss()
+        return TokenLookup(None, stamp)
+
+    def set_local(self, key: str, credentials: Credentials, stamp: int):
+        cache_settings = get_token_cache_settings()
+        with self.lock:
+            self.entries[key] = (
+                time.monotonic() + cache_settings['TTL'], stamp, credentials,
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > cache_settings['MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+
+    def set(self, key: str, credentials: Credentials, stamp: Optional[int]):
+        shared_cache = self.get_shared_cache()
+        if shared_cache is None or stamp is None:
+            return
+        self.set_local(key, credentials, stamp)
+        shared_cache.set(
+            get_shared_key(key),
+            (stamp, credentials),
+            get_token_cache_settings()['SHARED_TTL'],
+        )
+
+    def revoke(self, keys: Iterable[str]):
+        shared_cache = self.get_shared_cache()
+        if shared_cache is None:
+            return
+        for key in keys:
+            try:
+                shared_cache.incr(get_stamp_key(key))
+            except ValueError:
+                shared_cache.set(get_stamp_key(key), time.time_ns(),
+                                 timeout=None)
+
+    def invalidate(self, keys: Iterable[str]):
+        """Revoke the cached tokens now, and again once the current
+        transaction commits: a lookup that read the database before the
+        commit must not be served under the new stamp."""
+        keys = list(keys)
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        self.revoke(keys)
+        transaction.on_commit(lambda: self.revoke(keys))
+        stats.record_invalidations(len(keys))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` that only queries the database for tokens
+    missing from ``token_cache``."""
+
+    def authenticate_credentials(self, key):
+        credentials, stamp = token_cache.get(key)
+        if credentials is not None:
+            return credentials
+        credentials = super().authenticate_credentials(key)
+        token_cache.set(key, credentials, stamp)
+        return credentials
@@ -0,0 +1,50 @@
+"""Password hashing across a process pool.
+
+PBKDF2 holds the GIL, so threads do not help. Workers are spawned rather
+than forked, because the web servers run threads, and they only import
+this module, so they start without loading the apps.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Sequence
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+DEFAULTS = {
+    'HASH_WORKERS': None,
+    'CHUNK_SIZE': 1000,
+    'MAX_BULK_USERS': 1000,
+}
+
+
+def get_provisioning_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'USER_PROVISIONING', {})}
+
+
+def get_hash_workers() -> int:
+    workers = get_provisioning_settings()['HASH_WORKERS']
+    if workers is None:
+        return os.cpu_count() or 1
+    return workers
+
+
+@lru_cache(maxsize=None)
+def get_hash_executor(max_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+def hash_passwords(passwords: Sequence[str]) -> List[str]:
+    """``make_password`` of every password, in order. Hashed in this
+    process when ``HASH_WORKERS`` is 0 or there is a single password."""
+    workers = get_hash_workers()
+    if workers == 0 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(get_hash_executor(workers).map(
+        make_password, passwords, chunksize=chunksize,
+    ))
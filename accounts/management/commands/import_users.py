@@ -0,0 +1,81 @@
+import csv
+from typing import List
+from django.core.management.base import BaseCommand
+from accounts.hashing import get_provisioning_settings
+from accounts.serializers import UserProvisionSerializer
+from accounts.utils import bulk_create_users, find_taken_fields
+from application.imports import (
+    InvalidRow, add_input_arguments, get_input_format, open_input,
+    read_chunks,
+)
+
+
+class Command(BaseCommand):
+    help = ('Create users from a CSV (username, password, email, first_name, '
+            'last_name columns) or NDJSON file, in chunks.')
+
+    def add_arguments(self, parser):
+        add_input_arguments(parser)
+        parser.add_argument('--chunk-size', type=int,
+                            default=get_provisioning_settings()['CHUNK_SIZE'])
+        parser.add_argument('--tokens-output',
+                            help='Create auth tokens and write them to this '
+                                 'file as username,token rows.')
+
+    def handle(self, *args, **options):
+        tokens_writer = None
+        tokens_file = None
+        if options['tokens_output']:
+            # pylint: disable=consider-using-with
+            tokens_file = open(options['tokens_output'], 'w', newline='',
+                               encoding='utf-8')
+            tokens_writer = csv.writer(tokens_file)
+        try:
+            with open_input(options['path']) as stream:
+                self.import_stream(stream, get_input_format(options),
+                                   tokens_writer, options)
+        finally:
+            if tokens_file is not None:
+                tokens_file.close()
+
+    def import_stream(self, stream, input_format, tokens_writer, options):
+        created_count = 0
+        skipped_count = 0
+        for chunk in read_chunks(stream, input_format, options['chunk_size']):
+            valid_users = self.validate_chunk(chunk)
+            skipped_count += len(chunk) - len(valid_users)
+            if not valid_users:
+                continue
+            created = bulk_create_users(
+                valid_users,
+                create_tokens=tokens_writer is not None,
+                chunk_size=options['chunk_size'],
+            )
+            created_count += len(created)
+            if tokens_writer is not None:
+                tokens_writer.writerows(
+                    (user.username, token.key) for user, token in created
+                )
+        self.stdout.write(
+            f'Created {created_count} users, skipped {skipped_count} rows'
+        )
+
+    def validate_chunk(self, chunk) -> List[dict]:
+        valid_rows = []
+        for number, row in chunk:
+            if isinstance(row, InvalidRow):
+                self.stderr.write(f'Row {number} skipped: {row.error}')
+                continue
+            serializer = UserProvisionSerializer(data=row)
+            if serializer.is_valid():
+                valid_rows.append((number, serializer.validated_data))
+            else:
+                self.stderr.write(f'Row {number} skipped: {serializer.errors}')
+        errors = find_taken_fields([user for _, user in valid_rows])
+        valid_users = []
+        for (number, user), user_errors in zip(valid_rows, errors):
+            if user_errors:
+                self.stderr.write(f'Row {number} skipped: {user_errors}')
+            else:
+                valid_users.append(user)
+        return valid_users
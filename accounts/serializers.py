@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth import get_user_model, password_validation
+from .hashing import get_provisioning_settings
+from .utils import find_taken_fields
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -46,14 +48,62 @@ class RegistrationSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user = get_user_model().objects.create(
+        return get_user_model().objects.create_user(
             username=validated_data['username'],
             email=validated_data['email'],
+            password=validated_data['password'],
             first_name=validated_data['first_name'],
             last_name=validated_data['last_name']
         )
 
-        user.set_password(validated_data['password'])
-        user.save()
 
-        return user
+class UserProvisionSerializer(serializers.ModelSerializer):
+    """One user of a bulk registration. Uniqueness is checked for the
+    whole batch by ``BulkRegistrationSerializer``."""
+    username = serializers.CharField(max_length=50, required=True)
+    email = serializers.EmailField(required=True)
+    password = serializers.CharField(
+        write_only=True,
+        required=True,
+        validators=[password_validation.validate_password]
+    )
+
+    class Meta:
+        model = get_user_model()
+        fields = (
+            'username',
+            'password',
+            'email',
+            'first_name',
+            'last_name'
+        )
+        extra_kwargs = {
+            'first_name': {'required': True},
+            'last_name': {'required': True}
+        }
+
+
+class BulkRegistrationSerializer(serializers.Serializer):
+    users = serializers.ListSerializer(
+        child=UserProvisionSerializer(),
+        allow_empty=False
+    )
+    create_tokens = serializers.BooleanField(default=False)
+
+    def validate_users(self, users):
+        max_users = get_provisioning_settings()['MAX_BULK_USERS']
+        if len(users) > max_users:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {max_users} elements.'
+            )
+        errors = find_taken_fields(users)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return users
+
+
+class ProvisionedUserSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    username = serializers.CharField()
+    email = serializers.EmailField()
+    token = serializers.CharField(allow_null=True)
@@ -1,7 +1,20 @@
+import csv
+import json
+import tempfile
+from io import StringIO
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import caches
+from django.test import override_settings
+from .authentication import (
+    CachedTokenAuthentication, TokenCache, token_cache,
+    stats as token_cache_stats,
+)
+from .utils import invalidate_user_tokens
 
 User = get_user_model()
 
@@ -17,6 +30,7 @@ class AuthSystemTest(APITestCase):
         self.created_user_token = str(
             Token.objects.create(user=self.created_user)
         )
+        token_cache.clear()
 
     def test_registration_success(self):
         url = '/auth/register/'
@@ -76,3 +90,181 @@ class AuthSystemTest(APITestCase):
         )
         response = self.client.delete(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_cached_token_authentication(self):
+        authentication = CachedTokenAuthentication()
+        hits_before = token_cache_stats.as_dict()['hits']
+        with self.assertNumQueries(1):
+            user, _ = authentication.authenticate_credentials(
+                self.created_user_token)
+        with self.assertNumQueries(0):
+            cached_user, _ = authentication.authenticate_credentials(
+                self.created_user_token)
+        self.assertEqual(user, cached_user)
+        self.assertEqual(token_cache_stats.as_dict()['hits'], hits_before + 1)
+        self.assertGreater(token_cache_stats.as_dict()['hit_rate'], 0)
+
+    def test_cached_token_logout(self):
+        url = '/auth/logout/'
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.created_user_token}'
+        )
+        response = self.client.delete(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_token_deactivation(self):
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.created_user_token)
+        self.created_user.is_active = False
+        self.created_user.save()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.created_user_token)
+
+    def test_cached_token_bulk_deactivation(self):
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.created_user_token)
+        User.objects.filter(pk=self.created_user.pk).update(is_active=False)
+        invalidate_user_tokens([self.created_user.pk])
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.created_user_token)
+
+    def test_cached_token_revoked_by_other_process(self):
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.created_user_token)
+        # Another worker, sharing nothing but the shared cache.
+        TokenCache().invalidate([self.created_user_token])
+        self.assertIsNone(token_cache.get(self.created_user_token).credentials)
+        with self.assertNumQueries(1):
+            authentication.authenticate_credentials(self.created_user_token)
+
+    def test_request_after_revocation_by_other_process(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.created_user_token}'
+        )
+        CachedTokenAuthentication().authenticate_credentials(
+            self.created_user_token)
+        # Another worker deactivates the user: no signal reaches this
+        # process, only the revocation stamp in the shared cache.
+        User.objects.filter(pk=self.created_user.pk).update(is_active=False)
+        TokenCache().invalidate([self.created_user_token])
+        response = self.client.delete('/auth/logout/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_CACHE={'SHARED_CACHE': None})
+    def test_cached_token_without_shared_tier(self):
+        authentication = CachedTokenAuthentication()
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                authentication.authenticate_credentials(
+                    self.created_user_token)
+
+    @override_settings(TOKEN_CACHE={'SHARED_CACHE': 'default'})
+    def test_cached_token_shared_tier(self):
+        caches['default'].clear()
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.created_user_token)
+        token_cache.clear()
+        shared_hits_before = token_cache_stats.as_dict()['shared_hits']
+        with self.assertNumQueries(0):
+            user, _ = authentication.authenticate_credentials(
+                self.created_user_token)
+        self.assertEqual(user, self.created_user)
+        self.assertEqual(token_cache_stats.as_dict()['shared_hits'],
+                         shared_hits_before + 1)
+        Token.objects.filter(user=self.created_user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.created_user_token)
+
+
+class BulkProvisioningTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_user(
+            username='admin',
+            password='123456qwerty',
+            email='admin@test.com',
+            is_staff=True,
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.admin)}'
+        )
+        self.users = [
+            {
+                'username': f'employee_{index}',
+                'password': f'Secret-pass-{index}',
+                'email': f'employee_{index}@test.com',
+                'first_name': 'test',
+                'last_name': 'test',
+            }
+            for index in range(3)
+        ]
+
+    @override_settings(USER_PROVISIONING={'HASH_WORKERS': 2})
+    def test_bulk_registration(self):
+        url = '/auth/register/bulk/'
+        response = self.client.post(
+            url, {'users': self.users, 'create_tokens': True}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([user['username'] for user in response.data],
+                         [user['username'] for user in self.users])
+        user = User.objects.get(username='employee_1')
+        self.assertTrue(user.check_password('Secret-pass-1'))
+        self.assertEqual(response.data[1]['token'], user.auth_token.key)
+
+    def test_bulk_registration_unique(self):
+        url = '/auth/register/bulk/'
+        self.users[1]['username'] = 'admin'
+        self.users[2]['email'] = self.users[0]['email']
+        response = self.client.post(url, {'users': self.users}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['users'], [
+            {},
+            {'username': ['This field must be unique.']},
+            {'email': ['This field must be unique.']},
+        ])
+        self.assertFalse(User.objects.filter(username='employee_0').exists())
+
+    def test_bulk_registration_admin_only(self):
+        user = User.objects.create_user(username='user', password='123456qwerty')
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}'
+        )
+        response = self.client.post('/auth/register/bulk/',
+                                    {'users': self.users}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_users(self):
+        self.users[2]['username'] = 'admin'
+        self.users[1]['password'] = '123'
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as users_file, \
+                tempfile.NamedTemporaryFile('r', suffix='.csv') as tokens_file:
+            writer = csv.DictWriter(users_file, fieldnames=list(self.users[0]))
+            writer.writeheader()
+            writer.writerows(self.users)
+            users_file.flush()
+            stdout = StringIO()
+            call_command('import_users', users_file.name,
+                         tokens_output=tokens_file.name,
+                         stdout=stdout, stderr=StringIO())
+            tokens = list(csv.reader(tokens_file))
+        self.assertIn('Created 1 users, skipped 2 rows', stdout.getvalue())
+        user = User.objects.get(username='employee_0')
+        self.assertEqual(tokens, [['employee_0', user.auth_token.key]])
+
+    def test_import_users_ndjson(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as users_file:
+            users_file.write(f'{json.dumps(self.users[0])}\nnot json\n'
+                             f'"employee"\n{json.dumps(self.users[1])}\n')
+            users_file.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_users', users_file.name,
+                         stdout=stdout, stderr=stderr)
+        self.assertIn('Created 2 users, skipped 2 rows', stdout.getvalue())
+        self.assertIn('Row 2 skipped: Invalid JSON', stderr.getvalue())
+        self.assertIn('Row 3 skipped: Expected a JSON object.',
+                      stderr.getvalue())
+        self.assertEqual(User.objects.filter(
+            username__in=['employee_0', 'employee_1']).count(), 2)
@@ -1,9 +1,10 @@
 from django.urls import path
 from rest_framework.authtoken.views import ObtainAuthToken
-from .views import UserRegistrationView, LogoutView
+from .views import UserRegistrationView, BulkUserRegistrationView, LogoutView
 
 urlpatterns = [
     path('login/', ObtainAuthToken.as_view()),
     path('register/', UserRegistrationView.as_view()),
+    path('register/bulk/', BulkUserRegistrationView.as_view()),
     path('logout/', LogoutView.as_view()),
 ]
@@ -0,0 +1,81 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .hashing import hash_passwords
+
+UNIQUE_ERROR = 'This field must be unique.'
+
+
+def invalidate_user_tokens(user_ids: Iterable[int]):
+    """Drop the cached tokens of changed users. Saving a user does it,
+    changes made with ``QuerySet.update()`` have to call it."""
+    token_cache.invalidate(
+        Token.objects.filter(user__in=user_ids).values_list('key', flat=True)
+    )
+
+
+def find_taken_fields(users: List[dict]) -> List[Dict[str, List[str]]]:
+    """Errors of every user whose username or email is already taken, by
+    another user of the batch or, checked with one query, in the database.
+    Empty dicts for the users that are free."""
+    usernames = [user['username'] for user in users]
+    emails = [user['email'] for user in users]
+    taken = get_user_model().objects.filter(
+        Q(username__in=usernames) | Q(email__in=emails)
+    ).values_list('username', 'email')
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+    errors = []
+    for user in users:
+        user_errors = {}
+        for field, taken_values in (('username', taken_usernames),
+                                    ('email', taken_emails)):
+            if user[field] in taken_values:
+                user_errors[field] = [UNIQUE_ERROR]
+            taken_values.add(user[field])
+        errors.append(user_errors)
+    return errors
+
+
+def bulk_create_users(users: Iterable[dict], create_tokens: bool = False,
+                      chunk_size: int = 1000,
+                      ) -> List[Tuple[object, Optional[Token]]]:
+    """Create validated ``UserProvisionSerializer`` data with hashed
+    passwords, and an auth token each if ``create_tokens``, with chunked
+    INSERTs. Returns the ``(user, token)`` pairs.
+
+    Passwords are hashed before the transaction starts, so it is not held
+    open while they are.
+    """
+    users = list(users)
+    passwords = hash_passwords([user['password'] for user in users])
+    with transaction.atomic():
+        return insert_users(users, passwords, create_tokens, chunk_size)
+
+
+def insert_users(users: List[dict], passwords: List[str], create_tokens: bool,
+                 chunk_size: int) -> List[Tuple[object, Optional[Token]]]:
+    user_model = get_user_model()
+    created_users = user_model.objects.bulk_create(
+        (
+            user_model(
+                username=user['username'],
+                email=user['email'],
+                first_name=user['first_name'],
+                last_name=user['last_name'],
+                password=password,
+            )
+            for user, password in zip(users, passwords)
+        ),
+        batch_size=chunk_size,
+    )
+    if not create_tokens:
+        return [(user, None) for user in created_users]
+    tokens = Token.objects.bulk_create(
+        (Token(user=user, key=Token.generate_key()) for user in created_users),
+        batch_size=chunk_size,
+    )
+    return list(zip(created_users, tokens))
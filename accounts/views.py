@@ -1,13 +1,53 @@
 from rest_framework.generics import CreateAPIView, DestroyAPIView
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import RegistrationSerializer
+from drf_yasg.utils import swagger_auto_schema
+from .hashing import get_provisioning_settings
+from .serializers import (
+    RegistrationSerializer, BulkRegistrationSerializer,
+    ProvisionedUserSerializer,
+)
+from .utils import bulk_create_users
 
 
 class UserRegistrationView(CreateAPIView):
     serializer_class = RegistrationSerializer
 
 
+class BulkUserRegistrationView(CreateAPIView):
+    serializer_class = BulkRegistrationSerializer
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_201_CREATED: ProvisionedUserSerializer(many=True)
+        }
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = bulk_create_users(
+            serializer.validated_data['users'],
+            create_tokens=serializer.validated_data['create_tokens'],
+            chunk_size=get_provisioning_settings()['CHUNK_SIZE'],
+        )
+        response_serializer = ProvisionedUserSerializer(
+            [
+                {
+                    'id': user.pk,
+                    'username': user.username,
+                    'email': user.email,
+                    'token': token.key if token else None,
+                }
+                for user, token in created
+            ],
+            many=True,
+        )
+        return Response(response_serializer.data,
+                        status=status.HTTP_201_CREATED)
+
+
 class LogoutView(DestroyAPIView):
 
     def destroy(self, request, *args, **kwargs):
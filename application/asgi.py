@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'application.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# pylint: disable=wrong-import-position
+from voting_app.live import LiveResultsASGIMiddleware  # noqa: E402
+
+application = LiveResultsASGIMiddleware(django_application)
@@ -0,0 +1,156 @@
+"""PostgreSQL backend for the production profile.
+
+Adds two things to Django 3.2's backend:
+
+- ``CONN_HEALTH_CHECKS``, backported from Django 4.1: a persistent
+  connection is checked once before it is reused by a new request, so a
+  connection dropped by the server or a proxy fails over to a fresh one
+  instead of failing the request.
+- An optional in-process connection pool, ``POOL = {'MAX_SIZE',
+  'TIMEOUT'}``: closing a connection hands it back to the pool, so threads
+  that come and go (ASGI, thread pools) reuse connections too. Use it with
+  ``CONN_MAX_AGE = 0``. Pools are per process, so they are never shared
+  with forked workers.
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+POOL_DEFAULTS = {
+    'MAX_SIZE': 10,
+    'TIMEOUT': 10.0,
+}
+
+
+class ConnectionPool:
+    """Up to ``max_size`` connections, opened on demand and kept open once
+    returned. Borrowers wait up to ``timeout`` seconds for a free one."""
+
+    def __init__(self, max_size: int, timeout: float, conn_params: dict):
+        self.conn_params = conn_params
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle: List = []
+
+    def getconn(self):
+        # pylint: disable=consider-using-with
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f'No free pooled connection within {self.timeout}s')
+        try:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop()
+            return psycopg2.connect(**self.conn_params)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            if connection.closed:
+                return
+            status = connection.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                connection.close()
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self.lock:
+                self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+pools: Dict[Tuple[int, str], ConnectionPool] = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, settings_dict: dict,
+             conn_params: dict) -> Optional[ConnectionPool]:
+    if not settings_dict.get('POOL'):
+        return None
+    pool_settings = {**POOL_DEFAULTS, **settings_dict['POOL']}
+    key = (os.getpid(), alias)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                pool_settings['MAX_SIZE'],
+                pool_settings['TIMEOUT'],
+                conn_params,
+            )
+        return pools[key]
+
+
+def close_pools():
+    """Close the idle pooled connections of this process."""
+    with pools_lock:
+        process_pools = [pool for (pid, _), pool in pools.items()
+                         if pid == os.getpid()]
+    for pool in process_pools:
+        pool.close_idle()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get(
+            'CONN_HEALTH_CHECKS', False)
+        self.health_check_done = False
+        self.pool = None
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def get_new_connection(self, conn_params):
+        # pylint: disable=attribute-defined-outside-init
+        self.pool = get_pool(self.alias, self.settings_dict, conn_params)
+        if self.pool is None:
+            return super().get_new_connection(conn_params)
+        connection = self.pool.getconn()
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            return self.pool.putconn(self.connection)
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_health_check_failed(self):
+        if (self.connection is None or not self.health_check_enabled
+                or self.health_check_done):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # Runs at the start and end of every request.
+        if self.connection is not None:
+            self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
@@ -0,0 +1,130 @@
+"""Read replica routing with read-your-writes pinning.
+
+ORM reads go to one of ``DATABASE_ROUTING['REPLICAS']``, writes to the
+primary. Reads still go to the primary:
+
+- inside a transaction on the primary, so a transaction sees its own rows;
+- for related objects of an instance loaded from the primary;
+- for the ``PRIMARY_APPS`` (users, tokens, sessions), so a logout or a
+  deactivation is never undone by replication lag, and for the
+  ``DatabaseCache`` table, which holds the pins, result versions and token
+  revocation stamps when it backs a cache;
+- within ``primary()``;
+- for the whole of every unsafe request (POST, PATCH, ...), and for every
+  request of the same client for ``PIN_SECONDS`` after a successful one, so
+  clients immediately see their own writes.
+
+Clients are told apart by their ``Authorization`` header or session
+cookie. With several processes, point ``PIN_CACHE`` at a shared cache.
+Raw SQL through ``django.db.connection`` always runs on the primary.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from .middleware import HybridMiddleware
+
+DEFAULTS = {
+    'PRIMARY': 'default',
+    'REPLICAS': [],
+    'PRIMARY_APPS': ['auth', 'authtoken', 'sessions', 'django_cache'],
+    'PIN_SECONDS': 5.0,
+    'PIN_CACHE': 'default',
+}
+
+use_primary = ContextVar('use_primary', default=False)
+
+
+def get_routing_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+@contextmanager
+def primary():
+    """Send the reads of the block to the primary."""
+    token = use_primary.set(True)
+    try:
+        yield
+    finally:
+        use_primary.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        routing = get_routing_settings()
+        instance = hints.get('instance')
+        # pylint: disable=protected-access
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if (not routing['REPLICAS'] or use_primary.get()
+                or model._meta.app_label in routing['PRIMARY_APPS']
+                or connections[routing['PRIMARY']].in_atomic_block):
+            return routing['PRIMARY']
+        return random.choice(routing['REPLICAS'])
+
+    def db_for_write(self, model, **hints):
+        # pylint: disable=unused-argument
+        return get_routing_settings()['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # pylint: disable=unused-argument
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+def get_pin_key(request) -> Optional[str]:
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    return f'primary-pin:{hashlib.sha256(credentials.encode()).hexdigest()}'
+
+
+class PrimaryPinningMiddleware(HybridMiddleware):
+
+    def handle(self, request):
+        routing = get_routing_settings()
+        if not routing['REPLICAS']:
+            return self.get_response(request)
+        pin_cache = caches[routing['PIN_CACHE']]
+        pin_key = get_pin_key(request)
+        is_write = request.method not in SAFE_METHODS
+        is_pinned = is_write or (pin_key is not None
+                                 and pin_cache.get(pin_key) is not None)
+        token = use_primary.set(is_pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_primary.reset(token)
+        if is_write and pin_key is not None and response.status_code < 400:
+            pin_cache.set(pin_key, True, routing['PIN_SECONDS'])
+        return response
+
+    async def ahandle(self, request):
+        routing = get_routing_settings()
+        if not routing['REPLICAS']:
+            return await self.get_response(request)
+        # Cache backends are sync and may query the database.
+        pin_cache = caches[routing['PIN_CACHE']]
+        pin_key = get_pin_key(request)
+        is_write = request.method not in SAFE_METHODS
+        is_pinned = is_write or (
+            pin_key is not None
+            and await sync_to_async(pin_cache.get)(pin_key) is not None
+        )
+        token = use_primary.set(is_pinned)
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_primary.reset(token)
+        if is_write and pin_key is not None and response.status_code < 400:
+            await sync_to_async(pin_cache.set)(pin_key, True,
+                                               routing['PIN_SECONDS'])
+        return response
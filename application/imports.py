@@ -0,0 +1,69 @@
+"""Input files of the bulk import commands, ``import_surveys`` and
+``import_users``: CSV or NDJSON, from a path or stdin, read in numbered
+chunks."""
+import contextlib
+import csv
+import json
+import sys
+from itertools import islice
+from typing import (
+    Callable, Iterable, Iterator, List, NamedTuple, Tuple, Union,
+)
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+
+class InvalidRow(NamedTuple):
+    error: str
+
+
+Row = Union[dict, InvalidRow]
+
+
+def add_input_arguments(parser):
+    parser.add_argument('path', help='Input file, or - for stdin.')
+    parser.add_argument('--format', choices=(CSV, NDJSON),
+                        help='Defaults to the file extension.')
+
+
+def get_input_format(options) -> str:
+    return options['format'] or (
+        NDJSON if options['path'].endswith(('.ndjson', '.jsonl')) else CSV
+    )
+
+
+@contextlib.contextmanager
+def open_input(path: str):
+    if path == '-':
+        yield sys.stdin
+        return
+    with open(path, newline='', encoding='utf-8') as stream:
+        yield stream
+
+
+def read_ndjson(stream) -> Iterator[Row]:
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield InvalidRow(f'Invalid JSON: {error}')
+            continue
+        yield row if isinstance(row, dict) else InvalidRow(
+            'Expected a JSON object.')
+
+
+def read_chunks(stream, input_format: str, chunk_size: int,
+                read_csv: Callable[..., Iterable[dict]] = csv.DictReader,
+                ) -> Iterator[List[Tuple[int, Row]]]:
+    """``(row number, row)`` pairs, ``chunk_size`` at a time. CSV rows are
+    read by ``read_csv(stream)``."""
+    rows = read_csv(stream) if input_format == CSV else read_ndjson(stream)
+    numbered_rows = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(numbered_rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from application.schema import (
+    CODECS, get_code_version, get_schema_path, render_schema_document,
+    write_schema_document,
+)
+
+
+class Command(BaseCommand):
+    help = ('Write the OpenAPI schema of the current code version, so the '
+            'app servers do not have to generate it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir',
+                            help="Defaults to OPENAPI_SCHEMA['CACHE_DIR'].")
+
+    def handle(self, *args, **options):
+        code_version = get_code_version()
+        for schema_format in CODECS:
+            path = get_schema_path(code_version, schema_format,
+                                   options['output_dir'])
+            if path is None:
+                raise CommandError('No --output-dir or CACHE_DIR to write to')
+            write_schema_document(
+                path, render_schema_document(code_version, schema_format))
+            self.stdout.write(f'Wrote {path}')
@@ -0,0 +1,31 @@
+"""Base of the project middleware, native under both WSGI and ASGI."""
+import asyncio
+
+
+class HybridMiddleware:
+    """Runs ``handle`` when the rest of the chain is sync and ``ahandle``
+    when it is async, like Django's ``MiddlewareMixin``.
+
+    A sync-only middleware would make Django run every ASGI request,
+    async views included, in a thread for its whole duration.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells the handler that calling us returns a coroutine.
+            # pylint: disable=protected-access
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.ahandle(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def ahandle(self, request):
+        raise NotImplementedError
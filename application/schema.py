@@ -0,0 +1,163 @@
+"""Precomputed OpenAPI schema.
+
+Introspecting every view and serializer takes a while, so the schema is
+generated once per code version: by ``manage.py generate_schema`` at build
+time, or on the first request. The documents are kept in memory and, when
+``CACHE_DIR`` is set, in files named after the code version. They are
+served with an ETag and ``MAX_AGE`` cache headers.
+"""
+import hashlib
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+import drf_yasg
+import rest_framework
+from django.apps import apps
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+DEFAULTS = {
+    'CODE_VERSION': None,
+    'CACHE_DIR': None,
+    'MAX_AGE': 3600,
+}
+
+SCHEMA_JSON = 'json'
+SCHEMA_YAML = 'yaml'
+
+CODECS = {
+    SCHEMA_JSON: (OpenAPICodecJson, 'application/openapi+json'),
+    SCHEMA_YAML: (OpenAPICodecYaml, 'application/yaml'),
+}
+
+schema_info = openapi.Info(
+    title="Surveys API",
+    default_version='v1',
+)
+
+
+def get_schema_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'OPENAPI_SCHEMA', {})}
+
+
+@lru_cache(maxsize=None)
+def get_code_version() -> str:
+    """``CODE_VERSION`` if set, e.g. to the commit of the build, otherwise
+    a digest of the project sources and of the schema libraries."""
+    code_version = get_schema_settings()['CODE_VERSION']
+    if code_version:
+        return code_version
+    base_dir = Path(settings.BASE_DIR)
+    source_dirs = {base_dir / settings.ROOT_URLCONF.split('.')[0]}
+    source_dirs.update(
+        Path(app_config.path) for app_config in apps.get_app_configs()
+        if base_dir in Path(app_config.path).parents
+    )
+    digest = hashlib.sha1(
+        f'{drf_yasg.__version__}:{rest_framework.VERSION}'.encode()
+    )
+    for path in sorted(
+            path for source_dir in source_dirs
+            for path in source_dir.rglob('*.py')):
+        digest.update(str(path.relative_to(base_dir)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def get_schema(code_version: str) -> openapi.Swagger:
+    # Public and without a request, so the schema is the same for everyone.
+    del code_version
+    return OpenAPISchemaGenerator(schema_info).get_schema(None, public=True)
+
+
+def get_schema_path(code_version: str, schema_format: str,
+                    cache_dir: Optional[str] = None) -> Optional[Path]:
+    cache_dir = cache_dir or get_schema_settings()['CACHE_DIR']
+    if cache_dir is None:
+        return None
+    return Path(cache_dir) / f'openapi-{code_version}.{schema_format}'
+
+
+def write_schema_document(path: Path, document: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so readers never see half a document.
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        file.write(document)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+def render_schema_document(code_version: str, schema_format: str) -> bytes:
+    codec_class, _ = CODECS[schema_format]
+    return codec_class(validators=[]).encode(get_schema(code_version))
+
+
+@lru_cache(maxsize=None)
+def get_schema_document(code_version: str, schema_format: str) -> bytes:
+    path = get_schema_path(code_version, schema_format)
+    if path is not None and path.exists():
+        return path.read_bytes()
+    document = render_schema_document(code_version, schema_format)
+    if path is not None:
+        try:
+            write_schema_document(path, document)
+        except OSError:
+            pass
+    return document
+
+
+def schema_document_response(request, schema_format: str) -> HttpResponse:
+    code_version = get_code_version()
+    etag = f'"{code_version}-{schema_format}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        _, content_type = CODECS[schema_format]
+        response = HttpResponse(
+            get_schema_document(code_version, schema_format),
+            content_type=content_type,
+        )
+    response['ETag'] = etag
+    patch_cache_control(response, public=True,
+                        max_age=get_schema_settings()['MAX_AGE'])
+    return response
+
+
+class PrecomputedSchemaGenerator(OpenAPISchemaGenerator):
+    """Hands the schema of the current code version to the UI views."""
+
+    def get_schema(self, request=None, public=False):
+        return get_schema(get_code_version())
+
+
+SchemaView = get_schema_view(
+    schema_info,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+    generator_class=PrecomputedSchemaGenerator,
+)
+
+swagger_ui_view = SchemaView.with_ui('swagger', cache_timeout=0)
+
+
+def swagger_view(request):
+    # The UI loads its spec from its own URL with ?format=openapi.
+    if request.GET.get('format') == 'openapi':
+        return schema_document_response(request, SCHEMA_JSON)
+    return swagger_ui_view(request)
+
+
+def schema_json_view(request):
+    return schema_document_response(request, SCHEMA_JSON)
+
+
+def schema_yaml_view(request):
+    return schema_document_response(request, SCHEMA_YAML)
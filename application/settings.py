@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,12 +38,18 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'voting_app.apps.VotingAppConfig',
     'accounts',
+    # The project package, installed only so Django finds the management
+    # commands of its own modules, e.g. generate_schema for schema.py.
+    'application',
     'rest_framework',
     'rest_framework.authtoken',
     'drf_yasg',
 ]
 
 MIDDLEWARE = [
+    'voting_app.metrics.MetricsMiddleware',
+    'voting_app.profiling.ProfilingMiddleware',
+    'application.db_router.PrimaryPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,9 +90,21 @@ DATABASES = {
         'PASSWORD': 'postgres',
         'HOST': 'db',
         'PORT': 5432,
-    }
+    },
+    # Stands in for a read replica, see DATABASE_ROUTING.
+    'replica': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'postgres',
+        'USER': 'postgres',
+        'PASSWORD': 'postgres',
+        'HOST': 'db',
+        'PORT': 5432,
+        'TEST': {'NAME': 'test_postgres_replica'},
+    },
 }
 
+DATABASE_ROUTERS = ['application.db_router.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -129,7 +148,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ]
 }
 
@@ -144,3 +163,119 @@ SWAGGER_SETTINGS = {
         }
     }
 }
+
+# Write-behind vote buffer, see voting_app/buffer.py
+VOTE_BUFFER = {
+    'ENABLED': False,
+    'BACKEND': 'voting_app.buffer.DatabaseVoteBuffer',
+    'FLUSH_INTERVAL': 1.0,
+    'FLUSH_SIZE': 1000,
+    'AUTOSTART': True,
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'survey_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'survey-results',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Expired surveys sweeper, see voting_app/sweeper.py
+SURVEY_SWEEPER = {
+    'ENABLED': False,
+    'INTERVAL': 60.0,
+    'BATCH_SIZE': 1000,
+}
+
+# Vote event rollup, see voting_app/vote_log.py
+VOTE_ROLLUP = {
+    'ENABLED': False,
+    'INTERVAL': 10.0,
+    'BATCH_SIZE': 10000,
+}
+
+# Archival of finished surveys, see voting_app/archive.py
+SURVEY_ARCHIVE = {
+    'ENABLED': False,
+    'INTERVAL': 3600.0,
+    'AFTER_DAYS': 30,
+    'BATCH_SIZE': 100,
+    'CHUNK_SIZE': 10000,
+    'VOTER_BITMAP': True,
+}
+
+# Thread pool of the async survey views, see voting_app/async_views.py
+ASYNC_API = {
+    'MAX_WORKERS': 16,
+}
+
+# Live results streams, see voting_app/live.py
+LIVE_RESULTS = {
+    'POLL_INTERVAL': 0.5,
+    'MIN_INTERVAL': 1.0,
+    'HEARTBEAT': 15.0,
+}
+
+# Token authentication cache, see accounts/authentication.py
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 10.0,
+    # Holds the revocation stamps, nothing is cached without it. The
+    # local-memory default only serves one process; production settings
+    # require a cache shared by every worker.
+    'SHARED_CACHE': 'default',
+    'SHARED_TTL': 300.0,
+}
+
+# Bulk user provisioning, see accounts/hashing.py
+USER_PROVISIONING = {
+    'HASH_WORKERS': None,
+    'CHUNK_SIZE': 1000,
+    'MAX_BULK_USERS': 1000,
+}
+
+# Precomputed OpenAPI schema, see application/schema.py
+OPENAPI_SCHEMA = {
+    'CODE_VERSION': os.environ.get('CODE_VERSION'),
+    'CACHE_DIR': BASE_DIR / 'var' / 'openapi',
+    'MAX_AGE': 3600,
+}
+
+# Request metrics served at /metrics, see voting_app/metrics.py
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 10.0,
+    # Scrapers send Authorization: Bearer <TOKEN>, unset disables /metrics.
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# On-demand request profiling and slow query log, see voting_app/profiling.py
+PROFILING = {
+    'TOKEN': os.environ.get('PROFILING_TOKEN'),
+    'SAMPLE_RATE': 0.0,
+    'REPORT_DIR': BASE_DIR / 'var' / 'profiles',
+    'MAX_REPORTS': 100,
+    'TOP_FUNCTIONS': 40,
+    'SLOW_QUERY_THRESHOLD': None,
+}
+
+# Read replica routing, see application/db_router.py
+DATABASE_ROUTING = {
+    'PRIMARY': 'default',
+    'REPLICAS': [],
+    # django_cache is the DatabaseCache table.
+    'PRIMARY_APPS': ['auth', 'authtoken', 'sessions', 'django_cache'],
+    'PIN_SECONDS': 5.0,
+    'PIN_CACHE': 'default',
+}
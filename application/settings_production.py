@@ -0,0 +1,116 @@
+"""Production settings: ``DJANGO_SETTINGS_MODULE=application.settings_production``.
+
+Served by gunicorn with ``gunicorn.conf.py``, see the README. Everything
+environment specific comes from environment variables.
+"""
+# pylint: disable=wildcard-import,unused-wildcard-import
+import os
+from django.core.exceptions import ImproperlyConfigured
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+STATIC_ROOT = BASE_DIR / 'static'  # noqa: F405
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'application.db_backend',
+        'NAME': os.environ.get('DB_NAME', 'postgres'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
+        'HOST': os.environ.get('DB_HOST', 'db'),
+        'PORT': int(os.environ.get('DB_PORT', 5432)),
+        # Persistent connections, checked before a request reuses them.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Optional in-process pool, e.g. for ASGI workers whose threads come and
+# go. Connections go back to the pool after every request.
+if os.environ.get('DB_POOL_MAX_SIZE'):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': int(os.environ['DB_POOL_MAX_SIZE']),
+        'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica-1,replica-2. Each one is
+# a copy of the primary's settings with its own host.
+DATABASE_ROUTING = {
+    **DATABASE_ROUTING,  # noqa: F405
+    'REPLICAS': [],
+    # A database cache must never be read from a lagging replica.
+    'PRIMARY_APPS': ['auth', 'authtoken', 'sessions', 'django_cache'],
+    'PIN_SECONDS': float(os.environ.get('DB_REPLICA_PIN_SECONDS', 5)),
+    # Shared by the workers, see CACHES below.
+    'PIN_CACHE': 'default',
+}
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host}
+    DATABASE_ROUTING['REPLICAS'].append(f'replica_{index}')
+
+# Every worker has to see the same result cache versions, replica pins and
+# token invalidations, so the caches are shared between processes. There is
+# no fallback: a database cache would add a query to every authenticated
+# request, and a local one would be wrong with more than one worker.
+# Defaults to memcached, e.g.
+# CACHE_LOCATION=memcached-1:11211,memcached-2:11211.
+CACHE_BACKEND = os.environ.get(
+    'CACHE_BACKEND', 'django.core.cache.backends.memcached.PyMemcacheCache')
+if CACHE_BACKEND.endswith(('LocMemCache', 'DummyCache')):
+    raise ImproperlyConfigured(
+        'CACHE_BACKEND has to be shared by every worker.')
+if not os.environ.get('CACHE_LOCATION'):
+    raise ImproperlyConfigured(
+        'CACHE_LOCATION has to name the shared cache, e.g. memcached:11211.')
+CACHE_LOCATION = os.environ['CACHE_LOCATION']
+if CACHE_BACKEND.endswith('MemcacheCache'):
+    CACHE_LOCATION = CACHE_LOCATION.split(',')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'KEY_PREFIX': 'default',
+    },
+    'survey_results': {
+        **CACHES['survey_results'],  # noqa: F405
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'KEY_PREFIX': 'survey-results',
+    },
+}
+
+TOKEN_CACHE = {**TOKEN_CACHE, 'SHARED_CACHE': 'default'}  # noqa: F405
+
+# A pin only kept by the worker that served the write would send the
+# client's next read, served by another worker, to a lagging replica.
+if (DATABASE_ROUTING['REPLICAS'] and CACHES[DATABASE_ROUTING['PIN_CACHE']][
+        'BACKEND'].endswith('LocMemCache')):
+    raise ImproperlyConfigured(
+        'DB_REPLICA_HOSTS needs a PIN_CACHE shared by every worker.')
+
+# Threads started while gunicorn preloads the app would not survive the
+# fork; run finish_expired_surveys --loop, rollup_vote_events --loop and
+# archive_surveys --loop as their own processes instead.
+SURVEY_SWEEPER = {**SURVEY_SWEEPER, 'ENABLED': False}  # noqa: F405
+VOTE_ROLLUP = {**VOTE_ROLLUP, 'ENABLED': False}  # noqa: F405
+SURVEY_ARCHIVE = {**SURVEY_ARCHIVE, 'ENABLED': False}  # noqa: F405
+
+# Every gunicorn worker keeps its own metrics; /metrics adds them up.
+METRICS = {
+    **METRICS,  # noqa: F405
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_DIR',
+                                       '/tmp/voting-app-metrics'),
+}
+
+PROFILING = {
+    **PROFILING,  # noqa: F405
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+    'SLOW_QUERY_THRESHOLD': float(os.environ.get('SLOW_QUERY_THRESHOLD', 1)),
+}
@@ -15,24 +15,18 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Surveys API",
-        default_version='v1',
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from voting_app.metrics import metrics_view
+from voting_app.profiling import ProfileReportListView, ProfileReportView
+from .schema import swagger_view, schema_json_view, schema_yaml_view
 
 urlpatterns = [
-    path('swagger/', schema_view.with_ui(
-        'swagger',
-        cache_timeout=0
-    ), name='schema-swagger-ui'),
+    path('swagger/', swagger_view, name='schema-swagger-ui'),
+    path('swagger.json', schema_json_view, name='schema-json'),
+    path('swagger.yaml', schema_yaml_view, name='schema-yaml'),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', ProfileReportListView.as_view(), name='profiles'),
+    path('profiles/<slug:report_id>/', ProfileReportView.as_view(),
+         name='profile-report'),
     path('admin/', admin.site.urls),
     path('api/', include('voting_app.urls')),
     path('auth/', include('accounts.urls')),
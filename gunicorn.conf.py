@@ -0,0 +1,47 @@
+"""Gunicorn settings of the production profile.
+
+WSGI:  gunicorn application.wsgi
+ASGI:  GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+       gunicorn application.asgi
+
+Workers default to one per core, overridable with WEB_CONCURRENCY. Requests
+mostly wait on Postgres, so threads, not processes, cover the waits: more
+processes than cores only add context switches.
+"""
+# pylint: disable=invalid-name
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'application.settings_production')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+cores = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+# Only used by gthread workers.
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = True
+keepalive = 5
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+
+
+def pre_fork(server, worker):
+    # pylint: disable=import-outside-toplevel,unused-argument
+    from django.db import connections
+    # Connections opened while preloading must not be shared by workers.
+    connections.close_all()
+
+
+def on_starting(server):
+    # pylint: disable=import-outside-toplevel,unused-argument
+    from voting_app.metrics import clear_multiprocess_dir
+    clear_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    # pylint: disable=import-outside-toplevel,unused-argument
+    from voting_app.metrics import fold_worker_snapshots
+    fold_worker_snapshots(worker.pid)
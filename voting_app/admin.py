@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.forms import BaseInlineFormSet
-from .models import SurveyModel, UserSurveyJunctionModel
+from .models import SurveyModel, AnswerOptionModel, UserSurveyJunctionModel
+from .result_cache import bump_survey_versions_on_commit
 
 
 class OwnersFormset(BaseInlineFormSet):
@@ -17,6 +18,15 @@ class VotedUsersFormset(BaseInlineFormSet):
         return queryset.filter(is_voted=True)
 
 
+class AnswerOptionInline(admin.TabularInline):
+    model = AnswerOptionModel
+    extra = 0
+    # Votes only change by voting, an edited count would drift from the
+    # vote log.
+    readonly_fields = ('vote_count',)
+    verbose_name_plural = 'Answers'
+
+
 class UserSurveyOwnerInline(admin.TabularInline):
     model = UserSurveyJunctionModel
     formset = OwnersFormset
@@ -32,12 +42,23 @@ class UserSurveyVotedInline(admin.TabularInline):
 
 
 class SurveyAdmin(admin.ModelAdmin):
-    fields = ('survey_question', 'answers', 'finishing_date', 'is_finished',)
+    fields = ('survey_question', 'finishing_date', 'is_finished',
+              'shards_count',)
     inlines = [
+        AnswerOptionInline,
         UserSurveyOwnerInline,
         UserSurveyVotedInline,
     ]
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.fold_counter_shards()
+        bump_survey_versions_on_commit([obj.pk])
+
+    def delete_model(self, request, obj):
+        bump_survey_versions_on_commit([obj.pk])
+        super().delete_model(request, obj)
+
 
 admin.site.register(SurveyModel, SurveyAdmin)
 admin.site.register(UserSurveyJunctionModel)
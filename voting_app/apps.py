@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class VotingAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'voting_app'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel
+        from .archive import get_archive_settings, start_archiver
+        from .sweeper import get_sweeper_settings, start_sweeper
+        from .vote_log import get_rollup_settings, start_rollup
+        if get_sweeper_settings()['ENABLED']:
+            start_sweeper()
+        if get_rollup_settings()['ENABLED']:
+            start_rollup()
+        if get_archive_settings()['ENABLED']:
+            start_archiver()
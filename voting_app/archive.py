@@ -0,0 +1,200 @@
+"""Archival of finished surveys.
+
+Surveys finished at least ``AFTER_DAYS`` days ago (``finished_at``) get
+an immutable snapshot of their final results, which ``retrieve``
+serves as is. Their voter junction rows are then moved to the archive
+table, ``CHUNK_SIZE`` rows per transaction, so the hot table and its
+indexes only hold live surveys. Owner rows stay for the owner checks.
+
+A survey is marked archived once all of its rows moved, so an interrupted
+run picks up where it stopped.
+"""
+import logging
+import struct
+import time
+import zlib
+from typing import Iterable, List, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from .models import (
+    SurveyModel, SurveySnapshotModel, UserSurveyJunctionModel,
+    ArchivedUserSurveyJunctionModel,
+)
+from .periodic import PeriodicThread
+from .serializers import SurveyRetrieveSerializer
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'INTERVAL': 3600.0,
+    'AFTER_DAYS': 30,
+    'BATCH_SIZE': 100,
+    'CHUNK_SIZE': 10000,
+    'VOTER_BITMAP': True,
+}
+
+# pylint: disable=protected-access
+# Moves up to ``limit`` voter rows of a survey and returns how many.
+MOVE_VOTERS_SQL = f'''
+    WITH moved AS (
+        DELETE FROM {UserSurveyJunctionModel._meta.db_table}
+        WHERE id IN (
+            SELECT id FROM {UserSurveyJunctionModel._meta.db_table}
+            WHERE survey_id = %(survey)s AND is_voted AND NOT is_owner
+            LIMIT %(limit)s
+        )
+        RETURNING user_id, survey_id, is_owner, is_voted
+    ), archived AS (
+        INSERT INTO {ArchivedUserSurveyJunctionModel._meta.db_table}
+            (user_id, survey_id, is_owner, is_voted)
+        SELECT user_id, survey_id, is_owner, is_voted FROM moved
+        ON CONFLICT (survey_id, user_id) DO NOTHING
+    )
+    SELECT COUNT(*) FROM moved
+'''
+# pylint: enable=protected-access
+
+
+def get_archive_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'SURVEY_ARCHIVE', {})}
+
+
+def encode_voter_bitmap(user_ids: Iterable[int]) -> Tuple[bytes, int]:
+    """zlib compressed bitmap of the ascending ``user_ids``, after the
+    smallest id as an 8 byte offset, and how many ids it holds. The ids
+    are consumed one at a time, so they can be streamed."""
+    offset = None
+    bits = bytearray()
+    count = 0
+    for count, user_id in enumerate(user_ids, start=1):
+        if offset is None:
+            offset = user_id
+        index = user_id - offset
+        if index >> 3 >= len(bits):
+            bits.extend(bytes((index >> 3) + 1 - len(bits)))
+        bits[index >> 3] |= 1 << (index & 7)
+    return zlib.compress(struct.pack('>Q', offset or 0) + bits), count
+
+
+def decode_voter_bitmap(bitmap: bytes) -> List[int]:
+    data = zlib.decompress(bitmap)
+    offset, = struct.unpack('>Q', data[:8])
+    return [
+        offset + byte_index * 8 + bit
+        for byte_index, byte in enumerate(data[8:]) if byte
+        for bit in range(8) if byte >> bit & 1
+    ]
+
+
+@transaction.atomic
+def create_snapshot(survey_id: int, chunk_size: int,
+                    voter_bitmap: bool) -> bool:
+    """Snapshot the results of a finished survey, unless it already has
+    one. Returns whether the survey can be archived."""
+    survey = SurveyModel.objects.select_for_update().filter(
+        pk=survey_id, is_finished=True, is_archived=False,
+    ).first()
+    if survey is None:
+        # Deleted, reopened or archived since it was picked.
+        return False
+    if SurveySnapshotModel.objects.filter(survey=survey).exists():
+        return True
+    if survey.shards_count:
+        survey.fold_counter_shards()
+    prefetch_related_objects([survey], 'options')
+    voters = UserSurveyJunctionModel.objects.filter(survey=survey,
+                                                    is_voted=True)
+    if voter_bitmap:
+        bitmap, voters_count = encode_voter_bitmap(
+            voters.order_by('user_id').values_list(
+                'user_id', flat=True).iterator(chunk_size=chunk_size))
+    else:
+        bitmap, voters_count = None, voters.count()
+    SurveySnapshotModel.objects.create(
+        survey=survey,
+        answers=[[option.label, option.vote_count]
+                 for option in survey.options.all()],
+        voters_count=voters_count,
+        voter_bitmap=bitmap,
+        content=JSONRenderer().render(SurveyRetrieveSerializer(survey).data),
+    )
+    return True
+
+
+def move_voters(survey_id: int, chunk_size: int) -> int:
+    """Move the voter rows of a survey to the archive table, one
+    transaction per chunk. Returns how many rows moved."""
+    moved_count = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(MOVE_VOTERS_SQL,
+                           {'survey': survey_id, 'limit': chunk_size})
+            moved, = cursor.fetchone()
+        moved_count += moved
+        if moved < chunk_size:
+            return moved_count
+
+
+def archive_survey(survey_id: int, chunk_size: int,
+                   voter_bitmap: bool) -> int:
+    """Archive a finished survey. Returns how many voter rows moved."""
+    if not create_snapshot(survey_id, chunk_size, voter_bitmap):
+        return 0
+    moved_count = move_voters(survey_id, chunk_size)
+    SurveyModel.objects.filter(pk=survey_id).update(is_archived=True)
+    return moved_count
+
+
+def get_archivable_surveys(after_days: float, limit: int) -> List[int]:
+    return list(SurveyModel.objects.filter(
+        is_finished=True,
+        is_archived=False,
+        finished_at__lte=timezone.now() - timezone.timedelta(
+            days=after_days),
+    ).order_by('finished_at', 'id').values_list('id', flat=True)[:limit])
+
+
+def archive_finished_surveys(after_days: float, batch_size: int,
+                             chunk_size: int,
+                             voter_bitmap: bool) -> Tuple[int, int, float]:
+    """Archive every survey finished more than ``after_days`` days ago.
+
+    Returns how many surveys were archived, how many voter rows moved and
+    how long it took.
+    """
+    started = time.perf_counter()
+    archived_count = moved_count = 0
+    while True:
+        survey_ids = get_archivable_surveys(after_days, batch_size)
+        for survey_id in survey_ids:
+            moved_count += archive_survey(survey_id, chunk_size, voter_bitmap)
+            archived_count += 1
+        if len(survey_ids) < batch_size:
+            return archived_count, moved_count, time.perf_counter() - started
+
+
+def archive():
+    archive_settings = get_archive_settings()
+    archived_count, moved_count, elapsed = archive_finished_surveys(
+        archive_settings['AFTER_DAYS'],
+        archive_settings['BATCH_SIZE'],
+        archive_settings['CHUNK_SIZE'],
+        archive_settings['VOTER_BITMAP'],
+    )
+    if archived_count:
+        logger.info('Archived %d surveys and %d voters in %.3fs',
+                    archived_count, moved_count, elapsed)
+
+
+def start_archiver() -> PeriodicThread:
+    archiver = PeriodicThread(
+        archive,
+        get_archive_settings()['INTERVAL'],
+        name='survey-archiver',
+    )
+    archiver.start()
+    return archiver
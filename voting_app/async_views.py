@@ -0,0 +1,109 @@
+"""Async variants of the hot survey endpoints for ASGI servers.
+
+DRF views are sync, so under ASGI every request hops to a thread anyway.
+These views stay on the event loop and only send the ORM work to a
+bounded thread pool, so slow clients and long-lived connections do not tie
+up a thread each. They run under WSGI too, next to the DRF views.
+"""
+from django.http import (
+    HttpResponse, HttpResponseNotAllowed, JsonResponse,
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .buffer import vote_buffers, is_vote_buffer_enabled
+from .models import SurveyModel
+from .orm_pool import run_in_pool
+from .pagination import SurveyCursorPagination
+from .serializers import (
+    SurveyListSerializer, SurveyListFilterSerializer, SurveyVotingSerializer,
+)
+from .utils import filter_surveys, perform_survey_vote
+from .views import raise_for_vote_result, retrieve_survey
+
+
+def get_drf_request(request) -> Request:
+    return Request(
+        request,
+        parsers=[JSONParser()],
+        authenticators=[
+            authentication()
+            for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ],
+    )
+
+
+def error_response(error: APIException) -> JsonResponse:
+    data = error.detail
+    if not isinstance(data, (list, dict)):
+        data = {'detail': data}
+    return JsonResponse(data, status=error.status_code, safe=False)
+
+
+def list_surveys(request) -> dict:
+    drf_request = get_drf_request(request)
+    filter_serializer = SurveyListFilterSerializer(
+        data=request.GET.dict()
+    )
+    filter_serializer.is_valid(raise_exception=True)
+    queryset = filter_surveys(SurveyModel.objects.all(),
+                              filter_serializer.validated_data)
+    paginator = SurveyCursorPagination()
+    page = paginator.paginate_queryset(queryset, drf_request)
+    serializer = SurveyListSerializer(page, many=True,
+                                      context={'request': drf_request})
+    return paginator.get_paginated_response(serializer.data).data
+
+
+def vote_survey(request, survey_id: int) -> int:
+    drf_request = get_drf_request(request)
+    if not drf_request.user.is_authenticated:
+        raise NotAuthenticated()
+    serializer = SurveyVotingSerializer(data=drf_request.data)
+    serializer.is_valid(raise_exception=True)
+    voted_answer = serializer.validated_data['voted_answer']
+    if is_vote_buffer_enabled():
+        result = vote_buffers.get().append(
+            survey_id, drf_request.user.pk, voted_answer)
+        raise_for_vote_result(result, voted_answer)
+        return status.HTTP_202_ACCEPTED
+    result = perform_survey_vote(survey_id, drf_request.user, voted_answer)
+    raise_for_vote_result(result, voted_answer)
+    return status.HTTP_204_NO_CONTENT
+
+
+async def survey_list(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        data = await run_in_pool(list_surveys, request)
+    except APIException as error:
+        return error_response(error)
+    return JsonResponse(data)
+
+
+async def survey_retrieve(request, pk: int):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        return await run_in_pool(retrieve_survey, request, pk)
+    except APIException as error:
+        return error_response(error)
+
+
+async def survey_vote(request, pk: int):
+    if request.method != 'PATCH':
+        return HttpResponseNotAllowed(['PATCH'])
+    try:
+        status_code = await run_in_pool(vote_survey, request, pk)
+    except APIException as error:
+        return error_response(error)
+    return HttpResponse(status=status_code)
+
+
+# Token authentication does not use cookies; session authentication
+# enforces CSRF itself, like for the DRF views. Set directly because
+# csrf_exempt() would hide the coroutine from Django 3.2.
+survey_vote.csrf_exempt = True
@@ -0,0 +1,274 @@
+import asyncio
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import repeat
+from typing import Callable, Iterable, List, Sequence, Tuple
+from urllib.parse import urlsplit
+from django.db import connection, connections
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from .buffer import vote_buffers
+from .models import SurveyModel, AnswerOptionModel, UserSurveyJunctionModel
+
+
+def split_evenly(items: Sequence, parts: int) -> List[Sequence]:
+    return [items[index::parts] for index in range(parts)]
+
+
+def run_concurrently(worker: Callable, items: Sequence,
+                     workers: int) -> float:
+    """Run ``worker`` over ``items`` from ``workers`` threads.
+
+    Every thread gets its own database connection, which is closed once
+    the thread is done. Returns the wall clock time in seconds.
+    """
+    def run_chunk(chunk: Iterable):
+        try:
+            for item in chunk:
+                worker(item)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_chunk, split_evenly(items, workers)))
+    return time.perf_counter() - started
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+async def read_http_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """Read one HTTP/1.1 response. Returns its status and whether the
+    connection can be reused."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+def get_http_requests(url: str, requests: int, method: str = 'GET',
+                      body: bytes = b'', tokens: Sequence[str] = ()
+                      ) -> List[bytes]:
+    """``requests`` raw ``method`` requests to ``url``. A ``body`` is sent
+    as JSON; with ``tokens``, request ``i`` authenticates with
+    ``tokens[i]``, and there are at most as many requests as tokens."""
+    parsed_url = urlsplit(url)
+    target = parsed_url.path + (f'?{parsed_url.query}'
+                                if parsed_url.query else '')
+    head = f'{method} {target} HTTP/1.1\r\nHost: {parsed_url.netloc}\r\n'
+    if body:
+        head += (f'Content-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n')
+    if not tokens:
+        return [f'{head}\r\n'.encode() + body] * requests
+    return [
+        f'{head}Authorization: Token {token}\r\n\r\n'.encode() + body
+        for token in tokens[:requests]
+    ]
+
+
+async def run_http_load(url: str, requests: Sequence[bytes],
+                        concurrency: int) -> dict:
+    """Send the raw ``requests`` (see ``get_http_requests``) to ``url``
+    over ``concurrency`` keep-alive connections. Returns the latencies,
+    status counts and wall time."""
+    parsed_url = urlsplit(url)
+    host, port = parsed_url.hostname, parsed_url.port or 80
+    latencies, statuses = [], Counter()
+    remaining = iter(requests)
+
+    async def client():
+        reader = writer = None
+        for request in remaining:
+            started = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                status, keep_alive = await read_http_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                status, keep_alive = 0, False
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+            if not keep_alive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return {
+        'elapsed': time.perf_counter() - started,
+        'latencies': sorted(latencies),
+        'statuses': dict(statuses),
+    }
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` counting the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+# Client requests are (token, survey id, answer) items.
+def send_create(client: Client, item: tuple):
+    token, _, _ = item
+    return client.post(reverse('surveys-list'), {
+        'survey_question': 'Benchmark survey',
+        'answers': ['yes', 'no'],
+        'finishing_date': (timezone.now()
+                           + timezone.timedelta(days=1)).isoformat(),
+    }, content_type='application/json', HTTP_AUTHORIZATION=f'Token {token}')
+
+
+def send_list(client: Client, item: tuple):
+    token, _, _ = item
+    return client.get(reverse('surveys-list'), {'page_size': 50},
+                      HTTP_AUTHORIZATION=f'Token {token}')
+
+
+def send_retrieve(client: Client, item: tuple):
+    token, survey_id, _ = item
+    return client.get(reverse('surveys-detail', args=[survey_id]),
+                      HTTP_AUTHORIZATION=f'Token {token}')
+
+
+def send_vote(client: Client, item: tuple):
+    token, survey_id, answer = item
+    return client.patch(reverse('surveys-vote', args=[survey_id]),
+                        {'voted_answer': answer},
+                        content_type='application/json',
+                        HTTP_AUTHORIZATION=f'Token {token}')
+
+
+SCENARIOS = {
+    'create': send_create,
+    'list': send_list,
+    'retrieve': send_retrieve,
+    'vote': send_vote,
+}
+
+
+def run_client_chunk(scenario: str, host: str, chunk: Iterable) -> dict:
+    client = Client(HTTP_HOST=host, raise_request_exception=False)
+    send = SCENARIOS[scenario]
+    counter = QueryCounter()
+    latencies, statuses = [], Counter()
+    try:
+        with connection.execute_wrapper(counter):
+            for item in chunk:
+                started = time.perf_counter()
+                response = send(client, item)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+    finally:
+        connection.close()
+    return {'latencies': latencies, 'statuses': statuses,
+            'queries': counter.count}
+
+
+def merge_client_results(results: Iterable[dict]) -> dict:
+    merged = {'latencies': [], 'statuses': Counter(), 'queries': 0}
+    for result in results:
+        merged['latencies'] += result['latencies']
+        merged['statuses'] += result['statuses']
+        merged['queries'] += result['queries']
+    return merged
+
+
+def run_client_threads(scenario: str, items: Sequence, threads: int,
+                       host: str) -> dict:
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(partial(run_client_chunk, scenario, host),
+                                    split_evenly(items, threads)))
+    # Buffered votes are counted before the results are checked.
+    vote_buffers.shutdown()
+    return merge_client_results(results)
+
+
+def run_client_load(scenario: str, items: Sequence, processes: int,
+                    threads: int, host: str) -> dict:
+    """Send one ``scenario`` request per item through the whole Django
+    stack (middleware, authentication, views) with the test client, from
+    ``threads`` threads in each of ``processes`` forked processes.
+
+    Returns the latencies, status counts, query count and wall time.
+    """
+    started = time.perf_counter()
+    if processes <= 1:
+        result = run_client_threads(scenario, items, threads, host)
+    else:
+        # Forked processes must not share the parent's connections.
+        connections.close_all()
+        with ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            result = merge_client_results(executor.map(
+                run_client_threads, repeat(scenario),
+                split_evenly(items, processes), repeat(threads), repeat(host),
+            ))
+    result['elapsed'] = time.perf_counter() - started
+    return result
+
+
+def summarize_load(result: dict) -> dict:
+    latencies = sorted(result['latencies'])
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'elapsed': round(result['elapsed'], 3),
+        'throughput': round(requests / result['elapsed'], 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_per_request': round(result['queries'] / max(requests, 1), 2),
+        'statuses': {
+            str(status): count
+            for status, count in sorted(result['statuses'].items())
+        },
+    }
+
+
+def check_lost_votes(survey_ids: List[int]) -> dict:
+    """Compare the counted votes of the surveys with their voters."""
+    SurveyModel.objects.fold_counter_shards(survey_ids)
+    counted = AnswerOptionModel.objects.filter(
+        survey_id__in=survey_ids,
+    ).aggregate(total=Coalesce(Sum('vote_count'), 0))['total']
+    voters = UserSurveyJunctionModel.objects.filter(
+        survey_id__in=survey_ids, is_voted=True,
+    ).count()
+    return {'voters': voters, 'counted': counted, 'lost': voters - counted}
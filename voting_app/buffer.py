@@ -0,0 +1,245 @@
+import abc
+import atexit
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+from .models import (
+    SurveyModel, AnswerOptionModel, UserSurveyJunctionModel, PendingVoteModel,
+)
+from .periodic import PeriodicThread
+from .utils import apply_votes, get_vote_result
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BACKEND': 'voting_app.buffer.DatabaseVoteBuffer',
+    'FLUSH_INTERVAL': 1.0,
+    'FLUSH_SIZE': 1000,
+    'AUTOSTART': True,
+}
+
+# pylint: disable=protected-access
+SURVEY_CHECK_SQL = f'''
+    SELECT survey.id,
+           NOT survey.is_finished AND survey.finishing_date > NOW()
+               AS is_open,
+           EXISTS(
+               SELECT 1 FROM {AnswerOptionModel._meta.db_table}
+               WHERE survey_id = survey.id AND label = %(answer)s
+           ) AS has_answer,
+           EXISTS(
+               SELECT 1 FROM {UserSurveyJunctionModel._meta.db_table}
+               WHERE survey_id = survey.id
+                   AND user_id = %(user)s
+                   AND is_voted
+           ) AS is_voted
+    FROM {SurveyModel._meta.db_table} AS survey
+    WHERE survey.id = %(survey)s
+'''
+
+APPEND_SQL = f'''
+    WITH survey AS ({SURVEY_CHECK_SQL}), pending AS (
+        INSERT INTO {PendingVoteModel._meta.db_table}
+            (user_id, survey_id, answer, created_at)
+        SELECT %(user)s, id, %(answer)s, NOW() FROM survey
+        WHERE is_open AND has_answer AND NOT is_voted
+        ON CONFLICT (user_id, survey_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT is_open, has_answer, EXISTS(SELECT 1 FROM pending)
+    FROM survey
+'''
+
+# The append's insert waits for a flush that holds the same user's pending
+# vote, but its voted check ran before that flush committed. Run again in a
+# new snapshot, it withdraws the vote if the flush counted one meanwhile.
+WITHDRAW_VOTED_SQL = f'''
+    DELETE FROM {PendingVoteModel._meta.db_table} AS pending
+    WHERE user_id = %(user)s AND survey_id = %(survey)s
+        AND EXISTS(
+            SELECT 1 FROM {UserSurveyJunctionModel._meta.db_table}
+            WHERE survey_id = pending.survey_id
+                AND user_id = pending.user_id
+                AND is_voted
+        )
+    RETURNING id
+'''
+
+POP_SQL = f'''
+    DELETE FROM {PendingVoteModel._meta.db_table}
+    WHERE id IN (
+        SELECT id FROM {PendingVoteModel._meta.db_table}
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING user_id, survey_id, answer
+'''
+# pylint: enable=protected-access
+
+
+def get_buffer_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'VOTE_BUFFER', {})}
+
+
+class BaseVoteBuffer(abc.ABC):
+    """Accepts votes on the request path and counts them later in bulk.
+
+    Subclasses implement ``append``, which only checks that the vote can
+    be accepted and stores it, and ``pop``, which takes a batch of stored
+    votes out of the buffer.
+    """
+
+    def __init__(self, flush_size: int):
+        self.flush_size = flush_size
+
+    @abc.abstractmethod
+    def append(self, survey_id: int, user_id: int, answer: str) -> str:
+        """Store a vote if it can be counted, returns the vote result."""
+
+    @abc.abstractmethod
+    def pop(self, limit: int) -> List[Tuple[int, int, str]]:
+        """Take up to ``limit`` votes out of the buffer."""
+
+    def restore(self, votes: List[Tuple[int, int, str]]):
+        """Put back votes whose flush failed, if a rollback does not."""
+
+    def flush(self) -> int:
+        with transaction.atomic():
+            votes = self.pop(self.flush_size)
+            try:
+                apply_votes(votes)
+            except Exception:
+                self.restore(votes)
+                raise
+        return len(votes)
+
+    def drain(self) -> int:
+        flushed_total = 0
+        while True:
+            flushed = self.flush()
+            flushed_total += flushed
+            if flushed < self.flush_size:
+                return flushed_total
+
+
+class DatabaseVoteBuffer(BaseVoteBuffer):
+    """Durable buffer backed by ``PendingVoteModel``, shared by all workers."""
+
+    def append(self, survey_id, user_id, answer):
+        params = {'survey': survey_id, 'user': user_id, 'answer': answer}
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(APPEND_SQL, params)
+            row = cursor.fetchone()
+            if row is not None and row[2]:
+                cursor.execute(WITHDRAW_VOTED_SQL, params)
+                if cursor.fetchone() is not None:
+                    row = (row[0], row[1], False)
+        return get_vote_result(row)
+
+    def pop(self, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(POP_SQL, {'limit': limit})
+            return cursor.fetchall()
+
+
+class LocalVoteBuffer(BaseVoteBuffer):
+    """Process-local stand-in for a shared backend. Votes are kept in memory
+    and are lost if the process dies before they are flushed. A repeated
+    vote arriving while the flush of the first one commits is accepted,
+    then skipped by ``apply_votes``."""
+
+    def __init__(self, flush_size):
+        super().__init__(flush_size)
+        self.lock = threading.Lock()
+        self.votes = OrderedDict()
+
+    def append(self, survey_id, user_id, answer):
+        with connection.cursor() as cursor:
+            cursor.execute(SURVEY_CHECK_SQL, {
+                'survey': survey_id,
+                'user': user_id,
+                'answer': answer,
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return get_vote_result(row)
+        _, is_open, has_answer, is_voted = row
+        with self.lock:
+            is_added = (is_open and has_answer and not is_voted
+                        and (user_id, survey_id) not in self.votes)
+            if is_added:
+                self.votes[(user_id, survey_id)] = answer
+        return get_vote_result((is_open, has_answer, is_added))
+
+    def pop(self, limit):
+        with self.lock:
+            return [
+                (user_id, survey_id, answer)
+                for (user_id, survey_id), answer in (
+                    self.votes.popitem(last=False)
+                    for _ in range(min(limit, len(self.votes)))
+                )
+            ]
+
+    def restore(self, votes):
+        with self.lock:
+            for user_id, survey_id, answer in votes:
+                self.votes.setdefault((user_id, survey_id), answer)
+
+
+def create_vote_buffer() -> BaseVoteBuffer:
+    options = get_buffer_settings()
+    return import_string(options['BACKEND'])(flush_size=options['FLUSH_SIZE'])
+
+
+def is_vote_buffer_enabled() -> bool:
+    return get_buffer_settings()['ENABLED']
+
+
+class VoteBufferHandler:
+    """Owns the process-wide buffer and its background flusher."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vote_buffer = None
+        self.flusher = None
+
+    def get(self) -> BaseVoteBuffer:
+        with self.lock:
+            if self.vote_buffer is None:
+                options = get_buffer_settings()
+                self.vote_buffer = create_vote_buffer()
+                if options['AUTOSTART']:
+                    self.flusher = PeriodicThread(
+                        self.vote_buffer.drain,
+                        options['FLUSH_INTERVAL'],
+                        name='vote-buffer-flusher',
+                    )
+                    self.flusher.start()
+            return self.vote_buffer
+
+    def shutdown(self):
+        """Stop the flusher and count every vote still in the buffer."""
+        with self.lock:
+            if self.flusher is not None:
+                self.flusher.stop()
+                self.flusher = None
+            if self.vote_buffer is not None:
+                self.vote_buffer.drain()
+                self.vote_buffer = None
+
+
+vote_buffers = VoteBufferHandler()
+atexit.register(vote_buffers.shutdown)
+
+
+def reset_vote_buffer(*, setting, **kwargs):
+    if setting == 'VOTE_BUFFER':
+        vote_buffers.shutdown()
+
+
+setting_changed.connect(reset_vote_buffer)
@@ -4,3 +4,21 @@ RETRIEVE = 'retrieve'
 CREATE = 'create'
 EDIT_SURVEY = 'edit_survey'
 DESTROY = 'destroy'
+VOTE_BATCH = 'vote_batch'
+BULK_CREATE = 'bulk_create'
+EXPORT = 'export'
+EXPORT_RESULTS = 'export_results'
+EXPORT_VOTERS = 'export_voters'
+
+MAX_BATCH_VOTES = 1000
+MAX_BULK_SURVEYS = 1000
+
+EXPORT_CSV = 'csv'
+EXPORT_NDJSON = 'ndjson'
+EXPORT_CHUNK_SIZE = 2000
+
+VOTE_ACCEPTED = 'accepted'
+VOTE_SURVEY_NOT_FOUND = 'survey_not_found'
+VOTE_SURVEY_FINISHED = 'survey_finished'
+VOTE_INVALID_ANSWER = 'invalid_answer'
+VOTE_ALREADY_VOTED = 'already_voted'
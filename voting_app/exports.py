@@ -0,0 +1,85 @@
+import csv
+import itertools
+from typing import Iterable, Iterator, Sequence, Tuple
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from .models import (
+    SurveyModel, AnswerOptionModel, UserSurveyJunctionModel,
+    ArchivedUserSurveyJunctionModel,
+)
+from . import constants
+
+CONTENT_TYPES = {
+    constants.EXPORT_CSV: 'text/csv',
+    constants.EXPORT_NDJSON: 'application/x-ndjson',
+}
+
+Export = Tuple[Sequence[str], Iterable[tuple]]
+
+
+class Echo:
+    """File-like object handing back what ``csv.writer`` writes to it."""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def stream_csv(header: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(header: Sequence[str],
+                  rows: Iterable[tuple]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + '\n'
+
+
+def stream_export(export: Export, export_format: str) -> Iterator[str]:
+    header, rows = export
+    if export_format == constants.EXPORT_NDJSON:
+        return stream_ndjson(header, rows)
+    return stream_csv(header, rows)
+
+
+def export_surveys(queryset: QuerySet, chunk_size: int) -> Export:
+    header = ('id', 'survey_question', 'finishing_date', 'is_finished')
+    rows = queryset.order_by('pk').values_list(*header)
+    return header, rows.iterator(chunk_size=chunk_size)
+
+
+def export_results(queryset: QuerySet, chunk_size: int) -> Export:
+    """Per-answer counts of the surveys of ``queryset``, counter shards
+    that were not folded yet included."""
+    rows = AnswerOptionModel.objects.filter(
+        survey__in=queryset.values('pk'),
+    ).with_votes().order_by('survey', 'position').values_list(
+        'survey', 'survey__survey_question', 'label', 'votes',
+    )
+    header = ('survey', 'survey_question', 'answer', 'votes')
+    return header, rows.iterator(chunk_size=chunk_size)
+
+
+def export_voters(survey: SurveyModel, chunk_size: int) -> Export:
+    # Unordered, so the rows stream straight off the voted junction index
+    # instead of waiting for a sort of every voter.
+    rows = UserSurveyJunctionModel.objects.filter(
+        survey=survey,
+        is_voted=True,
+    ).order_by().values_list('user', 'user__username')
+    header = ('user', 'username')
+    if not survey.is_finished:
+        return header, rows.iterator(chunk_size=chunk_size)
+    # Voters of finished surveys may have moved to the archive.
+    archived_rows = ArchivedUserSurveyJunctionModel.objects.filter(
+        survey=survey,
+        is_voted=True,
+    ).order_by().values_list('user', 'user__username')
+    return header, itertools.chain(
+        rows.iterator(chunk_size=chunk_size),
+        archived_rows.iterator(chunk_size=chunk_size),
+    )
@@ -0,0 +1,275 @@
+"""Live survey results over Server-Sent Events.
+
+Every vote bumps the survey's result cache version. One watcher thread per
+survey polls that version and, when it moved, renders the results once for
+all of the survey's subscribers. Subscribers only keep the latest payload,
+so a burst of votes reaches each of them as at most one event per
+``MIN_INTERVAL``.
+
+The version lives in the ``survey_results`` cache: with the default local
+memory cache only votes served by the same process are seen, so deployments
+with several processes should point that cache at a shared backend.
+
+Streams go through the URLconf, the middleware and the ``stream`` action
+like any request. Under ``LiveResultsASGIMiddleware`` the action returns an
+empty response that the middleware then feeds on the event loop. Under
+WSGI every subscriber holds a worker thread for as long as it listens, so a
+gthread worker serves at most ``threads`` streams and nothing else meanwhile.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Set
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import StreamingHttpResponse
+from .result_cache import get_survey_version
+from .utils import get_survey_result
+
+DEFAULTS = {
+    'POLL_INTERVAL': 0.5,
+    'MIN_INTERVAL': 1.0,
+    'HEARTBEAT': 15.0,
+}
+
+# Published when the survey is gone; ends the streams.
+SURVEY_DELETED = b''
+
+KEEP_ALIVE_FRAME = b': keep-alive\n\n'
+DELETED_FRAME = b'event: deleted\ndata: {}\n\n'
+
+# Set in the scope of the requests LiveResultsASGIMiddleware can stream.
+ASGI_STREAMS = 'voting_app.live_results'
+# Survey whose stream the middleware feeds, removed from the response.
+STREAM_SURVEY_HEADER = b'x-live-results-survey'
+
+
+def get_live_results_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'LIVE_RESULTS', {})}
+
+
+def get_results_frame(payload: bytes) -> bytes:
+    if payload == SURVEY_DELETED:
+        return DELETED_FRAME
+    return b'event: results\ndata: ' + payload + b'\n\n'
+
+
+class Subscription:
+    """Latest unsent payload of one subscriber. A newer payload replaces
+    the unsent one, ``notify`` is called on every publish."""
+
+    def __init__(self, notify: Callable[[], None]):
+        self.lock = threading.Lock()
+        self.payload = None
+        self.notify = notify
+
+    def publish(self, payload: bytes):
+        with self.lock:
+            self.payload = payload
+        self.notify()
+
+    def take(self) -> Optional[bytes]:
+        with self.lock:
+            payload, self.payload = self.payload, None
+        return payload
+
+
+class SurveyWatcher(threading.Thread):
+    """Polls the version of one survey for all of its subscribers."""
+
+    def __init__(self, hub: 'LiveResultsHub', survey_id: int):
+        super().__init__(name=f'survey-watcher-{survey_id}', daemon=True)
+        self.hub = hub
+        self.survey_id = survey_id
+        self.subscriptions: Set[Subscription] = set()
+        self.payload = None
+        self.version = None
+
+    def run(self):
+        interval = get_live_results_settings()['POLL_INTERVAL']
+        try:
+            while self.hub.is_watched(self):
+                self.poll()
+                time.sleep(interval)
+        finally:
+            connection.close()
+
+    def poll(self):
+        version = get_survey_version(self.survey_id)
+        if version == self.version:
+            return
+        close_old_connections()
+        result = get_survey_result(self.survey_id)
+        self.version = version
+        self.payload = SURVEY_DELETED if result is None else result.content
+        for subscription in self.hub.get_subscriptions(self):
+            subscription.publish(self.payload)
+
+
+class LiveResultsHub:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watchers: Dict[int, SurveyWatcher] = {}
+
+    def subscribe(self, survey_id: int,
+                  notify: Callable[[], None]) -> Subscription:
+        subscription = Subscription(notify)
+        with self.lock:
+            watcher = self.watchers.get(survey_id)
+            if watcher is None:
+                watcher = self.watchers[survey_id] = SurveyWatcher(
+                    self, survey_id)
+                watcher.start()
+            watcher.subscriptions.add(subscription)
+            if watcher.payload is not None:
+                subscription.publish(watcher.payload)
+        return subscription
+
+    def unsubscribe(self, survey_id: int, subscription: Subscription):
+        with self.lock:
+            watcher = self.watchers.get(survey_id)
+            if watcher is None:
+                return
+            watcher.subscriptions.discard(subscription)
+            if not watcher.subscriptions:
+                del self.watchers[survey_id]
+
+    def is_watched(self, watcher: SurveyWatcher) -> bool:
+        with self.lock:
+            return self.watchers.get(watcher.survey_id) is watcher
+
+    def get_subscriptions(self, watcher: SurveyWatcher) -> Set[Subscription]:
+        with self.lock:
+            return set(watcher.subscriptions)
+
+    def get_watchers_count(self) -> int:
+        with self.lock:
+            return len(self.watchers)
+
+
+live_results = LiveResultsHub()
+
+
+def iter_results_frames(survey_id: int) -> Iterator[bytes]:
+    """SSE frames of a survey for sync servers. Blocks the thread serving
+    the response until the client goes away."""
+    live_settings = get_live_results_settings()
+    changed = threading.Event()
+    subscription = live_results.subscribe(survey_id, changed.set)
+    try:
+        while True:
+            if not changed.wait(live_settings['HEARTBEAT']):
+                yield KEEP_ALIVE_FRAME
+                continue
+            changed.clear()
+            payload = subscription.take()
+            if payload is None:
+                continue
+            yield get_results_frame(payload)
+            if payload == SURVEY_DELETED:
+                return
+            time.sleep(live_settings['MIN_INTERVAL'])
+    finally:
+        live_results.unsubscribe(survey_id, subscription)
+
+
+def get_results_stream_response(request,
+                                survey_id: int) -> StreamingHttpResponse:
+    """Response of the ``stream`` action. Its frames come from
+    ``LiveResultsASGIMiddleware`` when it serves the request, from a
+    blocked thread otherwise."""
+    if getattr(request, 'scope', {}).get(ASGI_STREAMS):
+        response = StreamingHttpResponse((), content_type='text/event-stream')
+        response[STREAM_SURVEY_HEADER.decode()] = str(survey_id)
+    else:
+        response = StreamingHttpResponse(iter_results_frames(survey_id),
+                                         content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class LiveResultsASGIMiddleware:
+    """Streams results natively under ASGI, where Django 3.2 would block
+    the event loop on a sync streaming response.
+
+    Every request, streams included, goes through ``application``. When
+    the ``stream`` action answered, the middleware keeps the response open
+    and sends the frames itself."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.application(scope, receive, send)
+        survey_ids = []
+
+        async def send_response(message):
+            if message['type'] == 'http.response.start':
+                headers = []
+                for name, value in message.get('headers', ()):
+                    if name.lower() == STREAM_SURVEY_HEADER:
+                        survey_ids.append(int(value))
+                    else:
+                        headers.append((name, value))
+                message = {**message, 'headers': headers}
+            elif survey_ids and not message.get('more_body'):
+                # The frames follow once Django is done with the request.
+                if message.get('body'):
+                    await send({**message, 'more_body': True})
+                return
+            await send(message)
+
+        await self.application({**scope, ASGI_STREAMS: True}, receive,
+                               send_response)
+        if survey_ids:
+            await self.stream(survey_ids[0], receive, send)
+
+    async def stream(self, survey_id: int, receive, send):
+        live_settings = get_live_results_settings()
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        subscription = live_results.subscribe(
+            survey_id, lambda: loop.call_soon_threadsafe(changed.set))
+        try:
+            while not disconnected.done():
+                frame = await self.next_frame(changed, disconnected,
+                                              subscription, live_settings)
+                if frame is None:
+                    continue
+                await send({'type': 'http.response.body', 'body': frame,
+                            'more_body': True})
+                if frame == DELETED_FRAME:
+                    break
+                if frame != KEEP_ALIVE_FRAME:
+                    await asyncio.sleep(live_settings['MIN_INTERVAL'])
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            live_results.unsubscribe(survey_id, subscription)
+            disconnected.cancel()
+
+    @staticmethod
+    async def next_frame(changed, disconnected, subscription,
+                         live_settings) -> Optional[bytes]:
+        changed_task = asyncio.ensure_future(changed.wait())
+        done, _ = await asyncio.wait(
+            {changed_task, disconnected},
+            timeout=live_settings['HEARTBEAT'],
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        changed_task.cancel()
+        if disconnected in done:
+            return None
+        if changed_task not in done:
+            return KEEP_ALIVE_FRAME
+        changed.clear()
+        payload = subscription.take()
+        return None if payload is None else get_results_frame(payload)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
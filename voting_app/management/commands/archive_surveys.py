@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from voting_app.archive import archive_finished_surveys, get_archive_settings
+
+
+class Command(BaseCommand):
+    help = ('Snapshot the results of surveys finished more than '
+            '--after-days days ago and move their voters to the archive.')
+
+    def add_arguments(self, parser):
+        archive_settings = get_archive_settings()
+        parser.add_argument('--after-days', type=float,
+                            default=archive_settings['AFTER_DAYS'])
+        parser.add_argument('--batch-size', type=int,
+                            default=archive_settings['BATCH_SIZE'],
+                            help='Surveys picked per query.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=archive_settings['CHUNK_SIZE'],
+                            help='Voters moved per transaction.')
+        parser.add_argument('--no-voter-bitmap', dest='voter_bitmap',
+                            action='store_false',
+                            default=archive_settings['VOTER_BITMAP'],
+                            help='Do not keep a bitmap of the voters in '
+                                 'the snapshots.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep archiving every --interval seconds.')
+        parser.add_argument('--interval', type=float,
+                            default=archive_settings['INTERVAL'])
+
+    def handle(self, *args, **options):
+        while True:
+            archived_count, moved_count, elapsed = archive_finished_surveys(
+                options['after_days'],
+                options['batch_size'],
+                options['chunk_size'],
+                options['voter_bitmap'],
+            )
+            self.stdout.write(
+                f'Archived {archived_count} surveys and {moved_count} '
+                f'voters in {elapsed:.3f}s'
+            )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
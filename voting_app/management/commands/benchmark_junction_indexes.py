@@ -0,0 +1,154 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from voting_app.models import SurveyModel, UserSurveyJunctionModel
+
+User = get_user_model()
+
+SEED_PREFIX = 'benchmark_junction_'
+
+
+class Command(BaseCommand):
+    help = ('Seed the junction table and print EXPLAIN ANALYZE plans and '
+            'timings of its hot queries without and with the partial '
+            'indexes. Takes exclusive locks; do not run on production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--surveys', type=int, default=10000)
+        parser.add_argument('--rows-per-survey', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the seeded rows.')
+
+    def handle(self, *args, **options):
+        options['rows_per_survey'] = min(options['rows_per_survey'],
+                                         options['users'])
+        started = time.perf_counter()
+        user_id, survey_id = self.seed(options)
+        self.stdout.write(
+            f'Seeded {options["surveys"] * options["rows_per_survey"]} '
+            f'junction rows in {time.perf_counter() - started:.1f}s'
+        )
+        try:
+            queries = self.get_queries(user_id, survey_id)
+            with transaction.atomic():
+                self.drop_indexes()
+                self.stdout.write(self.style.MIGRATE_HEADING('Before'))
+                self.run_queries(queries, options['repeat'])
+                transaction.set_rollback(True)
+            self.stdout.write(self.style.MIGRATE_HEADING('After'))
+            self.run_queries(queries, options['repeat'])
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def seed(self, options):
+        # pylint: disable=protected-access
+        user_table = User._meta.db_table
+        junction_table = UserSurveyJunctionModel._meta.db_table
+        # pylint: enable=protected-access
+        # Through the ORM, so every column gets its model default.
+        finishing_date = timezone.now() + timezone.timedelta(days=1)
+        survey_ids = [survey.pk for survey in SurveyModel.objects.bulk_create(
+            (SurveyModel(survey_question=f'{SEED_PREFIX}{number}',
+                         finishing_date=finishing_date)
+             for number in range(1, options['surveys'] + 1)),
+            batch_size=1000,
+        )]
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {user_table}
+                    (password, is_superuser, username, first_name,
+                     last_name, email, is_staff, is_active, date_joined)
+                SELECT '!', FALSE, %(prefix)s || number, '', '', '',
+                       FALSE, TRUE, NOW()
+                FROM generate_series(1, %(users)s) AS number
+                RETURNING id
+            ''', {'prefix': SEED_PREFIX, 'users': options['users']})
+            user_ids = [row[0] for row in cursor.fetchall()]
+            # Every survey gets rows_per_survey distinct users, the first
+            # one owns it and nine out of ten vote.
+            cursor.execute(f'''
+                INSERT INTO {junction_table}
+                    (user_id, survey_id, is_owner, is_voted)
+                SELECT users.ids[
+                           1 + (survey.id * %(rows)s + position)
+                           %% array_length(users.ids, 1)
+                       ],
+                       survey.id,
+                       position = 0,
+                       position %% 10 <> 0
+                FROM unnest(%(surveys)s::bigint[]) AS survey(id)
+                CROSS JOIN generate_series(0, %(rows)s - 1) AS position
+                CROSS JOIN (SELECT %(users)s::integer[] AS ids) AS users
+            ''', {
+                'rows': options['rows_per_survey'],
+                'surveys': survey_ids,
+                'users': user_ids,
+            })
+            cursor.execute(f'ANALYZE {junction_table}')
+        survey_id = survey_ids[len(survey_ids) // 2]
+        user_id = UserSurveyJunctionModel.objects.get(
+            survey_id=survey_id, is_owner=True).user_id
+        return user_id, survey_id
+
+    @staticmethod
+    def get_queries(user_id, survey_id):
+        junctions = UserSurveyJunctionModel.objects
+        return {
+            'Voted users of a survey':
+                junctions.filter(survey_id=survey_id, is_voted=True),
+            'Owners of a survey':
+                junctions.filter(survey_id=survey_id, is_owner=True),
+            'Surveys owned by a user':
+                junctions.filter(user_id=user_id, is_owner=True),
+            'Owner check':
+                junctions.filter(user_id=user_id, survey_id=survey_id,
+                                 is_owner=True),
+        }
+
+    @staticmethod
+    def drop_indexes():
+        # pylint: disable=protected-access
+        junction_table = UserSurveyJunctionModel._meta.db_table
+        with connection.cursor() as cursor:
+            for index in UserSurveyJunctionModel._meta.indexes:
+                cursor.execute(f'DROP INDEX {index.name}')
+            cursor.execute(
+                f'CREATE INDEX benchmark_junction_user_idx '
+                f'ON {junction_table} (user_id)'
+            )
+
+    def run_queries(self, queries, repeat):
+        for name, queryset in queries.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            self.stdout.write(self.style.SQL_KEYWORD(
+                f'{name}: {elapsed:.2f}ms per query'
+            ))
+            self.stdout.write(queryset.explain(analyze=True))
+
+    @staticmethod
+    def cleanup():
+        # pylint: disable=protected-access
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                DELETE FROM {UserSurveyJunctionModel._meta.db_table}
+                WHERE survey_id IN (
+                    SELECT id FROM {SurveyModel._meta.db_table}
+                    WHERE survey_question LIKE %(pattern)s
+                )
+            ''', {'pattern': f'{SEED_PREFIX}%'})
+            cursor.execute(f'''
+                DELETE FROM {SurveyModel._meta.db_table}
+                WHERE survey_question LIKE %(pattern)s
+            ''', {'pattern': f'{SEED_PREFIX}%'})
+            cursor.execute(f'''
+                DELETE FROM {User._meta.db_table}
+                WHERE username LIKE %(pattern)s
+            ''', {'pattern': f'{SEED_PREFIX}%'})
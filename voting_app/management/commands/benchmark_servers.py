@@ -0,0 +1,116 @@
+import asyncio
+import json
+from typing import List, Tuple
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from voting_app.benchmarks import (
+    get_http_requests, percentile, run_http_load,
+)
+from voting_app.models import SurveyModel
+
+ENDPOINTS = {
+    'retrieve': '{survey}/',
+    'list': '?page_size=50',
+    'vote': '{survey}/vote/',
+}
+VOTE_BODY = json.dumps({'voted_answer': 'yes'}).encode()
+
+
+def create_survey() -> SurveyModel:
+    return SurveyModel.objects.create(
+        survey_question='Benchmark survey',
+        answers={'yes': 0, 'no': 0},
+        finishing_date=timezone.now() + timezone.timedelta(days=1),
+    )
+
+
+def get_targets(values) -> List[Tuple[str, str]]:
+    targets = []
+    for target in values:
+        label, separator, url = target.partition('=')
+        if not separator:
+            raise CommandError(f'Expected label=url, got {target}')
+        targets.append((label, url))
+    return targets
+
+
+class Command(BaseCommand):
+    help = ('Load the survey endpoints of running servers, e.g. the WSGI '
+            'app and the async views under an ASGI server, and compare '
+            'their throughput and latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True,
+                            help='label=surveys base URL, e.g. '
+                                 'asgi=http://127.0.0.1:8001/api/async/surveys/'
+                                 ' Repeatable.')
+        parser.add_argument('--endpoint', action='append',
+                            choices=tuple(ENDPOINTS),
+                            help='Defaults to every endpoint.')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--survey', type=int,
+                            help='Survey to retrieve, a new one by default. '
+                                 'Votes always go to new surveys.')
+
+    def handle(self, *args, **options):
+        targets = get_targets(options['target'])
+        endpoints = options['endpoint'] or ENDPOINTS
+        surveys, voters = [], []
+        survey_id = options['survey']
+        try:
+            if survey_id is None:
+                surveys.append(create_survey())
+                survey_id = surveys[0].pk
+            tokens = (self.seed_voters(voters, options['requests'])
+                      if 'vote' in endpoints else [])
+            for endpoint in endpoints:
+                for label, url in targets:
+                    target_survey_id, request = survey_id, {}
+                    if endpoint == 'vote':
+                        # A new survey per target, which the voters haven't
+                        # voted in yet.
+                        surveys.append(create_survey())
+                        target_survey_id = surveys[-1].pk
+                        request = {'method': 'PATCH', 'body': VOTE_BODY,
+                                   'tokens': tokens}
+                    endpoint_url = url + ENDPOINTS[endpoint].format(
+                        survey=target_survey_id)
+                    self.run_benchmark(
+                        f'{endpoint} {label}', endpoint_url,
+                        options['concurrency'],
+                        get_http_requests(endpoint_url, options['requests'],
+                                          **request),
+                    )
+        finally:
+            SurveyModel.objects.filter(
+                pk__in=[survey.pk for survey in surveys]).delete()
+            User.objects.filter(pk__in=[voter.pk for voter in voters]).delete()
+
+    @staticmethod
+    def seed_voters(voters, count):
+        """Add ``count`` users to ``voters`` and return their tokens. Every
+        voter votes once, so each vote request has its own."""
+        voters.extend(User.objects.bulk_create(
+            User(username=f'benchmark_voter_{index}')
+            for index in range(count)
+        ))
+        return [
+            token.key for token in Token.objects.bulk_create(
+                Token(key=Token.generate_key(), user=voter)
+                for voter in voters
+            )
+        ]
+
+    def run_benchmark(self, label, url, concurrency, requests):
+        result = asyncio.run(run_http_load(url, requests, concurrency))
+        latencies = result['latencies']
+        self.stdout.write(
+            f'{label}: {len(latencies) / result["elapsed"]:.0f} req/s, '
+            f'p50 {percentile(latencies, 0.5) * 1000:.1f}ms, '
+            f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms, '
+            f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms, '
+            f'statuses {result["statuses"]}'
+        )
@@ -0,0 +1,146 @@
+import json
+import random
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from application.schema import get_code_version
+from voting_app.benchmarks import (
+    SCENARIOS, check_lost_votes, run_client_load, summarize_load,
+)
+from voting_app.buffer import is_vote_buffer_enabled
+from voting_app.models import SurveyModel
+from voting_app.utils import bulk_create_surveys
+
+User = get_user_model()
+
+ANSWERS = ('yes', 'no', 'maybe')
+
+
+class Command(BaseCommand):
+    help = ('Seed users, tokens and surveys, drive the survey endpoints '
+            'through the full request stack from concurrent clients and '
+            'report throughput, latency percentiles, queries per request '
+            'and lost votes. Do not run on production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append',
+                            choices=tuple(SCENARIOS),
+                            help='Defaults to every scenario.')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--surveys', type=int, default=10)
+        parser.add_argument('--shards', type=int, default=0,
+                            help='Counter shards of the seeded surveys.')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests of the create, list and retrieve '
+                                 'scenarios. Every user votes on every '
+                                 'survey.')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Client threads per process.')
+        parser.add_argument('--host', default='localhost',
+                            help='Host header, must be in ALLOWED_HOSTS.')
+        parser.add_argument('--json', dest='json_output',
+                            help='Write the report as JSON to this file, '
+                                 '"-" for stdout.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        randomizer = random.Random(options['seed'])
+        users, tokens, survey_ids = self.seed(options)
+        try:
+            report = {
+                'code_version': get_code_version(),
+                'vote_buffer': is_vote_buffer_enabled(),
+                'options': {
+                    name: options[name] for name in (
+                        'users', 'surveys', 'shards', 'requests',
+                        'processes', 'threads',
+                    )
+                },
+                'scenarios': {},
+            }
+            for scenario in options['scenario'] or SCENARIOS:
+                items = self.get_items(scenario, tokens, survey_ids,
+                                       options['requests'], randomizer)
+                result = summarize_load(run_client_load(
+                    scenario, items, options['processes'],
+                    options['threads'], options['host'],
+                ))
+                report['scenarios'][scenario] = result
+                self.write_result(scenario, result)
+                if scenario == 'vote':
+                    lost_votes = report['lost_votes'] = check_lost_votes(
+                        survey_ids)
+                    self.stdout.write(
+                        f'lost votes: {lost_votes["lost"]} '
+                        f'({lost_votes["counted"]} counted, '
+                        f'{lost_votes["voters"]} voters)'
+                    )
+        finally:
+            SurveyModel.objects.filter(
+                survey__user__in=users, survey__is_owner=True,
+            ).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        self.write_report(report, options['json_output'])
+        if report.get('lost_votes', {}).get('lost'):
+            raise CommandError(f'{report["lost_votes"]["lost"]} votes lost')
+
+    @staticmethod
+    def seed(options):
+        users = User.objects.bulk_create(
+            User(username=f'benchmark_client_{index}')
+            for index in range(options['users'])
+        )
+        tokens = Token.objects.bulk_create(
+            Token(key=Token.generate_key(), user=user) for user in users
+        )
+        surveys = bulk_create_surveys(
+            ({
+                'survey_question': f'Benchmark survey {index}',
+                'answers': list(ANSWERS),
+                'finishing_date': timezone.now() + timezone.timedelta(days=1),
+            } for index in range(options['surveys'])),
+            user=users[0],
+        )
+        survey_ids = [survey.pk for survey in surveys]
+        if options['shards']:
+            SurveyModel.objects.filter(pk__in=survey_ids).update(
+                shards_count=options['shards'])
+        return users, [token.key for token in tokens], survey_ids
+
+    @staticmethod
+    def get_items(scenario, tokens, survey_ids, requests, randomizer):
+        if scenario == 'vote':
+            # Interleaved, so concurrent clients vote on the same survey.
+            return [
+                (token, survey_id, randomizer.choice(ANSWERS))
+                for survey_id in survey_ids
+                for token in tokens
+            ]
+        return [
+            (tokens[index % len(tokens)],
+             survey_ids[index % len(survey_ids)],
+             None)
+            for index in range(requests)
+        ]
+
+    def write_result(self, scenario, result):
+        self.stdout.write(
+            f'{scenario}: {result["requests"]} requests, '
+            f'{result["throughput"]:.0f} req/s, '
+            f'p50 {result["p50_ms"]:.1f}ms, p95 {result["p95_ms"]:.1f}ms, '
+            f'p99 {result["p99_ms"]:.1f}ms, '
+            f'{result["queries_per_request"]} queries/request, '
+            f'statuses {result["statuses"]}'
+        )
+
+    def write_report(self, report, json_output):
+        if json_output is None:
+            return
+        content = json.dumps(report, indent=2, sort_keys=True)
+        if json_output == '-':
+            self.stdout.write(content)
+            return
+        with open(json_output, 'w', encoding='utf-8') as output:
+            output.write(content + '\n')
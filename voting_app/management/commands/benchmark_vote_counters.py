@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from voting_app.benchmarks import run_concurrently
+from voting_app.models import SurveyModel
+from voting_app.utils import perform_survey_vote
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Compare vote throughput of a single-row survey counter with '
+            'a sharded one under concurrent writers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16)
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        voters = User.objects.bulk_create(
+            User(username=f'benchmark_voter_{index}')
+            for index in range(options['votes'])
+        )
+        try:
+            for shards_count in (0, options['shards']):
+                self.run_benchmark(voters, shards_count, options['writers'])
+        finally:
+            User.objects.filter(pk__in=[voter.pk for voter in voters]).delete()
+
+    def run_benchmark(self, voters, shards_count, writers):
+        survey = SurveyModel.objects.create(
+            survey_question='Benchmark survey',
+            answers={'yes': 0, 'no': 0},
+            finishing_date=timezone.now() + timezone.timedelta(days=1),
+            shards_count=shards_count,
+        )
+        try:
+            elapsed = run_concurrently(
+                lambda voter: perform_survey_vote(survey.pk, voter, 'yes'),
+                voters,
+                writers,
+            )
+            survey.finish_survey()
+            survey.refresh_from_db()
+            counted = survey.answers['yes']
+        finally:
+            survey.delete()
+        label = f'{shards_count} shards' if shards_count else 'single row'
+        self.stdout.write(
+            f'{label}: {len(voters)} votes from {writers} writers in '
+            f'{elapsed:.2f}s ({len(voters) / elapsed:.0f} votes/s), '
+            f'{counted} counted'
+        )
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from voting_app.exports import (
+    stream_export, export_surveys, export_results, export_voters,
+)
+from voting_app.models import SurveyModel
+from voting_app import constants
+
+SURVEYS = 'surveys'
+RESULTS = 'results'
+VOTERS = 'voters'
+
+
+class Command(BaseCommand):
+    help = ('Stream surveys, their per-answer results or the voters of a '
+            'survey as CSV or NDJSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=(SURVEYS, RESULTS, VOTERS))
+        parser.add_argument('--survey', type=int, action='append',
+                            dest='surveys',
+                            help='Survey id, repeatable. Required for '
+                                 'voters, defaults to every survey.')
+        parser.add_argument('--format', default=constants.EXPORT_CSV,
+                            choices=(constants.EXPORT_CSV,
+                                     constants.EXPORT_NDJSON))
+        parser.add_argument('--output', default='-',
+                            help='Output file, or - for stdout.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=constants.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        export = self.get_export(options)
+        chunks = stream_export(export, options['format'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as stream:
+            stream.writelines(chunks)
+
+    @staticmethod
+    def get_export(options):
+        surveys = SurveyModel.objects.all()
+        if options['surveys']:
+            surveys = surveys.filter(pk__in=options['surveys'])
+        if options['kind'] == SURVEYS:
+            return export_surveys(surveys, options['chunk_size'])
+        if options['kind'] == RESULTS:
+            return export_results(surveys, options['chunk_size'])
+        if not options['surveys'] or len(options['surveys']) != 1:
+            raise CommandError('Exporting voters needs exactly one --survey')
+        survey = surveys.first()
+        if survey is None:
+            raise CommandError(f'Unknown survey {options["surveys"][0]}')
+        return export_voters(survey, options['chunk_size'])
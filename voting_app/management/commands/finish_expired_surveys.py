@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from voting_app.sweeper import finish_expired_surveys, get_sweeper_settings
+
+
+class Command(BaseCommand):
+    help = 'Finish every survey whose finishing date has passed.'
+
+    def add_arguments(self, parser):
+        sweeper_settings = get_sweeper_settings()
+        parser.add_argument('--batch-size', type=int,
+                            default=sweeper_settings['BATCH_SIZE'])
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep sweeping every --interval seconds.')
+        parser.add_argument('--interval', type=float,
+                            default=sweeper_settings['INTERVAL'])
+
+    def handle(self, *args, **options):
+        while True:
+            finished_count, elapsed = finish_expired_surveys(
+                options['batch_size']
+            )
+            self.stdout.write(
+                f'Finished {finished_count} surveys in {elapsed:.3f}s'
+            )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
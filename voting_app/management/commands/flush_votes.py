@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from voting_app.buffer import create_vote_buffer, get_buffer_settings
+
+
+class Command(BaseCommand):
+    help = 'Count the votes waiting in the shared vote buffer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep flushing every FLUSH_INTERVAL seconds.',
+        )
+
+    def handle(self, *args, **options):
+        vote_buffer = create_vote_buffer()
+        interval = get_buffer_settings()['FLUSH_INTERVAL']
+        while True:
+            flushed = vote_buffer.drain()
+            if options['verbosity'] > 1 or not options['loop']:
+                self.stdout.write(f'Flushed {flushed} votes')
+            if not options['loop']:
+                return
+            time.sleep(interval)
@@ -0,0 +1,66 @@
+import csv
+from functools import partial
+from typing import Iterator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from application.imports import (
+    InvalidRow, add_input_arguments, get_input_format, open_input,
+    read_chunks,
+)
+from voting_app.serializers import SurveyCreateRequestSerializer
+from voting_app.utils import bulk_create_surveys
+
+
+def read_csv(stream, answers_separator: str) -> Iterator[dict]:
+    for row in csv.DictReader(stream):
+        answers = row.get('answers') or ''
+        yield {**row, 'answers': answers.split(answers_separator)}
+
+
+class Command(BaseCommand):
+    help = ('Create surveys from a CSV (survey_question, answers, '
+            'finishing_date columns) or NDJSON file, in chunks.')
+
+    def add_arguments(self, parser):
+        add_input_arguments(parser)
+        parser.add_argument('--owner', required=True,
+                            help='Username of the surveys owner.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--answers-separator', default='|',
+                            help='Separates the answers of a CSV row.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = get_user_model().objects.get(username=options['owner'])
+        except get_user_model().DoesNotExist as error:
+            raise CommandError(f'Unknown user {options["owner"]}') from error
+        with open_input(options['path']) as stream:
+            self.import_stream(stream, owner, get_input_format(options),
+                               options)
+
+    def import_stream(self, stream, owner, input_format, options):
+        created_count = 0
+        skipped_count = 0
+        chunks = read_chunks(
+            stream, input_format, options['chunk_size'],
+            read_csv=partial(read_csv,
+                             answers_separator=options['answers_separator']),
+        )
+        for chunk in chunks:
+            valid_surveys = []
+            for number, row in chunk:
+                if isinstance(row, InvalidRow):
+                    skipped_count += 1
+                    self.stderr.write(f'Row {number} skipped: {row.error}')
+                    continue
+                serializer = SurveyCreateRequestSerializer(data=row)
+                if serializer.is_valid():
+                    valid_surveys.append(serializer.validated_data)
+                else:
+                    skipped_count += 1
+                    self.stderr.write(f'Row {number} skipped: {serializer.errors}')
+            if valid_surveys:
+                created_count += len(bulk_create_surveys(valid_surveys, owner))
+        self.stdout.write(
+            f'Created {created_count} surveys, skipped {skipped_count} rows'
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from voting_app.vote_log import (
+    find_vote_drift, fix_vote_drift, iter_survey_chunks,
+)
+
+
+class Command(BaseCommand):
+    help = ('Recount the votes of surveys from the vote event log and '
+            'report, or fix, the answer counters that drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('surveys', nargs='*', type=int,
+                            help='Survey ids, defaults to every survey.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Surveys recounted per query.')
+        parser.add_argument('--fix', action='store_true',
+                            help='Reset drifted counters to the log.')
+
+    def handle(self, *args, **options):
+        reconcile = fix_vote_drift if options['fix'] else find_vote_drift
+        checked_count = drifted_count = 0
+        for survey_ids in iter_survey_chunks(options['chunk_size'],
+                                             options['surveys'] or None):
+            checked_count += len(survey_ids)
+            for survey_id, answer, stored, logged in reconcile(survey_ids):
+                drifted_count += 1
+                self.stdout.write(
+                    f'Survey {survey_id}, answer {answer!r}: '
+                    f'counted {stored}, logged {logged}'
+                )
+        action = 'Fixed' if options['fix'] else 'Found'
+        self.stdout.write(
+            f'{action} {drifted_count} drifted answers '
+            f'in {checked_count} surveys'
+        )
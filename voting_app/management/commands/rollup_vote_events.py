@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from voting_app.vote_log import get_rollup_settings, roll_up_vote_events
+
+
+class Command(BaseCommand):
+    help = 'Fold new vote events into the per-answer vote tally.'
+
+    def add_arguments(self, parser):
+        rollup_settings = get_rollup_settings()
+        parser.add_argument('--batch-size', type=int,
+                            default=rollup_settings['BATCH_SIZE'])
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep rolling up every --interval seconds.')
+        parser.add_argument('--interval', type=float,
+                            default=rollup_settings['INTERVAL'])
+
+    def handle(self, *args, **options):
+        while True:
+            rolled_up_count, elapsed = roll_up_vote_events(
+                options['batch_size'],
+            )
+            self.stdout.write(
+                f'Rolled up {rolled_up_count} vote events in {elapsed:.3f}s'
+            )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
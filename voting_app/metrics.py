@@ -0,0 +1,488 @@
+"""Per-endpoint request metrics in the Prometheus text format.
+
+Every thread records into its own aggregates, so recording takes no lock;
+a scrape merges them. Aggregates of finished threads are folded into a
+retired set when their thread is collected.
+
+Pre-fork servers run one collector per worker. With
+``METRICS['MULTIPROCESS_DIR']`` set, every process writes its snapshot to
+its own file in that directory at most every ``FLUSH_INTERVAL`` seconds and
+on exit, and a scrape adds up the files of the other processes. When a
+worker exits, the master folds its file into a single aggregate of exited
+workers and removes it (``fold_worker_snapshots``), so counters never go
+backwards and recycled workers do not pile up files. The directory is
+emptied when the server starts (see ``gunicorn.conf.py``).
+
+``/metrics`` answers 404 unless ``METRICS['TOKEN']`` is set, and then only
+to ``Authorization: Bearer <TOKEN>``.
+"""
+import atexit
+import hmac
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from bisect import bisect_left
+from contextlib import ExitStack
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+from application.middleware import HybridMiddleware
+from .result_cache import stats as result_cache_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 10.0,
+    'TOKEN': None,
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE',
+                     'OPTIONS'))
+
+UNMATCHED = 'unmatched'
+
+# Samples of exited workers in MULTIPROCESS_DIR, not matched by
+# list_snapshots().
+EXITED_WORKERS = 'exited-workers.agg'
+
+
+class Metric(NamedTuple):
+    name: str
+    help: str
+    labels: Tuple[str, ...]
+    # None for counters.
+    buckets: Optional[Tuple[float, ...]] = None
+
+    @property
+    def type(self) -> str:
+        return 'counter' if self.buckets is None else 'histogram'
+
+
+REQUEST_DURATION = Metric(
+    'http_request_duration_seconds',
+    'Time to build the response, by view action.',
+    ('action', 'method'),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+RESPONSES = Metric(
+    'http_responses_total',
+    'Responses by view action and status code.',
+    ('action', 'method', 'status'),
+)
+RESPONSE_SIZE = Metric(
+    'http_response_size_bytes',
+    'Size of the non-streaming response bodies.',
+    ('action',),
+    (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152),
+)
+DB_QUERIES = Metric(
+    'db_queries_per_request',
+    'Database queries run while building the response.',
+    ('action',),
+    (0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_DURATION = Metric(
+    'db_query_duration_seconds_total',
+    'Time spent in database queries.',
+    ('action',),
+)
+RESULT_CACHE_LOOKUPS = Metric(
+    'survey_result_cache_lookups_total',
+    'Survey result cache lookups.',
+    ('result',),
+)
+TOKEN_CACHE_LOOKUPS = Metric(
+    'token_cache_lookups_total',
+    'Token authentication cache lookups.',
+    ('result',),
+)
+
+METRICS = (REQUEST_DURATION, RESPONSES, RESPONSE_SIZE, DB_QUERIES,
+           DB_DURATION, RESULT_CACHE_LOOKUPS, TOKEN_CACHE_LOOKUPS)
+
+# {(metric name, label values): values}. Histograms hold a count per
+# bucket, one for +Inf and their sum; counters hold their value.
+Samples = Dict[Tuple[str, Tuple[str, ...]], List[float]]
+
+
+def get_metrics_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+def merge_samples(target: Samples, samples: Samples):
+    for key, values in samples.items():
+        merged = target.get(key)
+        if merged is None:
+            target[key] = list(values)
+        else:
+            for index, value in enumerate(values):
+                merged[index] += value
+
+
+class Aggregates:
+    """Samples of one thread, only written by that thread."""
+
+    def __init__(self):
+        self.samples: Samples = {}
+
+    def get_values(self, metric: Metric, labels: Tuple[str, ...]) -> list:
+        values = self.samples.get((metric.name, labels))
+        if values is None:
+            size = 1 if metric.buckets is None else len(metric.buckets) + 2
+            values = self.samples[(metric.name, labels)] = [0] * size
+        return values
+
+    def observe(self, metric: Metric, labels: Tuple[str, ...], value: float):
+        values = self.get_values(metric, labels)
+        values[bisect_left(metric.buckets, value)] += 1
+        values[-1] += value
+
+    def inc(self, metric: Metric, labels: Tuple[str, ...], value: float = 1):
+        self.get_values(metric, labels)[0] += value
+
+    def copy(self) -> Samples:
+        # dict.copy() runs without releasing the GIL, so it is safe while
+        # the owner thread adds samples.
+        return {key: list(values)
+                for key, values in self.samples.copy().items()}
+
+
+class MetricsCollector:
+
+    def __init__(self):
+        # Reentrant: thread finalizers may run wherever the lock is held.
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.live: List[Aggregates] = []
+        self.retired: Samples = {}
+        self.flush_lock = threading.Lock()
+        self.flushed_at = 0.0
+        # ((pid, directory), path) of the snapshot file of this process.
+        self.snapshot = (None, None)
+
+    def get_aggregates(self) -> Aggregates:
+        aggregates = getattr(self.local, 'aggregates', None)
+        if aggregates is None:
+            aggregates = self.local.aggregates = Aggregates()
+            with self.lock:
+                self.live.append(aggregates)
+            weakref.finalize(threading.current_thread(), self.retire,
+                             aggregates)
+        return aggregates
+
+    def retire(self, aggregates: Aggregates):
+        with self.lock:
+            if aggregates in self.live:
+                self.live.remove(aggregates)
+                merge_samples(self.retired, aggregates.samples)
+
+    def collect(self) -> Samples:
+        """Samples of this process."""
+        with self.lock:
+            samples = {key: list(values)
+                       for key, values in self.retired.items()}
+            live = list(self.live)
+        for aggregates in live:
+            merge_samples(samples, aggregates.copy())
+        for metric, stats, results in (
+                (RESULT_CACHE_LOOKUPS, result_cache_stats.as_dict(),
+                 ('hits', 'misses')),
+                (TOKEN_CACHE_LOOKUPS, get_token_cache_stats(),
+                 ('hits', 'shared_hits', 'misses'))):
+            for result in results:
+                samples[(metric.name, (result,))] = [stats[result]]
+        return samples
+
+    def clear(self):
+        with self.lock:
+            for aggregates in self.live:
+                aggregates.samples.clear()
+            self.retired.clear()
+
+    def get_snapshot_path(self, directory: str) -> str:
+        # A new file after a fork, so workers never overwrite each other.
+        owner, path = self.snapshot
+        if owner != (os.getpid(), directory):
+            path = os.path.join(
+                directory, f'{os.getpid()}-{uuid.uuid4().hex}.json')
+            self.snapshot = ((os.getpid(), directory), path)
+        return path
+
+    def flush(self, force: bool = False):
+        """Write the snapshot of this process, at most every
+        ``FLUSH_INTERVAL`` seconds unless ``force``d."""
+        metrics_settings = get_metrics_settings()
+        directory = metrics_settings['MULTIPROCESS_DIR']
+        if directory is None:
+            return
+        now = time.monotonic()
+        if (not force and now - self.flushed_at
+                < metrics_settings['FLUSH_INTERVAL']):
+            return
+        # Other threads skip the flush instead of waiting for it.
+        if not self.flush_lock.acquire(  # pylint: disable=consider-using-with
+                blocking=force):
+            return
+        try:
+            self.flushed_at = now
+            write_snapshot(self.get_snapshot_path(str(directory)),
+                           self.collect())
+        except OSError:
+            logger.exception('Writing the metrics snapshot failed')
+        finally:
+            self.flush_lock.release()
+
+    def collect_all(self) -> Samples:
+        """Samples of this process and of the snapshots of the others."""
+        samples = self.collect()
+        directory = get_metrics_settings()['MULTIPROCESS_DIR']
+        if directory is None:
+            return samples
+        own_path = self.get_snapshot_path(str(directory))
+        snapshots = {path: read_snapshot(path)
+                     for path in list_snapshots(str(directory))
+                     if path != own_path}
+        # Read after the snapshots: a file folded in the meantime is then
+        # listed as folded, and counted once.
+        exited, folded = read_exited_workers(str(directory))
+        merge_samples(samples, exited)
+        for path, snapshot in snapshots.items():
+            if os.path.basename(path) not in folded:
+                merge_samples(samples, snapshot)
+        return samples
+
+
+def get_token_cache_stats() -> dict:
+    # pylint: disable=import-outside-toplevel
+    # accounts.authentication imports models, so not when settings load.
+    from accounts.authentication import stats
+    return stats.as_dict()
+
+
+def write_snapshot(path: str, samples: Samples):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as snapshot:
+        json.dump([[name, labels, values]
+                   for (name, labels), values in samples.items()], snapshot)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str) -> Samples:
+    try:
+        with open(path, encoding='utf-8') as snapshot:
+            return {(name, tuple(labels)): values
+                    for name, labels, values in json.load(snapshot)}
+    except (OSError, ValueError):
+        # Removed or not fully written, the next scrape will have it.
+        return {}
+
+
+def list_snapshots(directory: str) -> List[str]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name)
+            for name in names if name.endswith('.json')]
+
+
+def read_exited_workers(directory: str) -> Tuple[Samples, List[str]]:
+    """Samples of the exited workers, and the names of the snapshot files
+    they include."""
+    try:
+        with open(os.path.join(directory, EXITED_WORKERS),
+                  encoding='utf-8') as aggregate:
+            data = json.load(aggregate)
+    except (OSError, ValueError):
+        return {}, []
+    return ({(name, tuple(labels)): values
+             for name, labels, values in data['samples']}, data['folded'])
+
+
+def fold_worker_snapshots(pid: int):
+    """Fold the snapshots of the exited worker ``pid`` into the aggregate
+    of exited workers, and remove them. Only called by the gunicorn master,
+    so folds never run concurrently."""
+    directory = get_metrics_settings()['MULTIPROCESS_DIR']
+    if directory is None:
+        return
+    directory = str(directory)
+    paths = [path for path in list_snapshots(directory)
+             if os.path.basename(path).startswith(f'{pid}-')]
+    if not paths:
+        return
+    samples, folded = read_exited_workers(directory)
+    for path in paths:
+        merge_samples(samples, read_snapshot(path))
+    names = [os.path.basename(path) for path in paths]
+    # Files folded before are gone, unless their removal failed.
+    folded = [name for name in folded
+              if os.path.exists(os.path.join(directory, name))] + names
+    aggregate_path = os.path.join(directory, EXITED_WORKERS)
+    temporary_path = f'{aggregate_path}.tmp'
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as aggregate:
+            json.dump({'folded': folded,
+                       'samples': [[name, labels, values] for
+                                   (name, labels), values in samples.items()]},
+                      aggregate)
+        os.replace(temporary_path, aggregate_path)
+        for path in paths:
+            os.remove(path)
+    except OSError:
+        logger.exception('Folding the metrics snapshot of worker %s failed',
+                         pid)
+
+
+def clear_multiprocess_dir():
+    """Drop the snapshots of a previous server run."""
+    directory = get_metrics_settings()['MULTIPROCESS_DIR']
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+collector = MetricsCollector()
+atexit.register(collector.flush, force=True)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    )
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(samples: Samples) -> str:
+    lines = []
+    for metric in METRICS:
+        series = sorted((labels, values)
+                        for (name, labels), values in samples.items()
+                        if name == metric.name)
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for labels, values in series:
+            if metric.buckets is None:
+                lines.append(f'{metric.name}'
+                             f'{format_labels(metric.labels, labels)} '
+                             f'{format_number(values[0])}')
+                continue
+            count = 0
+            for bucket, bucket_count in zip(
+                    (*map(format_number, metric.buckets), '+Inf'),
+                    values[:-1]):
+                count += bucket_count
+                bucket_labels = format_labels(
+                    (*metric.labels, 'le'), (*labels, bucket))
+                lines.append(f'{metric.name}_bucket{bucket_labels} {count}')
+            metric_labels = format_labels(metric.labels, labels)
+            lines.append(f'{metric.name}_sum{metric_labels} '
+                         f'{format_number(values[-1])}')
+            lines.append(f'{metric.name}_count{metric_labels} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_scraper(request) -> bool:
+    token = get_metrics_settings()['TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+
+def metrics_view(request):
+    # Not found rather than forbidden, so scans do not learn of it.
+    if not is_scraper(request):
+        raise Http404()
+    return HttpResponse(render_metrics(collector.collect_all()),
+                        content_type=CONTENT_TYPE)
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` counting and timing queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def get_view_action(request) -> str:
+    """The ``SurveyApiViewSet.action`` (see ``constants``) of viewset
+    requests, the URL name of the other views."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED
+    actions = getattr(match.func, 'actions', None)
+    if actions and request.method.lower() in actions:
+        return actions[request.method.lower()]
+    return match.url_name or match.view_name
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Records latency, queries and response size of every request.
+
+    Queries run by streaming response bodies or in other threads, such as
+    the async views' ORM pool or sync views under ASGI, are not counted.
+    """
+
+    def __init__(self, get_response):
+        if not get_metrics_settings()['ENABLED']:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def handle(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def ahandle(self, request):
+        # Connections are per thread, and no query runs on the event loop.
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, None)
+        return response
+
+    @staticmethod
+    def record(request, response, duration: float,
+               timer: Optional[QueryTimer]):
+        action = get_view_action(request)
+        method = request.method if request.method in METHODS else 'OTHER'
+        aggregates = collector.get_aggregates()
+        aggregates.observe(REQUEST_DURATION, (action, method), duration)
+        aggregates.inc(RESPONSES,
+                       (action, method, str(response.status_code)))
+        if not response.streaming:
+            aggregates.observe(RESPONSE_SIZE, (action,),
+                               len(response.content))
+        if timer is not None:
+            aggregates.observe(DB_QUERIES, (action,), timer.count)
+            aggregates.inc(DB_DURATION, (action,), timer.duration)
+        collector.flush()
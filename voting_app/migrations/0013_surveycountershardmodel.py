@@ -0,0 +1,32 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0012_alter_usersurveyjunctionmodel_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveymodel',
+            name='shards_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SurveyCounterShardModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.CharField(max_length=80)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='voting_app.surveymodel')),
+            ],
+            options={
+                'unique_together': {('survey', 'answer', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0014_pendingvotemodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='surveymodel',
+            index=models.Index(fields=['finishing_date', 'id'], name='survey_finishing_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='surveymodel',
+            index=models.Index(fields=['is_finished', 'id'], name='survey_is_finished_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='surveymodel',
+            index=models.Index(fields=['is_finished', 'finishing_date', 'id'], name='survey_finished_date_idx'),
+        ),
+    ]
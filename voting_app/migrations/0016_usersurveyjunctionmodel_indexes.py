@@ -0,0 +1,65 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:21
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_user_index_concurrently(apps, schema_editor):
+    model = apps.get_model('voting_app', 'UserSurveyJunctionModel')
+    for index_name in schema_editor._constraint_names(
+            model, ['user_id'], index=True, unique=False):
+        schema_editor.execute(
+            f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(index_name)}'
+        )
+
+
+def create_user_index_concurrently(apps, schema_editor):
+    model = apps.get_model('voting_app', 'UserSurveyJunctionModel')
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+        f'{schema_editor.quote_name(model._meta.db_table + "_user_id")} '
+        f'ON {schema_editor.quote_name(model._meta.db_table)} (user_id)'
+    )
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction, and
+    # doesn't block writes to the table while the index is built.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('voting_app', '0015_surveymodel_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='usersurveyjunctionmodel',
+            index=models.Index(condition=models.Q(('is_voted', True)), fields=['survey'], name='junction_survey_voted_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersurveyjunctionmodel',
+            index=models.Index(condition=models.Q(('is_owner', True)), fields=['survey'], name='junction_survey_owner_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersurveyjunctionmodel',
+            index=models.Index(condition=models.Q(('is_owner', True)), fields=['user', 'survey'], name='junction_user_owner_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='usersurveyjunctionmodel',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='users', related_query_name='user', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(
+                    drop_user_index_concurrently,
+                    create_user_index_concurrently,
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# One statement each way, whatever the number of surveys.
+COPY_ANSWERS_TO_OPTIONS = '''
+    INSERT INTO voting_app_answeroptionmodel
+        (survey_id, label, position, vote_count)
+    SELECT survey.id, answer.key, answer.position - 1, answer.value::integer
+    FROM voting_app_surveymodel AS survey,
+        jsonb_each_text(COALESCE(survey.answers, '{}'::jsonb))
+            WITH ORDINALITY AS answer (key, value, position)
+'''
+
+COPY_OPTIONS_TO_ANSWERS = '''
+    UPDATE voting_app_surveymodel AS survey
+    SET answers = options.answers
+    FROM (
+        SELECT survey_id,
+            jsonb_object_agg(label, vote_count ORDER BY position) AS answers
+        FROM voting_app_answeroptionmodel
+        GROUP BY survey_id
+    ) AS options
+    WHERE survey.id = options.survey_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0016_usersurveyjunctionmodel_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerOptionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=80)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('vote_count', models.PositiveIntegerField(default=0)),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='options', to='voting_app.surveymodel')),
+            ],
+            options={
+                'ordering': ('position',),
+                'unique_together': {('survey', 'label')},
+            },
+        ),
+        migrations.RunSQL(COPY_ANSWERS_TO_OPTIONS, COPY_OPTIONS_TO_ANSWERS),
+        migrations.AlterField(
+            model_name='surveymodel',
+            name='answers',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RemoveField(
+            model_name='surveymodel',
+            name='answers',
+        ),
+    ]
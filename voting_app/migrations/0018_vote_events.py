@@ -0,0 +1,71 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def log_existing_votes(apps, schema_editor):
+    """Log the votes counted so far as anonymous events, so the log adds
+    up to the current counters."""
+    AnswerOptionModel = apps.get_model('voting_app', 'AnswerOptionModel')
+    SurveyCounterShardModel = apps.get_model('voting_app',
+                                             'SurveyCounterShardModel')
+    VoteEventModel = apps.get_model('voting_app', 'VoteEventModel')
+    schema_editor.execute(f'''
+        INSERT INTO {VoteEventModel._meta.db_table}
+            (user_id, survey_id, answer, created_at)
+        SELECT NULL, counted.survey_id, counted.answer, NOW()
+        FROM (
+            SELECT survey_id, label AS answer, vote_count AS votes
+            FROM {AnswerOptionModel._meta.db_table}
+            UNION ALL
+            SELECT survey_id, answer, count
+            FROM {SurveyCounterShardModel._meta.db_table}
+        ) AS counted
+        CROSS JOIN generate_series(1, counted.votes)
+    ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('voting_app', '0017_answeroptionmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollupCheckpointModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteEventModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.CharField(max_length=80)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_events', to='voting_app.surveymodel')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteTallyModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.CharField(max_length=80)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_tallies', to='voting_app.surveymodel')),
+            ],
+            options={
+                'unique_together': {('survey', 'answer')},
+            },
+        ),
+        migrations.RunPython(log_existing_votes, migrations.RunPython.noop),
+    ]
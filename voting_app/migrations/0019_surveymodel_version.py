@@ -0,0 +1,24 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0018_vote_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveymodel',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='surveymodel',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
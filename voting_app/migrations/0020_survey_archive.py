@@ -0,0 +1,59 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('voting_app', '0019_surveymodel_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedUserSurveyJunctionModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_owner', models.BooleanField(default=False)),
+                ('is_voted', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SurveySnapshotModel',
+            fields=[
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='voting_app.surveymodel')),
+                ('answers', models.JSONField()),
+                ('voters_count', models.PositiveIntegerField()),
+                ('voter_bitmap', models.BinaryField(null=True)),
+                ('content', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='surveymodel',
+            name='is_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='surveymodel',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_finished', True)), fields=['finishing_date', 'id'], name='survey_archivable_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedusersurveyjunctionmodel',
+            name='survey',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_junctions', to='voting_app.surveymodel'),
+        ),
+        migrations.AddField(
+            model_name='archivedusersurveyjunctionmodel',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_junctions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedusersurveyjunctionmodel',
+            unique_together={('survey', 'user')},
+        ),
+    ]
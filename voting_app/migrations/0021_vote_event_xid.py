@@ -0,0 +1,31 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:58
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and doesn't
+    # block the vote writes to the event log while the index is built.
+    atomic = False
+
+    dependencies = [
+        ('voting_app', '0020_survey_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voteeventmodel',
+            name='xid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='voterollupcheckpointmodel',
+            name='last_xid',
+            field=models.BigIntegerField(default=0),
+        ),
+        AddIndexConcurrently(
+            model_name='voteeventmodel',
+            index=models.Index(fields=['xid', 'id'], name='vote_event_xid_idx'),
+        ),
+    ]
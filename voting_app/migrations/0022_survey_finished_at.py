@@ -0,0 +1,41 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:30
+
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently, RemoveIndexConcurrently,
+)
+from django.db import migrations, models
+
+
+def set_finished_at(apps, schema_editor):
+    # Surveys finished before the column existed: their last change is
+    # the closest record of when that happened.
+    SurveyModel = apps.get_model('voting_app', 'SurveyModel')
+    SurveyModel.objects.filter(is_finished=True).update(
+        finished_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction, and
+    # doesn't block writes to the table while the index is built.
+    atomic = False
+
+    dependencies = [
+        ('voting_app', '0021_vote_event_xid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveymodel',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_finished_at, migrations.RunPython.noop),
+        RemoveIndexConcurrently(
+            model_name='surveymodel',
+            name='survey_archivable_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='surveymodel',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_finished', True)), fields=['finished_at', 'id'], name='survey_archivable_idx'),
+        ),
+    ]
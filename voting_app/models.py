@@ -1,30 +1,250 @@
-from django.db import models
+import json
+from typing import Dict, Iterable, List
+from django.db import models, connection, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from .result_cache import bump_survey_versions_on_commit
+
+
+class SurveyManager(models.Manager):
+
+    @transaction.atomic
+    def create(self, answers: Dict[str, int] = None, **kwargs):
+        """Create a survey with one ``AnswerOptionModel`` per answer of
+        ``{answer: votes}``, keeping their order."""
+        survey = super().create(**kwargs)
+        AnswerOptionModel.objects.bulk_create(
+            AnswerOptionModel.for_answers(survey, answers or {})
+        )
+        return survey
+
+    def fold_counter_shards(self, survey_ids: Iterable[int]) -> List[int]:
+        """Move sharded vote counts into the answer options and drop the
+        shards. Returns the ids of the surveys that had shards."""
+        with connection.cursor() as cursor:
+            # pylint: disable=protected-access
+            cursor.execute(f'''
+                WITH folded AS (
+                    DELETE FROM {SurveyCounterShardModel._meta.db_table}
+                    WHERE survey_id = ANY(%(surveys)s)
+                    RETURNING survey_id, answer, count
+                ), totals AS (
+                    SELECT survey_id, answer, SUM(count) AS total
+                    FROM folded
+                    GROUP BY survey_id, answer
+                )
+                UPDATE {AnswerOptionModel._meta.db_table} AS option
+                SET vote_count = option.vote_count + totals.total
+                FROM totals
+                WHERE option.survey_id = totals.survey_id
+                    AND option.label = totals.answer
+                RETURNING option.survey_id
+            ''', {'surveys': list(survey_ids)})
+            # pylint: enable=protected-access
+            return list({survey_id for survey_id, in cursor.fetchall()})
+
+    @transaction.atomic
+    def finish_expired(self, limit: int) -> List[int]:
+        """Finish up to ``limit`` expired surveys with one UPDATE.
+
+        Sharded counters of the finished surveys are folded, so their
+        answer options hold the final results. Returns the finished ids.
+        """
+        with connection.cursor() as cursor:
+            # pylint: disable=protected-access
+            cursor.execute(f'''
+                UPDATE {self.model._meta.db_table}
+                SET is_finished = TRUE,
+                    finished_at = NOW(),
+                    version = version + 1,
+                    updated_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM {self.model._meta.db_table}
+                    WHERE NOT is_finished AND finishing_date <= NOW()
+                    ORDER BY finishing_date
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, shards_count
+            ''', {'limit': limit})
+            # pylint: enable=protected-access
+            finished = cursor.fetchall()
+        sharded_ids = [survey_id for survey_id, shards in finished if shards]
+        if sharded_ids:
+            self.fold_counter_shards(sharded_ids)
+        finished_ids = [survey_id for survey_id, _ in finished]
+        bump_survey_versions_on_commit(finished_ids)
+        return finished_ids
+
+    def add_votes(self, counts: Dict[int, Dict[str, int]]):
+        """Add ``{survey_id: {answer: votes}}`` to the answer options.
+
+        Every option row is updated once, whatever the number of votes.
+        """
+        # pylint: disable=protected-access
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {AnswerOptionModel._meta.db_table} AS option
+                SET vote_count = option.vote_count + delta.votes
+                FROM (
+                    SELECT survey.key::bigint AS survey_id,
+                           answer.key AS label,
+                           answer.value::integer AS votes
+                    FROM jsonb_each(%(counts)s::jsonb) AS survey,
+                         jsonb_each_text(survey.value) AS answer
+                ) AS delta
+                WHERE option.survey_id = delta.survey_id
+                    AND option.label = delta.label
+            ''', {'counts': json.dumps(counts)})
+
+    def bump_versions(self, survey_ids: Iterable[int]):
+        self.filter(pk__in=list(survey_ids)).update(
+            version=models.F('version') + 1,
+            updated_at=timezone.now(),
+        )
 
 
 class SurveyModel(models.Model):
     survey_question = models.CharField(max_length=50)
-    answers = models.JSONField()
     finishing_date = models.DateTimeField()
     is_finished = models.BooleanField(default=False)
+    # When is_finished was set, which the archiver counts from.
+    finished_at = models.DateTimeField(null=True, blank=True)
+    shards_count = models.PositiveSmallIntegerField(default=0)
+    # Set once the voters were moved to the archive, see archive.py.
+    is_archived = models.BooleanField(default=False)
+    # Bumped by every change of the survey but votes; the ETag of its
+    # results adds their vote total, so votes never write this row.
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = SurveyManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['finishing_date', 'id'],
+                         name='survey_finishing_date_idx'),
+            models.Index(fields=['is_finished', 'id'],
+                         name='survey_is_finished_idx'),
+            models.Index(fields=['is_finished', 'finishing_date', 'id'],
+                         name='survey_finished_date_idx'),
+            models.Index(fields=['finished_at', 'id'],
+                         condition=models.Q(is_finished=True,
+                                            is_archived=False),
+                         name='survey_archivable_idx'),
+        ]
 
     def __str__(self):
         return f'{self.survey_question}'
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'is_finished' in update_fields:
+            if not self.is_finished:
+                self.finished_at = None
+            elif self.finished_at is None:
+                self.finished_at = timezone.now()
+            if update_fields is not None:
+                update_fields = kwargs['update_fields'] = {
+                    *update_fields, 'finished_at',
+                }
+        if not self._state.adding and update_fields != []:
+            self.version = models.F('version') + 1
+            self.updated_at = timezone.now()
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'version', 'updated_at',
+                }
+        super().save(*args, **kwargs)
+        if isinstance(self.version, models.Expression):
+            # Deferred, so it is read back from the database when used.
+            del self.version
+
+    @property
+    def answers(self) -> Dict[str, int]:
+        # Counter shards are only included in options loaded with_votes().
+        return {option.label: getattr(option, 'votes', option.vote_count)
+                for option in self.options.all()}
+
     def can_vote(self):
         return not self.is_finished and self.finishing_date > timezone.now()
 
+    def fold_counter_shards(self):
+        if SurveyModel.objects.fold_counter_shards([self.pk]):
+            getattr(self, '_prefetched_objects_cache', {}).pop('options', None)
+
     def finish_survey(self):
+        self.fold_counter_shards()
         self.is_finished = True
         self.save(update_fields=['is_finished'])
+        bump_survey_versions_on_commit([self.pk])
+
+
+class AnswerOptionQuerySet(models.QuerySet):
+
+    def with_votes(self):
+        """Annotates ``votes``, the counter plus the counter shards that
+        were not folded yet, so reads never have to fold them."""
+        sharded_votes = SurveyCounterShardModel.objects.filter(
+            survey=models.OuterRef('survey'),
+            answer=models.OuterRef('label'),
+        ).values('survey', 'answer').annotate(
+            votes=models.Sum('count')).values('votes')
+        return self.annotate(votes=models.F('vote_count') + Coalesce(
+            models.Subquery(sharded_votes,
+                            output_field=models.IntegerField()), 0,
+        ))
+
+
+class AnswerOptionModel(models.Model):
+    survey = models.ForeignKey(SurveyModel,
+                               on_delete=models.CASCADE,
+                               related_name='options')
+    label = models.CharField(max_length=80)
+    position = models.PositiveSmallIntegerField()
+    vote_count = models.PositiveIntegerField(default=0)
+
+    objects = AnswerOptionQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('survey', 'label')
+        ordering = ('position',)
+
+    def __str__(self):
+        return f'Survey: {self.survey}, Answer: {self.label}'
+
+    @classmethod
+    def for_answers(cls, survey: SurveyModel,
+                    answers: Dict[str, int]) -> List['AnswerOptionModel']:
+        return [
+            cls(survey=survey, label=label, position=position, vote_count=votes)
+            for position, (label, votes) in enumerate(answers.items())
+        ]
+
+
+class SurveyCounterShardModel(models.Model):
+    survey = models.ForeignKey(SurveyModel,
+                               on_delete=models.CASCADE,
+                               related_name='counter_shards')
+    answer = models.CharField(max_length=80)
+    shard = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('survey', 'answer', 'shard')
+
+    def __str__(self):
+        return f'Survey: {self.survey}, Answer: {self.answer}, Shard: {self.shard}'
 
 
 class UserSurveyJunctionModel(models.Model):
+    # Lookups by user are served by the (user, survey) unique index.
     user = models.ForeignKey(get_user_model(),
                              on_delete=models.CASCADE,
                              related_name='users',
-                             related_query_name='user')
+                             related_query_name='user',
+                             db_index=False)
     survey = models.ForeignKey(SurveyModel,
                                on_delete=models.CASCADE,
                                related_name='surveys',
@@ -34,6 +254,124 @@ class UserSurveyJunctionModel(models.Model):
 
     class Meta:
         unique_together = ('user', 'survey')
+        indexes = [
+            models.Index(fields=['survey'],
+                         condition=models.Q(is_voted=True),
+                         name='junction_survey_voted_idx'),
+            models.Index(fields=['survey'],
+                         condition=models.Q(is_owner=True),
+                         name='junction_survey_owner_idx'),
+            models.Index(fields=['user', 'survey'],
+                         condition=models.Q(is_owner=True),
+                         name='junction_user_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f'User: {self.user}, Survey: {self.survey}'
+
+
+class PendingVoteModel(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    survey = models.ForeignKey(SurveyModel, on_delete=models.CASCADE)
+    answer = models.CharField(max_length=80)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'survey')
+
+    def __str__(self):
+        return f'User: {self.user}, Survey: {self.survey}, Answer: {self.answer}'
+
+
+class VoteEventModel(models.Model):
+    """Append-only log of counted votes, the source of truth for the
+    answer counters."""
+    # NULL for the votes cast before the log existed.
+    user = models.ForeignKey(get_user_model(),
+                             on_delete=models.CASCADE,
+                             null=True)
+    survey = models.ForeignKey(SurveyModel,
+                               on_delete=models.CASCADE,
+                               related_name='vote_events')
+    answer = models.CharField(max_length=80)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Transaction that logged the vote, set by the vote statements. 0 for
+    # the votes logged before it was kept.
+    xid = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['xid', 'id'], name='vote_event_xid_idx'),
+        ]
+
+    def __str__(self):
+        return f'User: {self.user}, Survey: {self.survey}, Answer: {self.answer}'
+
+
+class VoteTallyModel(models.Model):
+    survey = models.ForeignKey(SurveyModel,
+                               on_delete=models.CASCADE,
+                               related_name='vote_tallies')
+    answer = models.CharField(max_length=80)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('survey', 'answer')
+
+    def __str__(self):
+        return f'Survey: {self.survey}, Answer: {self.answer}, Count: {self.count}'
+
+
+class VoteRollupCheckpointModel(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    # (xid, id) of the last event rolled up.
+    last_xid = models.BigIntegerField(default=0)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.last_xid}/{self.last_event_id}'
+
+
+class SurveySnapshotModel(models.Model):
+    """Immutable final results of an archived survey."""
+    survey = models.OneToOneField(SurveyModel,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='snapshot')
+    # [[answer, votes], ...] in answer order.
+    answers = models.JSONField()
+    voters_count = models.PositiveIntegerField()
+    # zlib compressed bitmap of the voter ids, see archive.py.
+    voter_bitmap = models.BinaryField(null=True)
+    # Rendered survey detail, served as is.
+    content = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'Survey: {self.survey_id}, Voters: {self.voters_count}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Survey snapshots are immutable.')
+        super().save(*args, **kwargs)
+
+
+class ArchivedUserSurveyJunctionModel(models.Model):
+    """Voter junction rows of archived surveys, out of the hot table."""
+    user = models.ForeignKey(get_user_model(),
+                             on_delete=models.CASCADE,
+                             related_name='archived_junctions')
+    # Lookups by survey are served by the (survey, user) unique index.
+    survey = models.ForeignKey(SurveyModel,
+                               on_delete=models.CASCADE,
+                               related_name='archived_junctions',
+                               db_index=False)
+    is_owner = models.BooleanField(default=False)
+    is_voted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('survey', 'user')
 
     def __str__(self):
         return f'User: {self.user}, Survey: {self.survey}'
@@ -0,0 +1,44 @@
+"""Bounded thread pool for the ORM work of async code."""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULTS = {
+    'MAX_WORKERS': 16,
+}
+
+
+def get_async_api_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'ASYNC_API', {})}
+
+
+@lru_cache(maxsize=None)
+def get_orm_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=get_async_api_settings()['MAX_WORKERS'],
+        thread_name_prefix='async-api-orm',
+    )
+
+
+def call_with_connection(func, *args):
+    # Pool threads outlive requests, so apply CONN_MAX_AGE around every
+    # call the way the request signals do for sync views.
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_in_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    # Executor threads do not inherit the context, e.g. the database
+    # routing of the request.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_orm_executor(),
+        partial(context.run, call_with_connection, func, *args),
+    )
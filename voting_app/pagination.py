@@ -0,0 +1,120 @@
+import json
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+def reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}'
+                 for field in ordering)
+
+
+class SurveyCursorPagination(CursorPagination):  # pylint: disable=too-many-instance-attributes
+    """Keyset pagination on the whole ordering.
+
+    DRF only filters on the first ordering column and skips rows tied on it
+    with an offset, which grows with the ties and stops at
+    ``offset_cutoff``. Here the cursor holds every ordering column, ``id``
+    included, and the next page starts with a row comparison, so every
+    page is one range scan of the (finishing_date, id) index.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'id'
+    ordering_param = 'ordering'
+    ordering_fields = ('id', 'finishing_date')
+
+    def get_ordering(self, request, queryset, view):
+        # ``id`` breaks ties, in the same direction, so positions are
+        # unique and can be compared as a row.
+        ordering = request.query_params.get(self.ordering_param, self.ordering)
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            return (self.ordering,)
+        if field == 'id':
+            return (ordering,)
+        return (ordering, '-id' if ordering.startswith('-') else 'id')
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            instance[field.lstrip('-')] if isinstance(instance, dict)
+            else getattr(instance, field.lstrip('-'))
+            for field in ordering
+        ]
+        return json.dumps([str(value) for value in values])
+
+    def get_position_filter(self, queryset, position: str, is_after: bool):
+        """``(col, ...) > (value, ...)``, or ``<``, for the cursor
+        position."""
+        opts = queryset.model._meta  # pylint: disable=protected-access
+        fields = [opts.get_field(field.lstrip('-')) for field in self.ordering]
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError(position)
+            values = [field.to_python(value)
+                      for field, value in zip(fields, values)]
+        except (ValueError, DjangoValidationError) as error:
+            raise NotFound(self.invalid_cursor_message) from error
+        quote_name = connection.ops.quote_name
+        columns = ', '.join(
+            f'{quote_name(opts.db_table)}.{quote_name(field.column)}'
+            for field in fields
+        )
+        placeholders = ', '.join(['%s'] * len(values))
+        return RawSQL(
+            f'({columns}) {">" if is_after else "<"} ({placeholders})',
+            values,
+            output_field=BooleanField(),
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with the row comparison.
+        # pylint: disable=attribute-defined-outside-init
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+        queryset = queryset.order_by(
+            *(reverse_ordering(self.ordering) if reverse else self.ordering)
+        )
+        if current_position is not None:
+            is_reversed = self.ordering[0].startswith('-')
+            queryset = queryset.filter(self.get_position_filter(
+                queryset, current_position, is_after=reverse == is_reversed,
+            ))
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = (
+            self._get_position_from_instance(results[-1], self.ordering)
+            if has_following_position else None
+        )
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
@@ -0,0 +1,31 @@
+import logging
+import threading
+from typing import Callable
+from django.db import connection, DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicThread(threading.Thread):
+    """Daemon thread running ``task`` every ``interval`` seconds."""
+
+    def __init__(self, task: Callable, interval: float, name: str):
+        super().__init__(name=name, daemon=True)
+        self.task = task
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.task()
+                except DatabaseError:
+                    logger.exception('%s failed', self.name)
+                    connection.close()
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
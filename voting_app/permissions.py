@@ -1,27 +1,17 @@
 from rest_framework.permissions import BasePermission
-from .models import UserSurveyJunctionModel
 from . import constants
 
 
-class HasNotVoted(BasePermission):
-    message = 'You already voted!'
-
-    def has_permission(self, request, view):
-        if view.action != constants.VOTE:
-            return True
-        relation = UserSurveyJunctionModel.objects.filter(
-            user=request.user,
-            survey=view.kwargs.get(view.lookup_field)).first()
-        return not relation or relation.is_voted is False
-
-
 class IsOwner(BasePermission):
     message = 'You are not owner!'
 
     def has_permission(self, request, view):
-        if view.action not in [constants.EDIT_SURVEY, constants.DESTROY]:
+        if view.action not in [constants.EDIT_SURVEY, constants.DESTROY,
+                               constants.EXPORT_VOTERS]:
+            return True
+        if not request.user.is_authenticated:
+            return False
+        if view.action == constants.EXPORT_VOTERS and request.user.is_staff:
             return True
-        return UserSurveyJunctionModel.objects.filter(
-            user=request.user,
-            survey=view.kwargs.get(view.lookup_field),
-            is_owner=True).exists()
+        survey = view.survey_with_membership
+        return survey is not None and bool(survey.caller_is_owner)
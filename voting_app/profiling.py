@@ -0,0 +1,309 @@
+"""On-demand request profiling and slow query logging.
+
+A request is profiled when it carries ``X-Profile: <PROFILING['TOKEN']>``
+or is picked with probability ``SAMPLE_RATE``. It then runs under cProfile
+and every SQL statement is captured with its duration and the project
+frames that ran it. Parameters only leave their types in the report, as
+they hold token keys, password hashes and user data. The report is written
+to ``REPORT_DIR`` and its id is returned in the ``X-Profile-Id`` header.
+Admins download reports from ``/profiles/<id>/`` (JSON, or
+``?output=pstats`` for the raw profile).
+Requests that are not profiled only pay for the trigger check.
+
+Independently, with ``SLOW_QUERY_THRESHOLD`` set every query is timed,
+and queries slower than that many seconds are logged with their call site
+and EXPLAIN plan.
+"""
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import time
+import traceback
+import uuid
+from contextlib import ExitStack
+from typing import List, Optional
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from application.middleware import HybridMiddleware
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TOKEN': None,
+    'SAMPLE_RATE': 0.0,
+    'REPORT_DIR': None,
+    'MAX_REPORTS': 100,
+    'TOP_FUNCTIONS': 40,
+    'SLOW_QUERY_THRESHOLD': None,
+}
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+MAX_CALL_SITE_FRAMES = 5
+
+# Frames of the execute wrappers and middleware, not call sites.
+INSTRUMENTATION_FILES = frozenset((__file__, metrics.__file__))
+
+
+def get_profiling_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def is_profiled(request, profiling_settings: dict) -> bool:
+    token = profiling_settings['TOKEN']
+    header = request.META.get(PROFILE_HEADER)
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    sample_rate = profiling_settings['SAMPLE_RATE']
+    return bool(sample_rate) and random.random() < sample_rate
+
+
+def get_call_site() -> List[str]:
+    """Innermost project frames of the current stack, outermost first."""
+    project_dir = str(settings.BASE_DIR)
+    frames = [
+        f'{os.path.relpath(frame.filename, project_dir)}:{frame.lineno} '
+        f'in {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(project_dir)
+        and frame.filename not in INSTRUMENTATION_FILES
+        and f'{os.sep}site-packages{os.sep}' not in frame.filename
+    ]
+    return frames[-MAX_CALL_SITE_FRAMES:]
+
+
+def explain(connection, sql: str, params) -> Optional[str]:
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # A savepoint, so a failing EXPLAIN cannot break the transaction.
+        # The raw cursor bypasses the execute wrappers.
+        with transaction.atomic(using=connection.alias):
+            with connection.connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}', params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+    except (DatabaseError, connection.Database.Error):
+        logger.exception('EXPLAIN failed')
+        return None
+
+
+class SlowQueryLogger:
+    """``connection.execute_wrapper`` logging the slow queries."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            plan = None if many else explain(context['connection'], sql,
+                                             params)
+            logger.warning(
+                'Slow query (%.1f ms) at %s: %s\n%s',
+                duration * 1000, ' < '.join(reversed(get_call_site())),
+                sql, plan or '(no plan)',
+            )
+        return result
+
+
+def get_param_types(params) -> Optional[List[str]]:
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        params = params.values()
+    return [type(param).__name__ for param in params]
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` capturing every query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'param_types': get_param_types(None if many else params),
+                'many': many,
+                'duration_ms': round((time.perf_counter() - started) * 1000,
+                                     3),
+                'call_site': get_call_site(),
+            })
+
+
+def get_report_dir() -> str:
+    report_dir = get_profiling_settings()['REPORT_DIR']
+    if report_dir is None:
+        return os.path.join(str(settings.BASE_DIR), 'var', 'profiles')
+    return str(report_dir)
+
+
+def get_profile_stats(profiler: cProfile.Profile, limit: int) -> str:
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
+
+
+def save_report(report: dict, profiler: cProfile.Profile):
+    report_dir = get_report_dir()
+    os.makedirs(report_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(report_dir, f'{report["id"]}.pstats'))
+    with open(os.path.join(report_dir, f'{report["id"]}.json'), 'w',
+              encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2)
+    prune_reports(report_dir, get_profiling_settings()['MAX_REPORTS'])
+
+
+def list_reports(report_dir: str) -> List[str]:
+    """Report ids, oldest first."""
+    try:
+        names = os.listdir(report_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len('.json')] for name in names
+                  if name.endswith('.json'))
+
+
+def prune_reports(report_dir: str, max_reports: int):
+    reports = list_reports(report_dir)
+    for report_id in reports[:max(len(reports) - max_reports, 0)]:
+        for extension in ('json', 'pstats'):
+            try:
+                os.remove(os.path.join(report_dir,
+                                       f'{report_id}.{extension}'))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """Profiles the requests picked by ``is_profiled``.
+
+    Under ASGI only the event loop thread is profiled, so the report holds
+    the async code of the request (and whatever else the loop ran
+    meanwhile) but neither the queries nor the code run in other threads.
+    """
+
+    def handle(self, request):
+        profiling_settings = get_profiling_settings()
+        threshold = profiling_settings['SLOW_QUERY_THRESHOLD']
+        with ExitStack() as stack:
+            if threshold is not None:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        SlowQueryLogger(threshold)))
+            if not is_profiled(request, profiling_settings):
+                return self.get_response(request)
+            return self.profile(request)
+
+    async def ahandle(self, request):
+        # Connections are per thread, and no query runs on the event loop,
+        # so there is nothing to log or record here.
+        profiling_settings = get_profiling_settings()
+        if not is_profiled(request, profiling_settings):
+            return await self.get_response(request)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request of this loop is already being profiled.
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.save(request, response, profiler=profiler,
+                         recorder=QueryRecorder(),
+                         duration=time.perf_counter() - started)
+
+    def profile(self, request):
+        recorder = QueryRecorder()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already running in this thread.
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        return self.save(request, response, profiler=profiler,
+                         recorder=recorder,
+                         duration=time.perf_counter() - started)
+
+    @staticmethod
+    def save(request, response, *, profiler, recorder, duration):
+        report_id = (f'{timezone.now():%Y%m%dT%H%M%S%f}-'
+                     f'{uuid.uuid4().hex[:8]}')
+        report = {
+            'id': report_id,
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'query_count': len(recorder.queries),
+            'query_time_ms': round(sum(query['duration_ms']
+                                       for query in recorder.queries), 3),
+            'queries': recorder.queries,
+            'profile': get_profile_stats(
+                profiler, get_profiling_settings()['TOP_FUNCTIONS']),
+        }
+        try:
+            save_report(report, profiler)
+        except OSError:
+            logger.exception('Saving profile %s failed', report_id)
+            return response
+        response['X-Profile-Id'] = report_id
+        return response
+
+
+class ProfileReportListView(APIView):
+    permission_classes = [IsAdminUser]
+    swagger_schema = None
+
+    def get(self, request, *args, **kwargs):
+        return Response({'reports': list_reports(get_report_dir())[::-1]})
+
+
+class ProfileReportView(APIView):
+    permission_classes = [IsAdminUser]
+    swagger_schema = None
+
+    def get(self, request, *args, **kwargs):
+        # ``format`` is taken by DRF content negotiation.
+        extension = ('pstats' if request.query_params.get('output') == 'pstats'
+                     else 'json')
+        path = os.path.join(get_report_dir(),
+                            f'{kwargs["report_id"]}.{extension}')
+        if not os.path.exists(path):
+            raise Http404()
+        return FileResponse(open(path, 'rb'),  # pylint: disable=consider-using-with
+                            as_attachment=extension == 'pstats',
+                            filename=os.path.basename(path))
@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Any, Iterable, Optional
+from django.core.cache import caches
+from django.db import transaction
+
+RESULT_CACHE_ALIAS = 'survey_results'
+
+
+class ResultCacheStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, is_hit: bool):
+        with self.lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+stats = ResultCacheStats()
+
+
+def get_cache():
+    return caches[RESULT_CACHE_ALIAS]
+
+
+def get_version_key(survey_id) -> str:
+    return f'survey-version:{survey_id}'
+
+
+# Bumped whenever the cached SurveyResult changes shape, so results pickled
+# by the previous release are never read from a shared cache.
+RESULT_FORMAT = 2
+
+
+def get_result_key(survey_id, version: int) -> str:
+    return f'survey-result:{RESULT_FORMAT}:{survey_id}:{version}'
+
+
+def get_survey_version(survey_id) -> int:
+    cache = get_cache()
+    version = cache.get(get_version_key(survey_id))
+    if version is None:
+        # A fresh counter starts from the clock, so results cached under
+        # an evicted counter can never be served again.
+        cache.add(get_version_key(survey_id), time.time_ns(), timeout=None)
+        version = cache.get(get_version_key(survey_id), time.time_ns())
+    return version
+
+
+def bump_survey_version(survey_id):
+    cache = get_cache()
+    try:
+        cache.incr(get_version_key(survey_id))
+    except ValueError:
+        cache.set(get_version_key(survey_id), time.time_ns(), timeout=None)
+
+
+def bump_survey_versions_on_commit(survey_ids: Iterable):
+    """Invalidate cached results once the current transaction commits, so
+    a concurrent miss can't cache the old data under the new version."""
+    survey_ids = list(survey_ids)
+
+    def bump_versions():
+        for survey_id in survey_ids:
+            bump_survey_version(survey_id)
+
+    transaction.on_commit(bump_versions)
+
+
+def get_cached_result(survey_id, version: int) -> Optional[Any]:
+    result = get_cache().get(get_result_key(survey_id, version))
+    stats.record(result is not None)
+    return result
+
+
+def set_cached_result(survey_id, version: int, result: Any):
+    get_cache().set(get_result_key(survey_id, version), result)
@@ -1,9 +1,14 @@
 from rest_framework import serializers
 from .models import SurveyModel
-from .validators import answers_unique_validator
+from . import constants
+from .validators import (
+    answers_unique_validator, batch_size_validator, bulk_size_validator,
+)
 
 
 class SurveyRetrieveSerializer(serializers.ModelSerializer):
+    answers = serializers.DictField(read_only=True)
+
     class Meta:
         model = SurveyModel
         fields = (
@@ -16,13 +21,24 @@ class SurveyRetrieveSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'id': {'read_only': True},
             'survey_question': {'read_only': True},
-            'answers': {'read_only': True},
             'finishing_date': {'required': False},
             'is_finished': {'required': False},
         }
 
+    def update(self, instance, validated_data):
+        # Only write the edited columns, so concurrent edits of other
+        # columns are never overwritten with a stale copy.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class SurveyCreateSerializer(serializers.HyperlinkedModelSerializer):
+    answers = serializers.DictField(
+        child=serializers.IntegerField(min_value=0),
+    )
+
     class Meta:
         model = SurveyModel
         fields = ('survey_question', 'answers', 'finishing_date', 'url')
@@ -42,6 +58,14 @@ class SurveyCreateRequestSerializer(serializers.Serializer):
     finishing_date = serializers.DateTimeField()
 
 
+class SurveyBulkCreateRequestSerializer(serializers.Serializer):
+    surveys = serializers.ListSerializer(
+        child=SurveyCreateRequestSerializer(),
+        validators=(bulk_size_validator,),
+        allow_empty=False
+    )
+
+
 class SurveyListSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = SurveyModel
@@ -52,8 +76,40 @@ class SurveyListSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class SurveyVotingSerializer(serializers.Serializer):
+    voted_answer = serializers.CharField(max_length=80)
+
+
+class SurveyBatchVoteItemSerializer(serializers.Serializer):
+    survey = serializers.IntegerField(min_value=1)
+    voted_answer = serializers.CharField(max_length=80)
+
+
+class SurveyBatchVotingSerializer(serializers.Serializer):
+    votes = serializers.ListSerializer(
+        child=SurveyBatchVoteItemSerializer(),
+        validators=(batch_size_validator,),
+        allow_empty=False
+    )
+
+
+class SurveyBatchVoteResultSerializer(SurveyBatchVoteItemSerializer):
+    status = serializers.CharField()
+
+
+class SurveyListFilterSerializer(serializers.Serializer):
+    is_finished = serializers.BooleanField(required=False)
+    is_open = serializers.BooleanField(required=False)
+    finishing_after = serializers.DateTimeField(required=False)
+    finishing_before = serializers.DateTimeField(required=False)
+
+
+class SurveyExportSerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(
+        choices=(constants.EXPORT_CSV, constants.EXPORT_NDJSON),
+        default=constants.EXPORT_CSV,
+    )
+
 
-    def __init__(self, *args, **kwargs):
-        choices = kwargs.pop('choices_from_db', [])
-        self.fields['voted_answer'] = serializers.ChoiceField(choices=choices)
-        super().__init__(*args, **kwargs)
+class SurveyListExportSerializer(SurveyListFilterSerializer,
+                                 SurveyExportSerializer):
+    pass
@@ -0,0 +1,51 @@
+import logging
+import time
+from typing import Tuple
+from django.conf import settings
+from .models import SurveyModel
+from .periodic import PeriodicThread
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'INTERVAL': 60.0,
+    'BATCH_SIZE': 1000,
+}
+
+
+def get_sweeper_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'SURVEY_SWEEPER', {})}
+
+
+def finish_expired_surveys(batch_size: int) -> Tuple[int, float]:
+    """Finish every expired survey, ``batch_size`` rows per UPDATE.
+
+    Returns how many surveys were finished and how long it took.
+    """
+    started = time.perf_counter()
+    finished_count = 0
+    while True:
+        finished = len(SurveyModel.objects.finish_expired(batch_size))
+        finished_count += finished
+        if finished < batch_size:
+            return finished_count, time.perf_counter() - started
+
+
+def sweep():
+    finished_count, elapsed = finish_expired_surveys(
+        get_sweeper_settings()['BATCH_SIZE']
+    )
+    if finished_count:
+        logger.info('Finished %d expired surveys in %.3fs',
+                    finished_count, elapsed)
+
+
+def start_sweeper() -> PeriodicThread:
+    sweeper = PeriodicThread(
+        sweep,
+        get_sweeper_settings()['INTERVAL'],
+        name='survey-expiry-sweeper',
+    )
+    sweeper.start()
+    return sweeper
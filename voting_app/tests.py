@@ -1,13 +1,60 @@
+# pylint: disable=too-many-lines
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
-from .models import SurveyModel, UserSurveyJunctionModel
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.utils import timezone
+from django.db import connection, router, transaction, OperationalError
+from django.test import (
+    AsyncClient, Client, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from accounts.authentication import token_cache
+from accounts.utils import invalidate_user_tokens
+from application.db_backend.base import DatabaseWrapper, close_pools
+from application.schema import get_code_version, get_schema_document
+from .archive import archive_finished_surveys, decode_voter_bitmap
+from .buffer import vote_buffers
+from .live import (
+    live_results, LiveResultsASGIMiddleware, STREAM_SURVEY_HEADER,
+)
+from .metrics import (
+    EXITED_WORKERS, collector as metrics_collector, fold_worker_snapshots,
+    write_snapshot,
+)
+from .orm_pool import run_in_pool
+from .result_cache import get_cache, stats as result_cache_stats
+from .models import (
+    SurveyModel, AnswerOptionModel, UserSurveyJunctionModel, PendingVoteModel,
+    VoteEventModel, VoteTallyModel, SurveySnapshotModel,
+    ArchivedUserSurveyJunctionModel,
+)
+from .utils import apply_votes, perform_survey_vote
+from .vote_log import find_vote_drift, roll_up_vote_events
+from . import constants
 
 User = get_user_model()
 
 
-class SurveyTest(APITestCase):
+class SurveyTestCase(APITestCase):
 
     def setUp(self) -> None:
         self.user = User.objects.create_user(
@@ -25,6 +72,11 @@ class SurveyTest(APITestCase):
         self.valid_survey = SurveyModel.objects.create(**self.data)
         UserSurveyJunctionModel.objects.create(survey=self.valid_survey, user=self.user, is_owner=True)
         self.valid_survey_id = self.valid_survey.pk
+        get_cache().clear()
+        token_cache.clear()
+
+
+class SurveyTest(SurveyTestCase):  # pylint: disable=too-many-public-methods
 
     def test_survey_creation_success(self):
         url = '/api/surveys/'
@@ -62,13 +114,92 @@ class SurveyTest(APITestCase):
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         current_count = len(SurveyModel.objects.all())
-        self.assertEqual(len(response.data), current_count)
+        self.assertEqual(len(response.data['results']), current_count)
+
+    def test_surveys_list_pagination(self):
+        for _ in range(4):
+            SurveyModel.objects.create(**self.data)
+        url = '/api/surveys/?page_size=2&ordering=-finishing_date'
+        survey_ids = []
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            survey_ids += [survey['id'] for survey in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(
+            survey_ids,
+            list(SurveyModel.objects.order_by('-finishing_date', '-id')
+                 .values_list('id', flat=True))
+        )
+
+    def test_surveys_list_pagination_ties(self):
+        for _ in range(6):
+            SurveyModel.objects.create(**self.data)
+        expected_ids = list(SurveyModel.objects.order_by('finishing_date', 'id')
+                            .values_list('id', flat=True))
+        url = '/api/surveys/?page_size=2&ordering=finishing_date'
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, format='json')
+            pages.append([survey['id'] for survey in response.data['results']])
+            cursor = parse_qs(urlparse(url).query).get('cursor')
+            if cursor is not None:
+                # A keyset on (finishing_date, id), never an offset.
+                self.assertNotIn('o=', b64decode(cursor[0]).decode())
+                self.assertTrue(any(
+                    '"finishing_date", "voting_app_surveymodel"."id") >'
+                    in query['sql'] for query in queries
+                ))
+            url = response.data['next']
+        self.assertEqual(sum(pages, []), expected_ids)
+        url = response.data['previous']
+        previous_pages = []
+        while url:
+            response = self.client.get(url, format='json')
+            previous_pages.append(
+                [survey['id'] for survey in response.data['results']])
+            url = response.data['previous']
+        self.assertEqual(previous_pages, pages[-2::-1])
+        # p=not
+        response = self.client.get('/api/surveys/', {'cursor': 'cD1ub3Q='})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_surveys_list_filters(self):
+        finished_survey = SurveyModel.objects.create(is_finished=True, **self.data)
+        expired_survey = SurveyModel.objects.create(
+            survey_question='Expired survey',
+            answers={'1': 0},
+            finishing_date='1943-11-05T18:25:43.511Z',
+        )
+        url = '/api/surveys/'
+        response = self.client.get(url, {'is_open': 'true'}, format='json')
+        self.assertEqual(
+            [survey['id'] for survey in response.data['results']],
+            [self.valid_survey_id]
+        )
+        response = self.client.get(url, {'is_finished': 'true'}, format='json')
+        self.assertEqual(
+            [survey['id'] for survey in response.data['results']],
+            [finished_survey.pk]
+        )
+        response = self.client.get(
+            url, {'finishing_before': '2000-01-01T00:00:00Z'}, format='json'
+        )
+        self.assertEqual(
+            [survey['id'] for survey in response.data['results']],
+            [expired_survey.pk]
+        )
+        response = self.client.get(url, {'is_open': 'maybe'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_survey_detail(self):
         url = f'/api/surveys/{self.valid_survey_id}/'
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data.get('id'), self.valid_survey_id)
+        data = response.json()
+        self.assertEqual(data.get('id'), self.valid_survey_id)
         valid_response_data = {
             'survey_question': 'Test survey',
             'answers': {'1': 0, '2': 0},
@@ -76,15 +207,15 @@ class SurveyTest(APITestCase):
         }
         self.assertEqual(
             valid_response_data['survey_question'],
-            response.data.get('survey_question')
+            data.get('survey_question')
         )
         self.assertEqual(
             valid_response_data['answers'],
-            response.data.get('answers')
+            data.get('answers')
         )
         self.assertEqual(
             valid_response_data['finishing_date'],
-            response.data.get('finishing_date')
+            data.get('finishing_date')
         )
 
     def test_survey_voting(self):
@@ -100,6 +231,114 @@ class SurveyTest(APITestCase):
         self.valid_survey.refresh_from_db()
         self.assertEqual(self.valid_survey.answers.get('1'), 1)
 
+    def test_survey_voting_twice(self):
+        url = f'/api/surveys/{self.valid_survey_id}/vote/'
+        voted_answer = {'voted_answer': '1'}
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.valid_survey.refresh_from_db()
+        self.assertEqual(self.valid_survey.answers.get('1'), 1)
+
+    def test_survey_voting_wrong_answer(self):
+        url = f'/api/surveys/{self.valid_survey_id}/vote/'
+        voted_answer = {'voted_answer': '3'}
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UserSurveyJunctionModel.objects.filter(
+            survey=self.valid_survey, is_voted=True).exists())
+
+    def test_survey_voting_not_found(self):
+        url = '/api/surveys/0/vote/'
+        voted_answer = {'voted_answer': '1'}
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sharded_survey_voting(self):
+        survey = SurveyModel.objects.create(shards_count=4, **self.data)
+        url = f'/api/surveys/{survey.pk}/vote/'
+        response = self.client.patch(url, {'voted_answer': '2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        survey.refresh_from_db()
+        self.assertEqual(survey.answers, {'1': 0, '2': 0})
+        self.assertEqual(survey.counter_shards.get().count, 1)
+        response = self.client.get(f'/api/surveys/{survey.pk}/', format='json')
+        self.assertEqual(response.json().get('answers'), {'1': 0, '2': 1})
+        # Reads add the shards up, only finishing folds them.
+        self.assertTrue(survey.counter_shards.exists())
+
+    def test_sharded_survey_finish(self):
+        survey = SurveyModel.objects.create(shards_count=4, **self.data)
+        for index in range(6):
+            user = User.objects.create(username=f'voter_{index}')
+            perform_survey_vote(survey.pk, user, '1')
+        self.assertEqual(survey.counter_shards.count(), 4)
+        survey.finish_survey()
+        survey.refresh_from_db()
+        self.assertTrue(survey.is_finished)
+        self.assertEqual(survey.answers, {'1': 6, '2': 0})
+
+    @override_settings(VOTE_BUFFER={'ENABLED': True, 'AUTOSTART': False})
+    def test_buffered_survey_voting(self):
+        url = f'/api/surveys/{self.valid_survey_id}/vote/'
+        voted_answer = {'voted_answer': '1'}
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.valid_survey.refresh_from_db()
+        self.assertEqual(self.valid_survey.answers.get('1'), 0)
+        self.assertEqual(vote_buffers.get().drain(), 1)
+        self.valid_survey.refresh_from_db()
+        self.assertEqual(self.valid_survey.answers.get('1'), 1)
+        self.assertFalse(PendingVoteModel.objects.exists())
+        self.assertTrue(UserSurveyJunctionModel.objects.get(
+            survey=self.valid_survey, user=self.user).is_voted)
+        response = self.client.patch(url, data=voted_answer, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(VOTE_BUFFER={
+        'ENABLED': True,
+        'AUTOSTART': False,
+        'BACKEND': 'voting_app.buffer.LocalVoteBuffer',
+        'FLUSH_SIZE': 2,
+    })
+    def test_local_buffer_flush_in_batches(self):
+        vote_buffer = vote_buffers.get()
+        for index in range(5):
+            user = User.objects.create(username=f'voter_{index}')
+            result = vote_buffer.append(self.valid_survey_id, user.pk, '2')
+            self.assertEqual(result, constants.VOTE_ACCEPTED)
+        self.assertEqual(
+            vote_buffer.append(self.valid_survey_id, user.pk, '2'),
+            constants.VOTE_ALREADY_VOTED
+        )
+        self.assertEqual(vote_buffer.flush(), 2)
+        self.assertEqual(vote_buffer.drain(), 3)
+        self.valid_survey.refresh_from_db()
+        self.assertEqual(self.valid_survey.answers, {'1': 0, '2': 5})
+
+    def test_survey_detail_cache(self):
+        url = f'/api/surveys/{self.valid_survey_id}/'
+        self.client.credentials()
+        hits_before = result_cache_stats.as_dict()['hits']
+        first_response = self.client.get(url, format='json')
+        with self.assertNumQueries(0):
+            second_response = self.client.get(url, format='json')
+        self.assertEqual(second_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(first_response.content, second_response.content)
+        self.assertEqual(result_cache_stats.as_dict()['hits'], hits_before + 1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/surveys/{self.valid_survey_id}/vote/',
+                data={'voted_answer': '1'},
+                format='json',
+            )
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.json()['answers'], {'1': 1, '2': 0})
+
     def test_survey_update(self):
         url = f'/api/surveys/{self.valid_survey_id}/edit-survey/'
         new_data = {'is_finished': True}
@@ -112,6 +351,94 @@ class SurveyTest(APITestCase):
         self.assertEqual(response.data.get('id'), self.valid_survey_id)
         self.assertEqual(response.data.get('is_finished'), True)
 
+    def test_survey_actions_queries(self):
+        # Token lookup, then a single statement for the vote.
+        with self.assertNumQueries(2):
+            response = self.client.patch(
+                f'/api/surveys/{self.valid_survey_id}/vote/',
+                data={'voted_answer': '1'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # The token is cached now: survey with membership, its answers,
+        # update.
+        with self.assertNumQueries(3):
+            response = self.client.patch(
+                f'/api/surveys/{self.valid_survey_id}/edit-survey/',
+                {'is_finished': True},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Survey with membership, then the cascading delete.
+        with self.assertNumQueries(10):
+            response = self.client.delete(
+                f'/api/surveys/{self.valid_survey_id}/',
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_survey_batch_voting(self):
+        other_survey = SurveyModel.objects.create(**self.data)
+        finished_survey = SurveyModel.objects.create(is_finished=True, **self.data)
+        votes = [
+            {'survey': self.valid_survey_id, 'voted_answer': '1'},
+            {'survey': self.valid_survey_id, 'voted_answer': '2'},
+            {'survey': other_survey.pk, 'voted_answer': '3'},
+            {'survey': other_survey.pk, 'voted_answer': '2'},
+            {'survey': finished_survey.pk, 'voted_answer': '1'},
+            {'survey': other_survey.pk + 1000, 'voted_answer': '1'},
+        ]
+        # Token lookup, surveys with membership, then the junction insert
+        # and the counters update inside a savepoint.
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                '/api/surveys/vote-batch/',
+                {'votes': votes},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [vote['status'] for vote in response.data],
+            [
+                constants.VOTE_ACCEPTED,
+                constants.VOTE_ALREADY_VOTED,
+                constants.VOTE_INVALID_ANSWER,
+                constants.VOTE_ACCEPTED,
+                constants.VOTE_SURVEY_FINISHED,
+                constants.VOTE_SURVEY_NOT_FOUND,
+            ]
+        )
+        self.valid_survey.refresh_from_db()
+        other_survey.refresh_from_db()
+        self.assertEqual(self.valid_survey.answers, {'1': 1, '2': 0})
+        self.assertEqual(other_survey.answers, {'1': 0, '2': 1})
+        response = self.client.post(
+            '/api/surveys/vote-batch/',
+            {'votes': votes[:1]},
+            format='json',
+        )
+        self.assertEqual(response.data[0]['status'], constants.VOTE_ALREADY_VOTED)
+
+    def test_survey_vote_updates_voted_answer_only(self):
+        options = {
+            option.label: option
+            for option in self.valid_survey.options.all()
+        }
+        response = self.client.patch(
+            f'/api/surveys/{self.valid_survey_id}/vote/',
+            data={'voted_answer': '2'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        for option in options.values():
+            option.refresh_from_db()
+        self.assertEqual(options['1'].vote_count, 0)
+        self.assertEqual(options['2'].vote_count, 1)
+        self.assertEqual(
+            [option.label for option in self.valid_survey.options.all()],
+            ['1', '2'],
+        )
+
     def test_survey_update_not_owner(self):
         user = User.objects.create_user(
             username='test_user2',
@@ -165,3 +492,1000 @@ class SurveyTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         test_response = self.client.get(url, format='json')
         self.assertEqual(test_response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SurveyConditionalTest(SurveyTestCase):
+
+    def test_survey_detail_conditional(self):
+        url = f'/api/surveys/{self.valid_survey_id}/'
+        response = self.client.get(url, format='json')
+        etag = response['ETag']
+        # The survey validators only, the token is cached.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertNotIn('Last-Modified', response)
+        version = SurveyModel.objects.get(pk=self.valid_survey_id).version
+        with self.captureOnCommitCallbacks(execute=True), \
+                CaptureQueriesContext(connection) as queries:
+            self.client.patch(f'{url}vote/', {'voted_answer': '1'},
+                              format='json')
+        # Votes do not write, nor lock, the survey row.
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'UPDATE voting_app_surveymodel' in query['sql']
+        ])
+        self.assertEqual(
+            SurveyModel.objects.get(pk=self.valid_survey_id).version, version)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['answers'], {'1': 1, '2': 0})
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'{url}edit-survey/', {'is_finished': True},
+                              format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['is_finished'])
+        response = self.client.get('/api/surveys/0/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sharded_survey_detail_conditional(self):
+        survey = SurveyModel.objects.create(shards_count=4, **self.data)
+        url = f'/api/surveys/{survey.pk}/'
+        response = self.client.get(url, format='json')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'{url}vote/', {'voted_answer': '2'},
+                              format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['answers'], {'1': 0, '2': 1})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_surveys_list_conditional(self):
+        url = '/api/surveys/'
+        etag = self.client.get(url, format='json')['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        SurveyModel.objects.create(**self.data)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class MetricsTest(SurveyTestCase):
+    scraper_token = 'scraper-token'
+
+    def setUp(self) -> None:
+        super().setUp()
+        metrics_collector.clear()
+        metrics_settings = override_settings(METRICS={'TOKEN': self.scraper_token})
+        metrics_settings.enable()
+        self.addCleanup(metrics_settings.disable)
+
+    def vote(self):
+        return self.client.patch(
+            f'/api/surveys/{self.valid_survey_id}/vote/',
+            {'voted_answer': '1'}, format='json',
+        )
+
+    def scrape(self, token=scraper_token):
+        # Not self.client, its token credentials replace the header.
+        return Client().get('/metrics', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_request_metrics(self):
+        self.client.get(f'/api/surveys/{self.valid_survey_id}/')
+        self.assertEqual(self.vote().status_code, status.HTTP_204_NO_CONTENT)
+        response = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('http_responses_total{action="retrieve",method="GET",'
+                      'status="200"} 1\n', content)
+        self.assertIn('http_responses_total{action="vote",method="PATCH",'
+                      'status="204"} 1\n', content)
+        self.assertIn('http_request_duration_seconds_bucket{action="vote",'
+                      'method="PATCH",le="+Inf"} 1\n', content)
+        self.assertIn('db_queries_per_request_count{action="vote"} 1\n',
+                      content)
+        self.assertIn('# TYPE token_cache_lookups_total counter', content)
+
+    def test_scrapers_only(self):
+        self.assertEqual(Client().get('/metrics').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.scrape('wrong').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        with override_settings(METRICS={}):
+            self.assertEqual(self.scrape(None).status_code,
+                             status.HTTP_404_NOT_FOUND)
+
+    def test_multiprocess_metrics(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        write_snapshot(f'{metrics_dir}/1-worker.json', {
+            ('http_responses_total', ('vote', 'PATCH', '204')): [5],
+        })
+        with override_settings(METRICS={'MULTIPROCESS_DIR': metrics_dir,
+                                        'FLUSH_INTERVAL': 0,
+                                        'TOKEN': self.scraper_token}):
+            self.vote()
+            content = self.scrape().content.decode()
+        self.assertIn('http_responses_total{action="vote",method="PATCH",'
+                      'status="204"} 6\n', content)
+        self.assertEqual(len(os.listdir(metrics_dir)), 2)
+
+    def test_exited_workers_are_folded(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        for pid, count in ((1, 5), (2, 3), (3, 1)):
+            write_snapshot(f'{metrics_dir}/{pid}-worker.json', {
+                ('http_responses_total', ('vote', 'PATCH', '204')): [count],
+            })
+        with override_settings(METRICS={'MULTIPROCESS_DIR': metrics_dir,
+                                        'TOKEN': self.scraper_token}):
+            fold_worker_snapshots(1)
+            fold_worker_snapshots(2)
+            content = self.scrape().content.decode()
+        names = os.listdir(metrics_dir)
+        self.assertNotIn('1-worker.json', names)
+        self.assertNotIn('2-worker.json', names)
+        self.assertIn('3-worker.json', names)
+        self.assertIn(EXITED_WORKERS, names)
+        self.assertIn('http_responses_total{action="vote",method="PATCH",'
+                      'status="204"} 9\n', content)
+
+
+class ProfilingTest(SurveyTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.report_dir)
+        profiling = override_settings(PROFILING={
+            'TOKEN': 'profile-secret', 'REPORT_DIR': self.report_dir,
+        })
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+
+    def test_profiled_request(self):
+        response = self.client.get(f'/api/surveys/{self.valid_survey_id}/',
+                                   HTTP_X_PROFILE='profile-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report_id = response['X-Profile-Id']
+        self.assertFalse(self.client.get(
+            f'/api/surveys/{self.valid_survey_id}/',
+            HTTP_X_PROFILE='wrong-secret').has_header('X-Profile-Id'))
+        self.assertEqual(self.client.get(f'/profiles/{report_id}/')
+                         .status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        invalidate_user_tokens([self.user.pk])
+        self.assertEqual(self.client.get('/profiles/').json(),
+                         {'reports': [report_id]})
+        report = json.loads(b''.join(
+            self.client.get(f'/profiles/{report_id}/').streaming_content))
+        self.assertEqual(report['status'], 200)
+        self.assertGreater(report['query_count'], 0)
+        # Parameters, the token key included, never reach the report.
+        self.assertNotIn(self.token, json.dumps(report))
+        self.assertIn('str', report['queries'][0]['param_types'])
+        self.assertTrue(any(
+            frame.startswith('voting_app/views.py')
+            for query in report['queries'] for frame in query['call_site']
+        ))
+        self.assertIn('cumulative', report['profile'])
+        response = self.client.get(f'/profiles/{report_id}/',
+                                   {'output': 'pstats'})
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content))
+
+    def test_slow_query_log(self):
+        with override_settings(PROFILING={'SLOW_QUERY_THRESHOLD': 0}), \
+                self.assertLogs('voting_app.profiling', 'WARNING') as logs:
+            self.client.get(f'/api/surveys/{self.valid_survey_id}/')
+        self.assertTrue(any('Scan' in line and 'voting_app/' in line
+                            for line in logs.output))
+
+
+class SchemaTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(OPENAPI_SCHEMA={
+            'CODE_VERSION': 'test',
+            'CACHE_DIR': self.cache_dir,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_code_version.cache_clear()
+        get_schema_document.cache_clear()
+        self.addCleanup(get_code_version.cache_clear)
+        self.addCleanup(get_schema_document.cache_clear)
+
+    def test_schema_document(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"test-json"')
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('/api/surveys/', json.loads(response.content)['paths'])
+        with open(f'{self.cache_dir}/openapi-test.json', 'rb') as file:
+            self.assertEqual(file.read(), response.content)
+        ui_response = self.client.get('/swagger/', {'format': 'openapi'})
+        self.assertEqual(ui_response.content, response.content)
+        response = self.client.get('/swagger.json',
+                                   HTTP_IF_NONE_MATCH='"test-json"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'swagger-ui', response.content)
+
+    def test_generate_schema(self):
+        stdout = StringIO()
+        call_command('generate_schema', stdout=stdout)
+        self.assertIn('openapi-test.yaml', stdout.getvalue())
+        with open(f'{self.cache_dir}/openapi-test.yaml', 'rb') as file:
+            self.assertEqual(file.read(), self.client.get('/swagger.yaml').content)
+
+
+class DatabaseBackendTest(TestCase):
+
+    def get_wrapper(self, alias, **settings_dict):
+        wrapper = DatabaseWrapper({**connection.settings_dict, **settings_dict},
+                                  alias=alias)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    @staticmethod
+    def get_backend_pid(wrapper) -> int:
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connection_health_check(self):
+        wrapper = self.get_wrapper('health_check', CONN_MAX_AGE=600,
+                                   CONN_HEALTH_CHECKS=True)
+        backend_pid = self.get_backend_pid(wrapper)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [backend_pid])
+        # A new request reconnects instead of failing on the dead one.
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertNotEqual(self.get_backend_pid(wrapper), backend_pid)
+
+    def test_connection_pool(self):
+        self.addCleanup(close_pools)
+        pool = {'MAX_SIZE': 1, 'TIMEOUT': 0.1}
+        wrapper = self.get_wrapper('pool', POOL=pool)
+        backend_pid = self.get_backend_pid(wrapper)
+        other_wrapper = self.get_wrapper('pool', POOL=pool)
+        with self.assertRaises(OperationalError):
+            other_wrapper.ensure_connection()
+        wrapper.close()
+        self.assertEqual(self.get_backend_pid(other_wrapper), backend_pid)
+
+
+class SurveyBulkTest(SurveyTestCase):
+
+    def test_survey_bulk_creation(self):
+        url = '/api/surveys/bulk-create/'
+        surveys = [
+            {
+                'survey_question': f'Test survey {index}',
+                'answers': ['1', '2'],
+                'finishing_date': '3021-11-05T18:25:43.511Z'
+            }
+            for index in range(10)
+        ]
+        # Token lookup, then the surveys, answers and owners INSERTs in a
+        # savepoint.
+        with self.assertNumQueries(6):
+            response = self.client.post(url, {'surveys': surveys}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 10)
+        created_survey = SurveyModel.objects.get(pk=response.data[0]['id'])
+        self.assertEqual(created_survey.answers, {'1': 0, '2': 0})
+        self.assertEqual(
+            UserSurveyJunctionModel.objects.filter(
+                user=self.user, is_owner=True).count(),
+            11
+        )
+
+    def test_import_surveys_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write(
+                'survey_question,answers,finishing_date\n'
+                'First,yes|no,3021-11-05T18:25:43Z\n'
+                'Broken,yes|yes,3021-11-05T18:25:43Z\n'
+                'Second,a|b|c,3021-11-05T18:25:43Z\n'
+            )
+            csv_file.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_surveys', csv_file.name, owner='test_user',
+                         chunk_size=1, stdout=stdout, stderr=stderr)
+        self.assertIn('Created 2 surveys, skipped 1 rows', stdout.getvalue())
+        self.assertIn('Row 2 skipped', stderr.getvalue())
+        self.assertEqual(
+            SurveyModel.objects.get(survey_question='Second').answers,
+            {'a': 0, 'b': 0, 'c': 0}
+        )
+        self.assertTrue(UserSurveyJunctionModel.objects.filter(
+            user=self.user, survey__survey_question='First', is_owner=True
+        ).exists())
+
+    def test_import_surveys_ndjson(self):
+        survey = ('{"survey_question": "First", "answers": ["yes", "no"], '
+                  '"finishing_date": "3021-11-05T18:25:43Z"}\n')
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as ndjson_file:
+            ndjson_file.write(f'{survey}{{"survey_question": \n\n[1, 2]\n'
+                              f'{survey.replace("First", "Second")}')
+            ndjson_file.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_surveys', ndjson_file.name, owner='test_user',
+                         stdout=stdout, stderr=stderr)
+        self.assertIn('Created 2 surveys, skipped 2 rows', stdout.getvalue())
+        self.assertIn('Row 2 skipped: Invalid JSON', stderr.getvalue())
+        self.assertIn('Row 3 skipped: Expected a JSON object.',
+                      stderr.getvalue())
+        self.assertEqual(
+            SurveyModel.objects.get(survey_question='Second').answers,
+            {'yes': 0, 'no': 0}
+        )
+
+    def test_finish_expired_surveys_command(self):
+        expired_data = {**self.data, 'finishing_date': '1943-11-05T18:25:43Z'}
+        expired_surveys = [
+            SurveyModel.objects.create(**expired_data) for _ in range(3)
+        ]
+        sharded_survey = SurveyModel.objects.create(shards_count=2, **expired_data)
+        sharded_survey.counter_shards.create(answer='2', shard=1, count=5)
+        stdout = StringIO()
+        call_command('finish_expired_surveys', batch_size=2, stdout=stdout)
+        self.assertIn('Finished 4 surveys', stdout.getvalue())
+        for survey in expired_surveys:
+            survey.refresh_from_db()
+            self.assertTrue(survey.is_finished)
+        sharded_survey.refresh_from_db()
+        self.assertTrue(sharded_survey.is_finished)
+        self.assertEqual(sharded_survey.answers, {'1': 0, '2': 5})
+        self.valid_survey.refresh_from_db()
+        self.assertFalse(self.valid_survey.is_finished)
+
+
+class SurveyExportTest(SurveyTestCase):
+
+    def test_export_surveys_and_results(self):
+        sharded_survey = SurveyModel.objects.create(shards_count=4,
+                                                    **self.data)
+        voter = User.objects.create(username='voter')
+        perform_survey_vote(self.valid_survey_id, voter, '2')
+        perform_survey_vote(sharded_survey.pk, voter, '1')
+        self.client.credentials()
+        for url in ('/api/surveys/export/', '/api/surveys/export-results/'):
+            self.assertEqual(self.client.get(url).status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        response = self.client.get('/api/surveys/export/?is_open=true')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual(rows[0], ['id', 'survey_question', 'finishing_date',
+                                   'is_finished'])
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [str(self.valid_survey_id), str(sharded_survey.pk)])
+        response = self.client.get(
+            '/api/surveys/export-results/?export_format=ndjson'
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [(row['survey'], row['answer'], row['votes'])
+             for row in map(json.loads, lines)],
+            [(self.valid_survey_id, '1', 0), (self.valid_survey_id, '2', 1),
+             (sharded_survey.pk, '1', 1), (sharded_survey.pk, '2', 0)],
+        )
+
+    def test_export_voters(self):
+        voters = [User.objects.create(username=f'voter_{index}')
+                  for index in range(3)]
+        for voter in voters:
+            perform_survey_vote(self.valid_survey_id, voter, '1')
+        url = f'/api/surveys/{self.valid_survey_id}/export-voters/'
+        self.client.credentials()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(voters[0])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(b''.join(response.streaming_content)
+                             .decode().splitlines()), 4)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, {'export_format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            sorted(json.loads(line)['username'] for line in lines),
+            ['voter_0', 'voter_1', 'voter_2'],
+        )
+        out = StringIO()
+        call_command('export_surveys', 'voters',
+                     '--survey', str(self.valid_survey_id), stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class SurveyArchiveTest(SurveyTestCase):
+
+    def finish_long_ago(self, survey):
+        SurveyModel.objects.filter(pk=survey.pk).update(
+            is_finished=True,
+            finished_at=timezone.now() - timezone.timedelta(days=40),
+        )
+
+    def test_archive_finished_surveys(self):
+        voters = [User.objects.create(username=f'voter_{index}')
+                  for index in range(5)]
+        for voter in voters:
+            perform_survey_vote(self.valid_survey_id, voter, '1')
+        perform_survey_vote(self.valid_survey_id, self.user, '2')
+        recent_survey = SurveyModel.objects.create(**self.data)
+        perform_survey_vote(recent_survey.pk, voters[0], '2')
+        # Expired long ago, but only finished now.
+        expired_survey = SurveyModel.objects.create(**{
+            **self.data,
+            'finishing_date': timezone.now() - timezone.timedelta(days=40),
+        })
+        self.finish_long_ago(self.valid_survey)
+        recent_survey.finish_survey()
+        self.assertEqual(SurveyModel.objects.finish_expired(10),
+                         [expired_survey.pk])
+        url = f'/api/surveys/{self.valid_survey_id}/'
+        expected = self.client.get(url, format='json').json()
+        self.assertEqual(expected['answers'], {'1': 5, '2': 1})
+        self.assertEqual(archive_finished_surveys(30, 1, 2, True)[:2], (1, 5))
+        self.valid_survey.refresh_from_db()
+        self.assertTrue(self.valid_survey.is_archived)
+        self.assertFalse(SurveyModel.objects.filter(
+            pk__in=[recent_survey.pk, expired_survey.pk],
+            is_archived=True).exists())
+        snapshot = SurveySnapshotModel.objects.get(survey=self.valid_survey)
+        self.assertEqual(snapshot.answers, [['1', 5], ['2', 1]])
+        self.assertEqual(snapshot.voters_count, 6)
+        self.assertEqual(
+            decode_voter_bitmap(bytes(snapshot.voter_bitmap)),
+            sorted(user.pk for user in [self.user, *voters]),
+        )
+        # The owner row stays for the owner checks.
+        self.assertEqual(list(UserSurveyJunctionModel.objects.filter(
+            survey=self.valid_survey).values_list('user', flat=True)),
+            [self.user.pk])
+        self.assertEqual(ArchivedUserSurveyJunctionModel.objects.filter(
+            survey=self.valid_survey).count(), 5)
+        self.assertEqual(archive_finished_surveys(30, 1, 2, True)[:2], (0, 0))
+        get_cache().clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.json(), expected)
+        response = self.client.patch(f'{url}edit-survey/',
+                                     {'is_finished': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(f'{url}export-voters/',
+                                   {'export_format': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            sorted(json.loads(line)['username'] for line in lines),
+            sorted(user.username for user in [self.user, *voters]),
+        )
+
+    def test_archive_surveys_command(self):
+        self.finish_long_ago(self.valid_survey)
+        stdout = StringIO()
+        call_command('archive_surveys', '--no-voter-bitmap', stdout=stdout)
+        self.assertIn('Archived 1 surveys and 0 voters', stdout.getvalue())
+        snapshot = SurveySnapshotModel.objects.get(survey=self.valid_survey)
+        self.assertIsNone(snapshot.voter_bitmap)
+        self.assertEqual(snapshot.voters_count, 0)
+        with self.assertRaises(ValueError):
+            snapshot.save()
+
+
+class SurveyVoteLogTest(SurveyTestCase):
+
+    def test_votes_are_logged(self):
+        voters = [User.objects.create(username=f'voter_{index}')
+                  for index in range(3)]
+        perform_survey_vote(self.valid_survey_id, voters[0], '1')
+        perform_survey_vote(self.valid_survey_id, voters[0], '2')
+        self.client.force_authenticate(voters[1])
+        self.client.post('/api/surveys/vote-batch/', {'votes': [
+            {'survey': self.valid_survey_id, 'voted_answer': '2'},
+        ]}, format='json')
+        with override_settings(VOTE_BUFFER={'ENABLED': True,
+                                            'AUTOSTART': False}):
+            vote_buffers.get().append(self.valid_survey_id, voters[2].pk, '2')
+            vote_buffers.get().drain()
+        self.assertEqual(
+            list(VoteEventModel.objects.order_by('id')
+                 .values_list('user', 'answer')),
+            [(voters[0].pk, '1'), (voters[1].pk, '2'), (voters[2].pk, '2')],
+        )
+
+    def test_reconcile_votes_command(self):
+        sharded_survey = SurveyModel.objects.create(shards_count=4,
+                                                    **self.data)
+        for index in range(3):
+            user = User.objects.create(username=f'voter_{index}')
+            perform_survey_vote(self.valid_survey_id, user, '1')
+            perform_survey_vote(sharded_survey.pk, user, '2')
+        AnswerOptionModel.objects.filter(
+            survey=self.valid_survey, label='1').update(vote_count=1)
+        sharded_survey.counter_shards.update(count=5)
+        out = StringIO()
+        call_command('reconcile_votes', '--chunk-size', '1', stdout=out)
+        self.assertIn('Found 2 drifted answers in 2 surveys', out.getvalue())
+        self.assertEqual(self.valid_survey.answers, {'1': 1, '2': 0})
+        out = StringIO()
+        call_command('reconcile_votes', str(self.valid_survey_id),
+                     str(sharded_survey.pk), '--fix', stdout=out)
+        self.assertIn(f'Survey {self.valid_survey_id}, answer \'1\': '
+                      'counted 1, logged 3', out.getvalue())
+        self.assertEqual(self.valid_survey.answers, {'1': 3, '2': 0})
+        self.assertEqual(sharded_survey.answers, {'1': 0, '2': 3})
+        self.assertFalse(sharded_survey.counter_shards.exists())
+        out = StringIO()
+        call_command('reconcile_votes', stdout=out)
+        self.assertIn('Found 0 drifted answers', out.getvalue())
+
+
+class AsyncSurveyApiTest(TransactionTestCase):
+    # The async views query from their own thread pool, outside of the
+    # transaction a TestCase would wrap them in.
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='test_user',
+                                             password='123456qwerty')
+        self.token = str(Token.objects.create(user=self.user))
+        self.survey = SurveyModel.objects.create(
+            survey_question='Test survey',
+            answers={'1': 0, '2': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+        get_cache().clear()
+
+    def vote(self, voted_answer, **headers):
+        return self.client.patch(
+            f'/api/async/surveys/{self.survey.pk}/vote/',
+            data=json.dumps({'voted_answer': voted_answer}),
+            content_type='application/json',
+            **headers,
+        )
+
+    def test_async_retrieve_and_list(self):
+        response = self.client.get(f'/api/async/surveys/{self.survey.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['answers'], {'1': 0, '2': 0})
+        self.assertEqual(
+            response.content,
+            self.client.get(f'/api/surveys/{self.survey.pk}/').content,
+        )
+        response = self.client.get('/api/async/surveys/0/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/async/surveys/?page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([survey['id'] for survey in response.json()['results']],
+                         [self.survey.pk])
+        response = self.client.get('/api/async/surveys/?is_open=maybe')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/async/surveys/')
+        self.assertEqual(response.status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_async_vote(self):
+        self.assertEqual(self.vote('1').status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token}'}
+        response = self.vote('3', **auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('voted_answer', response.json())
+        self.assertEqual(self.vote('1', **auth).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        response = self.vote('1', **auth)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json(), {'detail': 'You already voted!'})
+        response = self.client.get(f'/api/async/surveys/{self.survey.pk}/')
+        self.assertEqual(response.json()['answers'], {'1': 1, '2': 0})
+
+    @override_settings(DATABASE_ROUTING={'REPLICAS': ['default']})
+    def test_asgi_requests_stay_on_the_event_loop(self):
+        # A sync-only middleware would run the whole request, async view
+        # included, in a thread.
+        threads = {}
+        report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, report_dir)
+        get_aggregates = metrics_collector.get_aggregates
+
+        def record_metrics_thread():
+            threads['metrics'] = threading.get_ident()
+            return get_aggregates()
+
+        async def record_view_thread(func, *args):
+            threads['view'] = threading.get_ident()
+            return await run_in_pool(func, *args)
+
+        async def get_survey():
+            threads['loop'] = threading.get_ident()
+            # Django 3.2's AsyncClient takes ASGI header names.
+            return await AsyncClient().get(
+                f'/api/async/surveys/{self.survey.pk}/',
+                **{'x-profile': 'secret'},
+            )
+
+        with mock.patch.object(metrics_collector, 'get_aggregates',
+                               record_metrics_thread), \
+                mock.patch('voting_app.async_views.run_in_pool',
+                           record_view_thread), \
+                override_settings(PROFILING={'TOKEN': 'secret',
+                                             'REPORT_DIR': report_dir}):
+            response = async_to_sync(get_survey)()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('X-Profile-Id', response)
+        self.assertEqual(threads['view'], threads['loop'])
+        self.assertEqual(threads['metrics'], threads['loop'])
+
+
+@override_settings(LIVE_RESULTS={'POLL_INTERVAL': 0.02,
+                                 'MIN_INTERVAL': 0.3,
+                                 'HEARTBEAT': 5.0})
+class LiveResultsTest(TransactionTestCase):
+    # Watchers query from their own threads, outside of a TestCase
+    # transaction.
+
+    def setUp(self) -> None:
+        self.survey = SurveyModel.objects.create(
+            survey_question='Test survey',
+            answers={'1': 0, '2': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+        get_cache().clear()
+
+    def open_stream(self):
+        response = self.client.get(f'/api/surveys/{self.survey.pk}/stream/',
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response, iter(response.streaming_content)
+
+    def get_answers(self, frame):
+        event, data = frame.decode().strip().split('\n')
+        self.assertEqual(event, 'event: results')
+        return json.loads(data[len('data: '):])['answers']
+
+    def test_results_stream(self):
+        response = self.client.get('/api/surveys/0/stream/',
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        first_response, first_frames = self.open_stream()
+        second_response, second_frames = self.open_stream()
+        self.assertEqual(self.get_answers(next(first_frames)),
+                         {'1': 0, '2': 0})
+        self.assertEqual(self.get_answers(next(second_frames)),
+                         {'1': 0, '2': 0})
+        self.assertEqual(live_results.get_watchers_count(), 1)
+        for index in range(3):
+            user = User.objects.create(username=f'voter_{index}')
+            perform_survey_vote(self.survey.pk, user, '1')
+        # The burst arrives as a single event with the final counts.
+        self.assertEqual(self.get_answers(next(first_frames)),
+                         {'1': 3, '2': 0})
+        first_response.close()
+        self.assertEqual(live_results.get_watchers_count(), 1)
+        second_response.close()
+        self.assertEqual(live_results.get_watchers_count(), 0)
+
+    def test_asgi_results_stream(self):
+        # The whole Django stack, so the stream is routed and measured.
+        application = LiveResultsASGIMiddleware(get_asgi_application())
+        metrics_collector.clear()
+
+        def get_scope(path):
+            return {'type': 'http', 'method': 'GET', 'path': path,
+                    'query_string': b'', 'root_path': '',
+                    'headers': [(b'host', b'testserver'),
+                                (b'accept', b'text/event-stream')]}
+
+        @async_to_sync
+        async def stream(survey_id):
+            communicator = ApplicationCommunicator(
+                application,
+                get_scope(f'/api/surveys/{survey_id}/stream/'),
+            )
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=5)
+            if start['status'] != 200:
+                await communicator.wait(timeout=5)
+                return start, None
+            body = await communicator.receive_output(timeout=5)
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(timeout=5)
+            return start, body
+
+        start, _ = stream(0)
+        self.assertEqual(start['status'], 404)
+        start, body = stream(self.survey.pk)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'),
+                      start['headers'])
+        self.assertNotIn(STREAM_SURVEY_HEADER,
+                         [name.lower() for name, _ in start['headers']])
+        self.assertEqual(self.get_answers(body['body']), {'1': 0, '2': 0})
+        self.assertTrue(body['more_body'])
+        samples = metrics_collector.collect()
+        self.assertEqual(
+            samples[('http_responses_total', ('stream', 'GET', '200'))], [1])
+        for _ in range(50):
+            if not live_results.get_watchers_count():
+                break
+            time.sleep(0.02)
+        self.assertEqual(live_results.get_watchers_count(), 0)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': ['replica']})
+class ReplicaRoutingTest(TransactionTestCase):
+    """The replica test database only gets the rows copied to it, like a
+    replica that stopped replicating."""
+    databases = {'default', 'replica'}
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        token_cache.clear()
+        caches['default'].clear()
+        self.voter = self.get_client('voter')
+        self.other = self.get_client('other')
+        self.survey = SurveyModel.objects.create(
+            survey_question='Replicated survey',
+            answers={'1': 0, '2': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+        SurveyModel.objects.using('replica').bulk_create(
+            SurveyModel.objects.using('default').filter(pk=self.survey.pk))
+        AnswerOptionModel.objects.using('replica').bulk_create(
+            AnswerOptionModel.objects.using('default').filter(
+                survey=self.survey))
+        SurveyModel.objects.create(
+            survey_question='Primary only survey',
+            answers={'1': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+
+    @staticmethod
+    def get_client(username):
+        user = User.objects.create_user(username=username,
+                                        password='123456qwerty')
+        token = Token.objects.create(user=user)
+        return Client(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def get_questions(self, client):
+        return [survey['survey_question']
+                for survey in client.get('/api/surveys/').json()['results']]
+
+    def test_reads_go_to_replica(self):
+        with self.assertNumQueries(0, using='default'):
+            self.assertEqual(self.get_questions(Client()),
+                             ['Replicated survey'])
+        with transaction.atomic():
+            self.assertTrue(SurveyModel.objects.filter(
+                survey_question='Primary only survey').exists())
+
+    def test_cache_table_reads_go_to_primary(self):
+        cache_model = DatabaseCache('django_cache', {}).cache_model_class
+        self.assertEqual(router.db_for_read(cache_model), 'default')
+
+    def test_read_your_writes(self):
+        url = f'/api/surveys/{self.survey.pk}/'
+        etag = self.voter.get(url)['ETag']
+        self.assertEqual(self.voter.patch(
+            f'{url}vote/', {'voted_answer': '1'},
+            content_type='application/json').status_code,
+            status.HTTP_204_NO_CONTENT)
+        # The lagging replica still has the old results.
+        self.assertEqual(self.other.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.voter.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['answers'], {'1': 1, '2': 0})
+        self.assertEqual(self.get_questions(self.voter),
+                         ['Replicated survey', 'Primary only survey'])
+        # Unpinned once the pin expires.
+        caches['default'].clear()
+        self.assertEqual(self.voter.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.get_questions(self.voter),
+                         ['Replicated survey'])
+
+
+class ConcurrentVotingTest(TransactionTestCase):
+    voters_count = 40
+
+    def setUp(self) -> None:
+        self.survey = SurveyModel.objects.create(
+            survey_question='Test survey',
+            answers={'1': 0, '2': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+        self.users = [
+            User.objects.create(username=f'voter_{index}')
+            for index in range(self.voters_count)
+        ]
+
+    def vote(self, user):
+        try:
+            return perform_survey_vote(self.survey.pk, user, '1')
+        finally:
+            connection.close()
+
+    def test_no_lost_votes(self):
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(self.vote, self.users))
+        self.assertEqual(
+            results.count(constants.VOTE_ACCEPTED),
+            self.voters_count
+        )
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.answers, {'1': self.voters_count, '2': 0})
+        self.assertEqual(VoteEventModel.objects.count(), self.voters_count)
+
+    def test_no_lost_votes_sharded(self):
+        SurveyModel.objects.filter(pk=self.survey.pk).update(shards_count=8)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(self.vote, self.users))
+        self.assertEqual(
+            results.count(constants.VOTE_ACCEPTED),
+            self.voters_count
+        )
+        self.survey.fold_counter_shards()
+        self.assertEqual(self.survey.answers, {'1': self.voters_count, '2': 0})
+
+    def test_single_vote_per_user(self):
+        user = self.users[0]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(self.vote, [user] * 16))
+        self.assertEqual(results.count(constants.VOTE_ACCEPTED), 1)
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.answers, {'1': 1, '2': 0})
+
+    @override_settings(VOTE_BUFFER={'ENABLED': True, 'AUTOSTART': False})
+    def test_buffered_vote_during_flush(self):
+        user = self.users[0]
+        vote_buffer = vote_buffers.get()
+        self.assertEqual(vote_buffer.append(self.survey.pk, user.pk, '1'),
+                         constants.VOTE_ACCEPTED)
+        popped, release = threading.Event(), threading.Event()
+
+        def flush():
+            # A flush that counted the vote but did not commit yet.
+            try:
+                with transaction.atomic():
+                    apply_votes(vote_buffer.pop(10))
+                    popped.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def append():
+            try:
+                return vote_buffer.append(self.survey.pk, user.pk, '2')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            executor.submit(flush)
+            self.assertTrue(popped.wait(5))
+            appended = executor.submit(append)
+            # The append waits for the flush on the pending vote row.
+            time.sleep(0.2)
+            release.set()
+            self.assertEqual(appended.result(5),
+                             constants.VOTE_ALREADY_VOTED)
+        self.assertFalse(PendingVoteModel.objects.exists())
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.answers, {'1': 1, '2': 0})
+
+
+class VoteRollupTest(TransactionTestCase):
+    # The rollup only takes the events of committed transactions.
+
+    def setUp(self) -> None:
+        self.survey = SurveyModel.objects.create(
+            survey_question='Test survey',
+            answers={'1': 0, '2': 0},
+            finishing_date='3021-11-05T18:25:43.511Z',
+        )
+        self.users = [User.objects.create(username=f'voter_{index}')
+                      for index in range(3)]
+
+    def get_tally(self):
+        return dict(VoteTallyModel.objects.values_list('answer', 'count'))
+
+    def test_votes_are_rolled_up(self):
+        for user, answer in zip(self.users, '122'):
+            perform_survey_vote(self.survey.pk, user, answer)
+        self.assertEqual(roll_up_vote_events(batch_size=2)[0], 3)
+        self.assertEqual(roll_up_vote_events(batch_size=2)[0], 0)
+        self.assertEqual(self.get_tally(), {'1': 1, '2': 2})
+        # Rolled up events are counted from the tally only.
+        VoteEventModel.objects.all().delete()
+        self.assertEqual(find_vote_drift([self.survey.pk]), [])
+
+    def test_rollup_waits_for_open_transactions(self):
+        voted, release = threading.Event(), threading.Event()
+
+        def vote_in_open_transaction():
+            try:
+                with transaction.atomic():
+                    perform_survey_vote(self.survey.pk, self.users[0], '1')
+                    voted.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(vote_in_open_transaction)
+            self.assertTrue(voted.wait(5))
+            # Its event id is greater, but it commits first.
+            perform_survey_vote(self.survey.pk, self.users[1], '2')
+            self.assertEqual(roll_up_vote_events(batch_size=10)[0], 0)
+            self.assertEqual(find_vote_drift([self.survey.pk]), [])
+            release.set()
+            future.result()
+        self.assertEqual(roll_up_vote_events(batch_size=10)[0], 2)
+        self.assertEqual(self.get_tally(), {'1': 1, '2': 1})
+        self.assertEqual(find_vote_drift([self.survey.pk]), [])
+
+
+class BenchmarkSuiteTest(TransactionTestCase):
+
+    def test_benchmark_suite(self):
+        report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, report_dir)
+        report_path = f'{report_dir}/report.json'
+        call_command('benchmark_suite', '--users', '6', '--surveys', '2',
+                     '--requests', '8', '--threads', '3',
+                     '--host', 'testserver', '--json', report_path,
+                     stdout=StringIO())
+        with open(report_path, encoding='utf-8') as report_file:
+            report = json.load(report_file)
+        self.assertEqual(set(report['scenarios']),
+                         {'create', 'list', 'retrieve', 'vote'})
+        self.assertEqual(report['scenarios']['create']['statuses'],
+                         {'201': 8})
+        self.assertEqual(report['scenarios']['vote']['statuses'],
+                         {'204': 12})
+        self.assertEqual(report['lost_votes'],
+                         {'voters': 12, 'counted': 12, 'lost': 0})
+        self.assertGreater(report['scenarios']['list']['queries_per_request'],
+                           0)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(SurveyModel.objects.exists())
+
+
+class BenchmarkJunctionIndexesTest(TransactionTestCase):
+
+    def test_benchmark_junction_indexes(self):
+        stdout = StringIO()
+        call_command('benchmark_junction_indexes', '--users', '5',
+                     '--surveys', '3', '--rows-per-survey', '4',
+                     '--repeat', '1', stdout=stdout)
+        self.assertIn('Seeded 12 junction rows', stdout.getvalue())
+        self.assertEqual(stdout.getvalue().count('Owner check'), 2)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(SurveyModel.objects.exists())
+        self.assertFalse(UserSurveyJunctionModel.objects.exists())
@@ -1,8 +1,16 @@
+from django.urls import path
 from rest_framework import routers
 from .views import SurveyApiViewSet
+from .async_views import survey_list, survey_retrieve, survey_vote
 
 router = routers.SimpleRouter()
 router.register(r'surveys', SurveyApiViewSet, 'surveys')
 
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    path('async/surveys/', survey_list, name='async-surveys-list'),
+    path('async/surveys/<int:pk>/', survey_retrieve,
+         name='async-surveys-detail'),
+    path('async/surveys/<int:pk>/vote/', survey_vote,
+         name='async-surveys-vote'),
+]
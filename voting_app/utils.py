@@ -1,6 +1,108 @@
-from typing import Dict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 from collections import defaultdict
-from django.db import transaction
+from django.db import transaction, connection
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import (
+    Q, F, QuerySet, FilteredRelation, OuterRef, Prefetch, Subquery, Sum,
+    IntegerField, prefetch_related_objects,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from application.db_router import primary
+from . import constants
+from .result_cache import (
+    bump_survey_versions_on_commit, get_survey_version, get_cached_result,
+    set_cached_result,
+)
+from .serializers import SurveyRetrieveSerializer
+from .models import (
+    SurveyModel, AnswerOptionModel, UserSurveyJunctionModel,
+    SurveyCounterShardModel, VoteEventModel, SurveySnapshotModel,
+)
+
+# pylint: disable=protected-access
+# Has-not-voted check, junction upsert and in-place counter increment in
+# one statement. The junction INSERT only returns a row when the user has
+# not voted yet, so the counter UPDATE runs exactly once per voter, and the
+# UPDATE re-reads ``vote_count`` under the row lock, so concurrent votes are
+# never lost. Only the voted answer option row is locked, so votes for other
+# answers of the same survey do not wait on each other. Sharded surveys
+# increment one of their counter shards instead, picked by the voter id.
+# Every counted vote is also appended to the vote event log. The survey row
+# is only read: the ETag of the results carries their vote total.
+VOTE_SQL = f'''
+    WITH survey AS (
+        SELECT id,
+               shards_count,
+               NOT is_finished AND finishing_date > NOW() AS is_open,
+               EXISTS(
+                   SELECT 1 FROM {AnswerOptionModel._meta.db_table}
+                   WHERE survey_id = %(survey)s AND label = %(answer)s
+               ) AS has_answer
+        FROM {SurveyModel._meta.db_table}
+        WHERE id = %(survey)s
+    ), relation AS (
+        INSERT INTO {UserSurveyJunctionModel._meta.db_table} AS junction
+            (user_id, survey_id, is_owner, is_voted)
+        SELECT %(user)s, id, FALSE, TRUE FROM survey
+        WHERE is_open AND has_answer
+        ON CONFLICT (user_id, survey_id) DO UPDATE SET is_voted = TRUE
+        WHERE NOT junction.is_voted
+        RETURNING survey_id
+    ), event AS (
+        INSERT INTO {VoteEventModel._meta.db_table}
+            (user_id, survey_id, answer, created_at, xid)
+        SELECT %(user)s, survey_id, %(answer)s, NOW(), txid_current()
+        FROM relation
+    ), counter AS (
+        UPDATE {AnswerOptionModel._meta.db_table} AS option
+        SET vote_count = option.vote_count + 1
+        FROM relation JOIN survey ON survey.id = relation.survey_id
+        WHERE option.survey_id = relation.survey_id
+            AND option.label = %(answer)s
+            AND survey.shards_count = 0
+        RETURNING option.survey_id
+    ), shard AS (
+        INSERT INTO {SurveyCounterShardModel._meta.db_table} AS counter_shard
+            (survey_id, answer, shard, count)
+        SELECT survey.id, %(answer)s, MOD(%(user)s, survey.shards_count), 1
+        FROM relation JOIN survey ON survey.id = relation.survey_id
+        WHERE survey.shards_count > 0
+        ON CONFLICT (survey_id, answer, shard)
+        DO UPDATE SET count = counter_shard.count + 1
+        RETURNING survey_id
+    )
+    SELECT is_open,
+           has_answer,
+           EXISTS(SELECT 1 FROM counter) OR EXISTS(SELECT 1 FROM shard)
+    FROM survey
+'''
+
+# Marks a whole batch of users as voted and logs the votes of the pairs that
+# had not voted yet, which are returned.
+APPLY_VOTES_SQL = f'''
+    WITH vote AS (
+        SELECT *
+        FROM unnest(%(users)s::integer[], %(surveys)s::bigint[],
+                    %(answers)s::varchar[])
+            AS vote(user_id, survey_id, answer)
+    ), relation AS (
+        INSERT INTO {UserSurveyJunctionModel._meta.db_table} AS junction
+            (user_id, survey_id, is_owner, is_voted)
+        SELECT user_id, survey_id, FALSE, TRUE FROM vote
+        ON CONFLICT (user_id, survey_id) DO UPDATE SET is_voted = TRUE
+        WHERE NOT junction.is_voted
+        RETURNING user_id, survey_id
+    ), event AS (
+        INSERT INTO {VoteEventModel._meta.db_table}
+            (user_id, survey_id, answer, created_at, xid)
+        SELECT user_id, survey_id, vote.answer, NOW(), txid_current()
+        FROM relation JOIN vote USING (user_id, survey_id)
+    )
+    SELECT user_id, survey_id FROM relation
+'''
+# pylint: enable=protected-access
 
 
 def get_prepared_answers(answers: list) -> Dict[str, int]:
@@ -10,6 +112,133 @@ def get_prepared_answers(answers: list) -> Dict[str, int]:
     return prepared_answers
 
 
+def filter_surveys(queryset: QuerySet, filters: dict) -> QuerySet:
+    if 'is_finished' in filters:
+        queryset = queryset.filter(is_finished=filters['is_finished'])
+    if 'is_open' in filters:
+        is_open = Q(is_finished=False, finishing_date__gt=timezone.now())
+        queryset = queryset.filter(is_open if filters['is_open'] else ~is_open)
+    if 'finishing_after' in filters:
+        queryset = queryset.filter(
+            finishing_date__gte=filters['finishing_after'])
+    if 'finishing_before' in filters:
+        queryset = queryset.filter(
+            finishing_date__lt=filters['finishing_before'])
+    return queryset
+
+
+def annotate_membership(queryset: QuerySet, user) -> QuerySet:
+    """Join the caller's junction row to every survey of ``queryset``.
+
+    The surveys get ``caller_is_owner`` and ``caller_is_voted`` attributes,
+    which are ``None`` when the caller has no junction row.
+    """
+    return queryset.annotate(
+        membership=FilteredRelation('survey', condition=Q(survey__user=user)),
+        caller_is_owner=F('membership__is_owner'),
+        caller_is_voted=F('membership__is_voted'),
+    )
+
+
+def get_survey_with_membership(queryset: QuerySet, survey_id, user):
+    if not str(survey_id).isdigit():
+        return None
+    return annotate_membership(queryset, user).filter(pk=survey_id).first()
+
+
+def get_options_with_votes() -> Prefetch:
+    """Answer options with their counter shards added in the query, so
+    rendering results never folds the shards, which only happens when a
+    survey is finished."""
+    return Prefetch('options', queryset=AnswerOptionModel.objects.with_votes())
+
+
+class SurveyValidators(NamedTuple):
+    etag: str
+
+
+class SurveyResult(NamedTuple):
+    content: bytes
+    validators: SurveyValidators
+
+
+def get_validators(version: int, votes: int) -> SurveyValidators:
+    # Every counted vote adds one to the total and folding shards keeps it,
+    # so votes change the ETag without writing the survey row, whose
+    # version covers every other change.
+    return SurveyValidators(etag=f'"{version}-{votes}"')
+
+
+def get_survey_validators(survey_id) -> Optional[SurveyValidators]:
+    """Validators of the current results of a survey, read by primary key
+    without loading its answers. ``None`` if there is no survey."""
+    option_votes = AnswerOptionModel.objects.filter(
+        survey=OuterRef('pk'),
+    ).values('survey').annotate(votes=Sum('vote_count')).values('votes')
+    sharded_votes = SurveyCounterShardModel.objects.filter(
+        survey=OuterRef('pk'),
+    ).values('survey').annotate(votes=Sum('count')).values('votes')
+    row = SurveyModel.objects.filter(pk=survey_id).annotate(
+        votes=Coalesce(
+            Subquery(option_votes, output_field=IntegerField()), 0,
+        ) + Coalesce(
+            Subquery(sharded_votes, output_field=IntegerField()), 0,
+        ),
+    ).values_list('version', 'votes').first()
+    return None if row is None else get_validators(*row)
+
+
+def get_survey_instance_validators(survey: SurveyModel) -> SurveyValidators:
+    """Validators of a survey from its answer options, loaded with
+    ``get_options_with_votes()``."""
+    return get_validators(survey.version, sum(survey.answers.values()))
+
+
+def get_snapshot(survey: SurveyModel) -> Optional[SurveySnapshotModel]:
+    try:
+        return survey.snapshot
+    except SurveySnapshotModel.DoesNotExist:
+        return None
+
+
+def render_survey_result(survey: SurveyModel) -> SurveyResult:
+    """Rendered JSON of a survey loaded with ``select_related('snapshot')``,
+    from its snapshot once it is archived."""
+    snapshot = get_snapshot(survey)
+    if snapshot is not None:
+        return SurveyResult(
+            content=bytes(snapshot.content),
+            validators=get_validators(
+                survey.version, sum(votes for _, votes in snapshot.answers),
+            ),
+        )
+    prefetch_related_objects([survey], get_options_with_votes())
+    return SurveyResult(
+        content=JSONRenderer().render(SurveyRetrieveSerializer(survey).data),
+        validators=get_survey_instance_validators(survey),
+    )
+
+
+def get_survey_result(survey_id) -> Optional[SurveyResult]:
+    """Rendered JSON of a survey and its results with their validators,
+    from the result cache when it holds the current version. ``None`` if
+    there is no survey."""
+    version = get_survey_version(survey_id)
+    result = get_cached_result(survey_id, version)
+    if result is not None:
+        return result
+    # Cached under the current version, which a lagging replica may not
+    # have caught up with yet.
+    with primary():
+        survey = SurveyModel.objects.select_related('snapshot').defer(
+            'snapshot__voter_bitmap').filter(pk=survey_id).first()
+        if survey is None:
+            return None
+        result = render_survey_result(survey)
+    set_cached_result(survey_id, version, result)
+    return result
+
+
 @transaction.atomic
 def create_survey(view, serializer, user, model):
     view.perform_create(serializer)
@@ -19,10 +248,125 @@ def create_survey(view, serializer, user, model):
 
 
 @transaction.atomic
-def perform_survey_vote(survey_obj, junction_model, user):
-    survey_obj.save(update_fields=['answers'])
-    junction_model.objects.update_or_create(
-        user=user,
-        survey=survey_obj,
-        defaults={'is_voted': True}
+def bulk_create_surveys(surveys: Iterable[dict], user) -> List[SurveyModel]:
+    """Create validated ``SurveyCreateRequestSerializer`` data owned by
+    ``user`` with one INSERT each for the surveys, their answer options
+    and their owners."""
+    surveys = list(surveys)
+    created_surveys = SurveyModel.objects.bulk_create(
+        SurveyModel(
+            survey_question=survey['survey_question'],
+            finishing_date=survey['finishing_date'],
+        )
+        for survey in surveys
+    )
+    AnswerOptionModel.objects.bulk_create(
+        option
+        for created_survey, survey in zip(created_surveys, surveys)
+        for option in AnswerOptionModel.for_answers(
+            created_survey, get_prepared_answers(survey['answers']))
+    )
+    UserSurveyJunctionModel.objects.bulk_create(
+        UserSurveyJunctionModel(user=user, survey=survey, is_owner=True)
+        for survey in created_surveys
     )
+    return created_surveys
+
+
+def get_vote_result(row) -> str:
+    if row is None:
+        return constants.VOTE_SURVEY_NOT_FOUND
+    is_open, has_answer, is_counted = row
+    if not is_open:
+        return constants.VOTE_SURVEY_FINISHED
+    if not has_answer:
+        return constants.VOTE_INVALID_ANSWER
+    if not is_counted:
+        return constants.VOTE_ALREADY_VOTED
+    return constants.VOTE_ACCEPTED
+
+
+def perform_survey_vote(survey_id: int, user, voted_answer: str) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute(VOTE_SQL, {
+            'survey': survey_id,
+            'user': user.pk,
+            'answer': voted_answer,
+        })
+        result = get_vote_result(cursor.fetchone())
+    if result == constants.VOTE_ACCEPTED:
+        bump_survey_versions_on_commit([survey_id])
+    return result
+
+
+@transaction.atomic
+def apply_votes(
+        votes: Iterable[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """Count ``(user_id, survey_id, answer)`` votes in bulk.
+
+    Users that already voted are skipped, as are repeated votes of a user
+    for the same survey. Returns the votes that were counted.
+    """
+    unique_votes = {}
+    for user_id, survey_id, answer in votes:
+        unique_votes.setdefault((user_id, survey_id), answer)
+    if not unique_votes:
+        return []
+    users, surveys = zip(*unique_votes)
+    with connection.cursor() as cursor:
+        cursor.execute(APPLY_VOTES_SQL, {
+            'users': list(users),
+            'surveys': list(surveys),
+            'answers': list(unique_votes.values()),
+        })
+        counted_votes = [
+            (user_id, survey_id, unique_votes[(user_id, survey_id)])
+            for user_id, survey_id in cursor.fetchall()
+        ]
+    counts = defaultdict(lambda: defaultdict(int))
+    for _, survey_id, answer in counted_votes:
+        counts[survey_id][answer] += 1
+    if counts:
+        SurveyModel.objects.add_votes(counts)
+        bump_survey_versions_on_commit(counts)
+    return counted_votes
+
+
+def perform_batch_vote(user, votes: List[dict]) -> List[str]:
+    """Validate and count many ``{'survey', 'voted_answer'}`` votes of one
+    user at once. Returns the result of every vote, in order."""
+    answer_labels = AnswerOptionModel.objects.filter(
+        survey=OuterRef('pk'),
+    ).values('survey').annotate(labels=ArrayAgg('label')).values('labels')
+    surveys = annotate_membership(
+        SurveyModel.objects.filter(pk__in={vote['survey'] for vote in votes}),
+        user,
+    ).annotate(answer_labels=Subquery(answer_labels)).in_bulk()
+    results = []
+    accepted_votes = {}
+    for vote in votes:
+        survey = surveys.get(vote['survey'])
+        if survey is None:
+            results.append(constants.VOTE_SURVEY_NOT_FOUND)
+        elif not survey.can_vote():
+            results.append(constants.VOTE_SURVEY_FINISHED)
+        elif vote['voted_answer'] not in (survey.answer_labels or ()):
+            results.append(constants.VOTE_INVALID_ANSWER)
+        elif survey.caller_is_voted or survey.pk in accepted_votes:
+            results.append(constants.VOTE_ALREADY_VOTED)
+        else:
+            accepted_votes[survey.pk] = vote['voted_answer']
+            results.append(constants.VOTE_ACCEPTED)
+    counted_surveys = {
+        survey_id for _, survey_id, _ in apply_votes(
+            (user.pk, survey_id, answer)
+            for survey_id, answer in accepted_votes.items()
+        )
+    }
+    # Votes that lost a race with a concurrent vote of the same user.
+    return [
+        constants.VOTE_ALREADY_VOTED
+        if result == constants.VOTE_ACCEPTED
+        and vote['survey'] not in counted_surveys else result
+        for vote, result in zip(votes, results)
+    ]
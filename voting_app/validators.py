@@ -1,6 +1,20 @@
 from rest_framework import serializers
+from .constants import MAX_BATCH_VOTES, MAX_BULK_SURVEYS
 
 
 def answers_unique_validator(values_list):
     if len(values_list) != len(set(values_list)):
         raise serializers.ValidationError('The answers must be unique!')
+
+
+def max_length_validator(max_length):
+    def validator(values_list):
+        if len(values_list) > max_length:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {max_length} elements.'
+            )
+    return validator
+
+
+batch_size_validator = max_length_validator(MAX_BATCH_VOTES)
+bulk_size_validator = max_length_validator(MAX_BULK_SURVEYS)
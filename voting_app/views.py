@@ -1,21 +1,116 @@
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
-from rest_framework.exceptions import PermissionDenied
+import hashlib
+import json
+from typing import Optional
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from rest_framework.permissions import (
+    IsAuthenticated, IsAuthenticatedOrReadOnly,
+)
+from rest_framework.exceptions import (
+    PermissionDenied, NotFound, ValidationError,
+)
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import status, mixins
 from rest_framework.response import Response
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.decorators import action
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from .utils import get_prepared_answers, create_survey, perform_survey_vote
+from .utils import (
+    get_prepared_answers, create_survey, perform_survey_vote, filter_surveys,
+    get_survey_with_membership, perform_batch_vote, bulk_create_surveys,
+    get_survey_result, get_survey_validators, get_options_with_votes,
+    get_snapshot, SurveyResult, SurveyValidators,
+)
+from .exports import (
+    CONTENT_TYPES, stream_export, export_surveys, export_results,
+    export_voters,
+)
+from .live import get_results_stream_response
+from .buffer import vote_buffers, is_vote_buffer_enabled
+from .result_cache import bump_survey_versions_on_commit
 from .models import SurveyModel, UserSurveyJunctionModel
-from .permissions import HasNotVoted, IsOwner
+from .pagination import SurveyCursorPagination
+from .permissions import IsOwner
 from .serializers import (
     SurveyRetrieveSerializer, SurveyCreateSerializer,
     SurveyListSerializer, SurveyCreateRequestSerializer,
-    SurveyVotingSerializer,
+    SurveyVotingSerializer, SurveyListFilterSerializer,
+    SurveyBatchVotingSerializer, SurveyBatchVoteResultSerializer,
+    SurveyBulkCreateRequestSerializer, SurveyExportSerializer,
+    SurveyListExportSerializer,
 )
 from . import constants
 
 
+def raise_for_vote_result(result, voted_answer):
+    if result == constants.VOTE_SURVEY_NOT_FOUND:
+        raise NotFound()
+    if result == constants.VOTE_SURVEY_FINISHED:
+        raise PermissionDenied('Survey already finished!')
+    if result == constants.VOTE_INVALID_ANSWER:
+        raise ValidationError({
+            'voted_answer': [f'"{voted_answer}" is not a valid choice.']
+        })
+    if result == constants.VOTE_ALREADY_VOTED:
+        raise PermissionDenied('You already voted!')
+
+
+def set_validators(response, validators: SurveyValidators):
+    response['ETag'] = validators.etag
+    return response
+
+
+def get_not_modified_response(request, survey_id) -> Optional[HttpResponse]:
+    """304 when the client holds the current results of a survey, checked
+    with a single primary key lookup. ``None`` when it has to be sent."""
+    if 'HTTP_IF_NONE_MATCH' not in request.META:
+        return None
+    validators = get_survey_validators(survey_id)
+    if validators is None:
+        raise NotFound()
+    response = get_conditional_response(request, etag=validators.etag)
+    return None if response is None else set_validators(response, validators)
+
+
+def get_result_response(result: SurveyResult) -> HttpResponse:
+    return set_validators(
+        HttpResponse(result.content, content_type='application/json'),
+        result.validators,
+    )
+
+
+def get_page_etag(request, paginator, page) -> str:
+    """ETag of a list page from its rows, without serializing them."""
+    digest = hashlib.sha1(repr((
+        request.build_absolute_uri(),
+        paginator.has_next,
+        paginator.has_previous,
+        [(survey.pk, survey.survey_question) for survey in page],
+    )).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def retrieve_survey(request, survey_id) -> HttpResponse:
+    response = get_not_modified_response(request, survey_id)
+    if response is not None:
+        return response
+    result = get_survey_result(survey_id)
+    if result is None:
+        raise NotFound()
+    return get_result_response(result)
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only errors are rendered, the stream itself bypasses renderers.
+        return JSONRenderer().render(data)
+
+
 class SurveyApiViewSet(mixins.CreateModelMixin,
                        mixins.RetrieveModelMixin,
                        mixins.DestroyModelMixin,
@@ -27,14 +122,127 @@ class SurveyApiViewSet(mixins.CreateModelMixin,
                           constants.CREATE: SurveyCreateSerializer,
                           constants.EDIT_SURVEY: SurveyRetrieveSerializer,
                           constants.VOTE: SurveyVotingSerializer,
+                          constants.VOTE_BATCH: SurveyBatchVotingSerializer,
+                          constants.BULK_CREATE: SurveyListSerializer,
+                          constants.EXPORT: SurveyListExportSerializer,
+                          constants.EXPORT_RESULTS: SurveyListExportSerializer,
+                          constants.EXPORT_VOTERS: SurveyExportSerializer,
                           constants.DESTROY: SurveyRetrieveSerializer}
-    permission_classes = [IsAuthenticatedOrReadOnly, HasNotVoted, IsOwner]
+    permission_classes = [IsAuthenticatedOrReadOnly, IsOwner]
+    pagination_class = SurveyCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == constants.EDIT_SURVEY:
+            queryset = queryset.select_related('snapshot').defer(
+                'snapshot__voter_bitmap').prefetch_related(
+                    get_options_with_votes())
+        return queryset
 
     def get_serializer_class(self):
         view_action = self.action
         self.serializer_class = self.serializer_classes.get(view_action)
         return self.serializer_class
 
+    @cached_property
+    def survey_with_membership(self):
+        return get_survey_with_membership(
+            self.get_queryset(),
+            self.kwargs[self.lookup_field],
+            self.request.user,
+        )
+
+    def get_object(self):
+        if self.action not in [constants.EDIT_SURVEY, constants.DESTROY,
+                               constants.EXPORT_VOTERS]:
+            return super().get_object()
+        # Already loaded for the IsOwner check, together with the
+        # caller's membership.
+        instance = self.survey_with_membership
+        if instance is None:
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in [constants.LIST, constants.EXPORT,
+                               constants.EXPORT_RESULTS]:
+            return queryset
+        filter_serializer = SurveyListFilterSerializer(
+            data=self.request.query_params.dict()
+        )
+        filter_serializer.is_valid(raise_exception=True)
+        return filter_surveys(queryset, filter_serializer.validated_data)
+
+    @swagger_auto_schema(query_serializer=SurveyListFilterSerializer)
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        etag = get_page_etag(request, self.paginator, page)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        response['ETag'] = etag
+        return response
+
+    def stream_export(self, export, filename):
+        export_serializer = self.get_serializer(
+            data=self.request.query_params.dict()
+        )
+        export_serializer.is_valid(raise_exception=True)
+        export_format = export_serializer.validated_data['export_format']
+        response = StreamingHttpResponse(
+            stream_export(export, export_format),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}.{export_format}"'
+        )
+        return response
+
+    @swagger_auto_schema(
+        query_serializer=SurveyListExportSerializer,
+        responses={status.HTTP_200_OK: openapi.Response('Survey rows')},
+    )
+    @action(methods=['get'], detail=False, url_path='export',
+            pagination_class=None,
+            permission_classes=[IsAuthenticated, IsOwner])
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.stream_export(
+            export_surveys(queryset, constants.EXPORT_CHUNK_SIZE),
+            'surveys',
+        )
+
+    @swagger_auto_schema(
+        query_serializer=SurveyListExportSerializer,
+        responses={status.HTTP_200_OK: openapi.Response('Answer rows')},
+    )
+    @action(methods=['get'], detail=False, url_path='export-results',
+            pagination_class=None,
+            permission_classes=[IsAuthenticated, IsOwner])
+    def export_results(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.stream_export(
+            export_results(queryset, constants.EXPORT_CHUNK_SIZE),
+            'results',
+        )
+
+    @swagger_auto_schema(
+        query_serializer=SurveyExportSerializer,
+        responses={status.HTTP_200_OK: openapi.Response('Voter rows')},
+    )
+    @action(methods=['get'], detail=True, url_path='export-voters',
+            permission_classes=[IsAuthenticated, IsOwner])
+    def export_voters(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.stream_export(
+            export_voters(instance, constants.EXPORT_CHUNK_SIZE),
+            f'survey-{instance.pk}-voters',
+        )
+
     @swagger_auto_schema(
         request_body=SurveyCreateRequestSerializer,
         responses={status.HTTP_201_CREATED: SurveyCreateSerializer}
@@ -59,35 +267,116 @@ class SurveyApiViewSet(mixins.CreateModelMixin,
             status=status.HTTP_201_CREATED,
         )
 
+    def retrieve(self, request, *args, **kwargs):
+        survey_id = self.kwargs[self.lookup_field]
+        if not survey_id.isdigit():
+            raise NotFound()
+        if request.accepted_renderer.format == 'json':
+            return retrieve_survey(request, survey_id)
+        # The browsable API renders the same cached result.
+        response = get_not_modified_response(request, survey_id)
+        if response is not None:
+            return response
+        result = get_survey_result(survey_id)
+        if result is None:
+            raise NotFound()
+        return set_validators(Response(json.loads(result.content)),
+                              result.validators)
+
+    def perform_destroy(self, instance):
+        bump_survey_versions_on_commit([instance.pk])
+        instance.delete()
+
+    @swagger_auto_schema(
+        request_body=SurveyBulkCreateRequestSerializer,
+        responses={status.HTTP_201_CREATED: SurveyListSerializer(many=True)}
+    )
+    @action(methods=['post'], detail=False, url_path='bulk-create')
+    def bulk_create(self, request, *args, **kwargs):
+        request_serializer = SurveyBulkCreateRequestSerializer(
+            data=request.data
+        )
+        request_serializer.is_valid(raise_exception=True)
+        surveys = bulk_create_surveys(
+            surveys=request_serializer.validated_data['surveys'],
+            user=request.user,
+        )
+        response_serializer = self.get_serializer(surveys, many=True)
+        return Response(
+            response_serializer.data,
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(methods=['patch'], detail=True, url_path='edit-survey')
     def edit_survey(self, request, *args, **kwargs):
         instance = self.get_object()
+        # Snapshots are taken before the voters move to the archive.
+        if get_snapshot(instance) is not None:
+            raise PermissionDenied('Survey is archived!')
         serializer = self.get_serializer(
             instance,
             data=request.data,
             partial=True,
         )
         serializer.is_valid(raise_exception=True)
+        # Like finish_survey, finishing folds the counter shards.
+        if (instance.shards_count and not instance.is_finished
+                and serializer.validated_data.get('is_finished')):
+            instance.fold_counter_shards()
         serializer.save()
+        bump_survey_versions_on_commit([instance.pk])
         return Response(serializer.data)
 
+    @swagger_auto_schema(
+        responses={status.HTTP_200_OK: openapi.Response(
+            'Server-Sent Events with the survey results')},
+    )
+    @action(methods=['get'], detail=True,
+            renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def stream(self, request, *args, **kwargs):
+        survey_id = self.kwargs[self.lookup_field]
+        if not survey_id.isdigit() or get_survey_result(survey_id) is None:
+            raise NotFound()
+        return get_results_stream_response(request, int(survey_id))
+
     @action(methods=['patch'], detail=True)
     def vote(self, request, *args, **kwargs):
-        survey_obj = self.get_object()
-        if not survey_obj.can_vote():
-            raise PermissionDenied('Survey already finished!')
-        answers = survey_obj.answers
-        request_serializer = self.get_serializer(
-            data=request.data,
-            choices_from_db=answers.keys(),
-        )
+        survey_id = self.kwargs[self.lookup_field]
+        if not survey_id.isdigit():
+            raise NotFound()
+        request_serializer = self.get_serializer(data=request.data)
         request_serializer.is_valid(raise_exception=True)
         voted_answer = request_serializer.validated_data['voted_answer']
-        answers[voted_answer] += 1
-        survey_obj.answers = answers
-        perform_survey_vote(
-            survey_obj=survey_obj,
-            junction_model=UserSurveyJunctionModel,
+        if is_vote_buffer_enabled():
+            result = vote_buffers.get().append(
+                survey_id=int(survey_id),
+                user_id=request.user.pk,
+                answer=voted_answer,
+            )
+            raise_for_vote_result(result, voted_answer)
+            return Response({}, status=status.HTTP_202_ACCEPTED, )
+        result = perform_survey_vote(
+            survey_id=int(survey_id),
             user=request.user,
+            voted_answer=voted_answer,
         )
+        raise_for_vote_result(result, voted_answer)
         return Response({}, status=status.HTTP_204_NO_CONTENT, )
+
+    @swagger_auto_schema(
+        request_body=SurveyBatchVotingSerializer,
+        responses={
+            status.HTTP_200_OK: SurveyBatchVoteResultSerializer(many=True)
+        }
+    )
+    @action(methods=['post'], detail=False, url_path='vote-batch')
+    def vote_batch(self, request, *args, **kwargs):
+        request_serializer = self.get_serializer(data=request.data)
+        request_serializer.is_valid(raise_exception=True)
+        votes = request_serializer.validated_data['votes']
+        results = perform_batch_vote(user=request.user, votes=votes)
+        response_serializer = SurveyBatchVoteResultSerializer(
+            [{**vote, 'status': result} for vote, result in zip(votes, results)],
+            many=True,
+        )
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,228 @@
+import logging
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from .models import (
+    SurveyModel, AnswerOptionModel, SurveyCounterShardModel, VoteEventModel,
+    VoteTallyModel, VoteRollupCheckpointModel,
+)
+from .periodic import PeriodicThread
+from .result_cache import bump_survey_versions_on_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'INTERVAL': 10.0,
+    'BATCH_SIZE': 10000,
+}
+
+ROLLUP_CHECKPOINT = 'vote_tally'
+
+# pylint: disable=protected-access
+CHECKPOINT_SQL = f'''
+    INSERT INTO {VoteRollupCheckpointModel._meta.db_table}
+        (name, last_xid, last_event_id, updated_at)
+    VALUES (%(name)s, 0, 0, NOW())
+    ON CONFLICT (name) DO NOTHING
+'''
+
+# Folds the events after the high-water mark into the tally and moves the
+# mark past them. Event ids are handed out before the voting transaction
+# commits, so events are taken in (xid, id) order and only from
+# transactions older than the snapshot's xmin. Every one of those has
+# committed or rolled back, so no event can show up behind the mark later.
+ROLLUP_SQL = f'''
+    WITH checkpoint AS (
+        SELECT last_xid, last_event_id
+        FROM {VoteRollupCheckpointModel._meta.db_table}
+        WHERE name = %(name)s
+        FOR UPDATE
+    ), batch AS (
+        SELECT event.id, event.xid, event.survey_id, event.answer
+        FROM {VoteEventModel._meta.db_table} AS event, checkpoint
+        WHERE (event.xid, event.id)
+                > (checkpoint.last_xid, checkpoint.last_event_id)
+            AND event.xid < txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY event.xid, event.id
+        LIMIT %(limit)s
+    ), tally AS (
+        INSERT INTO {VoteTallyModel._meta.db_table} AS tally
+            (survey_id, answer, count)
+        SELECT survey_id, answer, COUNT(*) FROM batch
+        GROUP BY survey_id, answer
+        ON CONFLICT (survey_id, answer)
+        DO UPDATE SET count = tally.count + EXCLUDED.count
+    ), mark AS (
+        UPDATE {VoteRollupCheckpointModel._meta.db_table}
+        SET (last_xid, last_event_id) = (
+                SELECT xid, id FROM batch ORDER BY xid DESC, id DESC LIMIT 1
+            ),
+            updated_at = NOW()
+        WHERE name = %(name)s AND EXISTS(SELECT 1 FROM batch)
+    )
+    SELECT COUNT(*) FROM batch
+'''
+
+# Answer counters, shards included, that do not add up to the vote log:
+# its rolled-up tally plus the events after the high-water mark.
+DRIFT_SQL = f'''
+    SELECT option.id,
+           option.survey_id,
+           option.label,
+           option.vote_count + COALESCE(sharded.votes, 0) AS stored,
+           COALESCE(logged.votes, 0) AS logged,
+           COALESCE(sharded.votes, 0) AS sharded
+    FROM {AnswerOptionModel._meta.db_table} AS option
+    LEFT JOIN (
+        SELECT survey_id, answer, SUM(count) AS votes
+        FROM {SurveyCounterShardModel._meta.db_table}
+        WHERE survey_id = ANY(%(surveys)s)
+        GROUP BY survey_id, answer
+    ) AS sharded
+        ON sharded.survey_id = option.survey_id
+        AND sharded.answer = option.label
+    LEFT JOIN (
+        SELECT survey_id, answer, SUM(votes) AS votes
+        FROM (
+            SELECT survey_id, answer, count AS votes
+            FROM {VoteTallyModel._meta.db_table}
+            WHERE survey_id = ANY(%(surveys)s)
+            UNION ALL
+            SELECT event.survey_id, event.answer, 1
+            FROM {VoteEventModel._meta.db_table} AS event
+            LEFT JOIN {VoteRollupCheckpointModel._meta.db_table} AS checkpoint
+                ON checkpoint.name = %(name)s
+            WHERE event.survey_id = ANY(%(surveys)s)
+                AND (event.xid, event.id) > (
+                    COALESCE(checkpoint.last_xid, 0),
+                    COALESCE(checkpoint.last_event_id, 0)
+                )
+        ) AS counted
+        GROUP BY survey_id, answer
+    ) AS logged
+        ON logged.survey_id = option.survey_id
+        AND logged.answer = option.label
+    WHERE option.survey_id = ANY(%(surveys)s)
+        AND option.vote_count + COALESCE(sharded.votes, 0)
+            <> COALESCE(logged.votes, 0)
+'''
+
+LOCK_OPTIONS_SQL = f'''
+    SELECT id FROM {AnswerOptionModel._meta.db_table}
+    WHERE survey_id = ANY(%(surveys)s)
+    ORDER BY id
+    FOR UPDATE
+'''
+
+FIX_DRIFT_SQL = f'''
+    UPDATE {AnswerOptionModel._meta.db_table} AS target
+    SET vote_count = GREATEST(drift.logged - drift.sharded, 0)
+    FROM ({DRIFT_SQL}) AS drift
+    WHERE target.id = drift.id
+    RETURNING drift.survey_id, drift.label, drift.stored, drift.logged
+'''
+# pylint: enable=protected-access
+
+# (survey_id, answer, stored votes, logged votes)
+Drift = Tuple[int, str, int, int]
+
+
+def get_rollup_settings() -> dict:
+    return {**DEFAULTS, **getattr(settings, 'VOTE_ROLLUP', {})}
+
+
+@transaction.atomic
+def roll_up_vote_events_batch(batch_size: int) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(CHECKPOINT_SQL, {'name': ROLLUP_CHECKPOINT})
+        cursor.execute(ROLLUP_SQL, {
+            'name': ROLLUP_CHECKPOINT,
+            'limit': batch_size,
+        })
+        return cursor.fetchone()[0]
+
+
+def roll_up_vote_events(batch_size: int) -> Tuple[int, float]:
+    """Fold every committed vote event into the tally, ``batch_size``
+    events per transaction.
+
+    Returns how many events were rolled up and how long it took.
+    """
+    started = time.perf_counter()
+    rolled_up_count = 0
+    while True:
+        rolled_up = roll_up_vote_events_batch(batch_size)
+        rolled_up_count += rolled_up
+        if rolled_up < batch_size:
+            return rolled_up_count, time.perf_counter() - started
+
+
+def roll_up():
+    rollup_settings = get_rollup_settings()
+    rolled_up_count, elapsed = roll_up_vote_events(
+        rollup_settings['BATCH_SIZE'],
+    )
+    if rolled_up_count:
+        logger.info('Rolled up %d vote events in %.3fs',
+                    rolled_up_count, elapsed)
+
+
+def start_rollup() -> PeriodicThread:
+    rollup = PeriodicThread(
+        roll_up,
+        get_rollup_settings()['INTERVAL'],
+        name='vote-event-rollup',
+    )
+    rollup.start()
+    return rollup
+
+
+def iter_survey_chunks(chunk_size: int,
+                       survey_ids: Optional[Iterable[int]] = None,
+                       ) -> Iterator[List[int]]:
+    """Yield ``survey_ids``, or the ids of every survey, in chunks."""
+    if survey_ids is not None:
+        survey_ids = sorted(set(survey_ids))
+        for start in range(0, len(survey_ids), chunk_size):
+            yield survey_ids[start:start + chunk_size]
+        return
+    last_id = 0
+    while True:
+        chunk = list(
+            SurveyModel.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]
+
+
+def find_vote_drift(survey_ids: List[int]) -> List[Drift]:
+    with connection.cursor() as cursor:
+        cursor.execute(DRIFT_SQL, {'surveys': survey_ids,
+                                   'name': ROLLUP_CHECKPOINT})
+        return sorted(row[1:5] for row in cursor.fetchall())
+
+
+@transaction.atomic
+def fix_vote_drift(survey_ids: List[int]) -> List[Drift]:
+    """Reset the answer counters of ``survey_ids`` to the vote log.
+
+    Shards are folded and the counters locked first, so votes cast while
+    fixing are neither lost nor counted twice. Returns the drift found.
+    """
+    SurveyModel.objects.fold_counter_shards(survey_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(LOCK_OPTIONS_SQL, {'surveys': survey_ids})
+        cursor.execute(FIX_DRIFT_SQL, {'surveys': survey_ids,
+                                       'name': ROLLUP_CHECKPOINT})
+        drift = sorted(cursor.fetchall())
+    drifted_ids = {survey_id for survey_id, *_ in drift}
+    if drifted_ids:
+        SurveyModel.objects.bump_versions(drifted_ids)
+    bump_survey_versions_on_commit(drifted_ids)
+    return drift